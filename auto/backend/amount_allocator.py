@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - USDT 唯一金額分配
+Unique Amount Allocator for 4D Tech Style Auto Sponsorship System
+
+同一網絡的所有訂單付款到同一個收款地址，只能按金額區分訂單。
+分配器為每個未完成訂單在應付金額後加上代幣精度內的微小尾數，
+使同一網絡上任意兩個未完成訂單的應付金額都不相同。
+
+主要功能:
+- 從隨機位置開始探測尾數，減少多個 worker 同時下單時的衝突
+- 金額 -> 訂單索引，鏈上轉賬按金額 O(1) 找到訂單
+- 訂單取消、過期或完成後釋放尾數
+- 本地索引只是提示，跨 worker 的唯一性由存儲保證
+  （usdt_orders 上未完成訂單的 (network, open_amount) 唯一索引）
+"""
+
+import random
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Iterator, Optional
+
+class AmountAllocator:
+    """按網絡分配唯一應付金額"""
+
+    def __init__(self, decimals: int = 6, slots: int = 1000):
+        """
+        decimals: 代幣精度，尾數單位為 10^-decimals
+        slots: 每個基礎金額可用的尾數數量（0 ~ slots-1 個單位）
+        """
+        self.unit = Decimal(1).scaleb(-decimals)
+        self.slots = slots
+        self._index: Dict[str, Dict[Decimal, Optional[str]]] = {}
+
+        # 統計信息
+        self.allocations = 0
+        self.collisions = 0
+        self.exhausted = 0
+
+    def candidates(self, network: str, base_amount: Decimal) -> Iterator[Decimal]:
+        """依次給出可嘗試的應付金額：先試本地未佔用的，再試本地記錄為佔用的
+        （本地記錄可能已過時，例如訂單已在其他 worker 上取消，最終由存儲判斷）"""
+        taken = self._index.get(network, {})
+        start = random.randrange(self.slots)
+        amounts = [base_amount + ((start + offset) % self.slots) * self.unit for offset in range(self.slots)]
+        stale = []
+        for amount in amounts:
+            if amount in taken:
+                stale.append(amount)
+            else:
+                yield amount
+        yield from stale
+        self.exhausted += 1
+
+    def reserve(self, network: str, amount: Decimal, order_id: str):
+        self._index.setdefault(network, {})[Decimal(amount)] = order_id
+        self.allocations += 1
+
+    def collided(self, network: str, amount: Decimal):
+        """候選金額已被其他 worker 佔用；記下以免再次嘗試（訂單號未知，下次 sync 時補全）"""
+        self._index.setdefault(network, {}).setdefault(Decimal(amount), None)
+        self.collisions += 1
+
+    def release(self, network: str, amount: Decimal):
+        self._index.get(network, {}).pop(Decimal(amount), None)
+
+    def lookup(self, network: str, amount: Decimal) -> Optional[str]:
+        """按金額找到未完成的訂單"""
+        return self._index.get(network, {}).get(amount)
+
+    def sync(self, network: str, orders: Iterable[Dict[str, Any]]):
+        """用存儲中的未完成訂單重建索引（包括其他 worker 創建的訂單）"""
+        self._index[network] = {Decimal(order['total_amount']): order['order_id'] for order in orders}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取統計信息"""
+        return {
+            'open_amounts': {network: len(index) for network, index in self._index.items()},
+            'slots': self.slots,
+            'allocations': self.allocations,
+            'collisions': self.collisions,
+            'exhausted': self.exhausted
+        }
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 鏈上掃描基準測試
+Chain Scanner Benchmark for 4D Tech Style Auto Sponsorship System
+
+在本地模擬鏈上離線運行完整的 USDT 付款流程:
+1. 創建 N 個待付款訂單（只有少數幾種套餐金額，靠唯一尾數區分）
+2. 模擬鏈上對每個訂單付款（外加若干筆無法匹配的轉賬）
+3. 一輪掃描匹配所有轉賬 -> processing
+4. 出塊直到確認數足夠，再掃描一輪 -> completed
+
+檢查每個訂單的最終狀態和狀態變更推送次數，並輸出每輪掃描耗時。
+結果不符時以非零狀態退出。
+
+用法:
+    cd backend
+    python benchmarks/bench_chain_scanner.py --orders 1000 --packages 5 --network trc20
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(BACKEND_DIR)
+
+from usdt_service import USDTPaymentService  # noqa: E402
+
+async def run(args) -> int:
+    service = USDTPaymentService(simulated=True)
+    pushed = []
+
+    async def on_status_change(order):
+        pushed.append((order['order_id'], order['status']))
+
+    # 手動驅動掃描，不啟動後台任務
+    service.start_watchers(interval=3600, on_status_change=on_status_change)
+    watcher = service.watchers[args.network]
+    await watcher.stop()
+    chain = service.simulated_chains[args.network]
+
+    orders = []
+    for i in range(args.orders):
+        result = await service.create_payment_order(amount=10 * (1 + i % args.packages), network=args.network)
+        if not result['success']:
+            print(f"創建訂單失敗: {result['error']}")
+            return 1
+        orders.append(result['order'])
+
+    for order in orders:
+        chain.send(order['total_amount'])
+    for i in range(args.unmatched):
+        chain.send(1 + i / 1000)
+
+    started = time.perf_counter()
+    await watcher.scan_once()
+    match_ms = (time.perf_counter() - started) * 1000
+
+    chain.mine(watcher.required_confirmations)
+    started = time.perf_counter()
+    await watcher.scan_once()
+    confirm_ms = (time.perf_counter() - started) * 1000
+
+    statuses = [(await service.check_payment_status(order['order_id']))['status'] for order in orders]
+    completed = statuses.count('completed')
+
+    print(f"網絡 {args.network}，訂單 {args.orders}，套餐金額 {args.packages} 種，無法匹配的轉賬 {args.unmatched}")
+    print(f"匹配輪耗時   {match_ms:>10.1f}ms")
+    print(f"確認輪耗時   {confirm_ms:>10.1f}ms")
+    print(f"已完成訂單   {completed:>10}/{args.orders}")
+    print(f"狀態推送     {len(pushed):>10}")
+    print(f"掃描統計     {watcher.get_stats()}")
+    print(f"金額分配     {service.allocator.get_stats()}")
+
+    ok = (completed == args.orders
+          and len(pushed) == 2 * args.orders
+          and watcher.unmatched == args.unmatched)
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='鏈上掃描基準測試')
+    parser.add_argument('--orders', type=int, default=1000)
+    parser.add_argument('--packages', type=int, default=5, help='不同套餐金額的數量')
+    parser.add_argument('--unmatched', type=int, default=10)
+    parser.add_argument('--network', choices=['erc20', 'trc20'], default='trc20')
+    sys.exit(asyncio.run(run(parser.parse_args())))
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 訂單過期調度基準測試
+Expiry Scheduler Benchmark for 4D Tech Style Auto Sponsorship System
+
+1. 登記 N 個過期時間隨機分佈在 span 秒內的訂單
+2. 按刻度推進時間輪直到全部到期，按批次交給處理函數
+
+檢查每個訂單恰好觸發一次且不早於過期時間，輸出載入耗時、
+時間輪條目內存和推進耗時。結果不符時以非零狀態退出。
+
+用法:
+    cd backend
+    python benchmarks/bench_expiry_scheduler.py --orders 1000000 --span 7200
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from expiry_scheduler import ExpiryScheduler  # noqa: E402
+
+def run(args) -> int:
+    fired = bytearray(args.orders)
+    early = 0
+    deadlines = []
+
+    def handler(batch):
+        nonlocal early
+        for item_id in batch:
+            fired[item_id] += 1
+            if scheduler.wheel.now_tick < deadlines[item_id]:
+                early += 1
+        return len(batch)
+
+    scheduler = ExpiryScheduler('bench', handler, tick_seconds=1.0, batch_size=args.batch_size)
+    start = time.time()
+
+    started = time.perf_counter()
+    for item_id in range(args.orders):
+        expires_at = start + random.uniform(0, args.span)
+        deadlines.append(scheduler._tick(expires_at))
+        scheduler.schedule(item_id, datetime.fromtimestamp(expires_at))
+    load_s = time.perf_counter() - started
+    memory_mb = scheduler.wheel.memory_bytes() / 1024 / 1024
+
+    started = time.perf_counter()
+    for second in range(0, int(args.span) + 2, args.step):
+        scheduler.fire_due(start + second)
+    advance_s = time.perf_counter() - started
+
+    missing = sum(1 for count in fired if count == 0)
+    duplicated = sum(1 for count in fired if count > 1)
+
+    print(f"訂單 {args.orders}，過期時間分佈 {args.span}s，每次推進 {args.step}s")
+    print(f"載入耗時     {load_s:>10.2f}s")
+    print(f"條目內存     {memory_mb:>10.1f}MB")
+    print(f"推進耗時     {advance_s:>10.2f}s")
+    print(f"未觸發       {missing:>10}")
+    print(f"重複觸發     {duplicated:>10}")
+    print(f"提前觸發     {early:>10}")
+
+    return 0 if missing == duplicated == early == 0 else 1
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='訂單過期調度基準測試')
+    parser.add_argument('--orders', type=int, default=1000000)
+    parser.add_argument('--span', type=float, default=7200, help='過期時間分佈範圍（秒）')
+    parser.add_argument('--step', type=int, default=1, help='每次推進的秒數')
+    parser.add_argument('--batch-size', type=int, default=500)
+    sys.exit(run(parser.parse_args()))
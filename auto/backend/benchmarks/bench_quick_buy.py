@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 速買性能基準測試
+Quick-Buy Benchmark for 4D Tech Style Auto Sponsorship System
+
+比較舊版多次往返的速買流程與單一事務的速買流程:
+- p50 / p99 延遲
+- 每秒訂單數
+
+注意: 會寫入訂單並修改庫存和餘額，請只在測試資料庫上執行。
+
+用法:
+    cd backend
+    python benchmarks/bench_quick_buy.py --orders 2000 --concurrency 50 --user-id 2 --item-id 1
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import secrets
+import statistics
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(BACKEND_DIR)
+os.makedirs('logs', exist_ok=True)
+
+import main  # noqa: E402
+
+async def legacy_quick_buy(user_id: int, item_id: int, amount: int, payment_method: str):
+    """舊版速買流程（逐條語句，無共享事務），僅用於對比"""
+    database = main.db_manager.database
+    order_id = f"QB{datetime.now().strftime('%Y%m%d%H%M%S')}{secrets.randbelow(1000):03d}"
+
+    item = await database.fetch_one(
+        "SELECT * FROM items WHERE id = :item_id AND is_active = 1", {"item_id": item_id}
+    )
+    user = await database.fetch_one(
+        "SELECT * FROM users WHERE id = :user_id AND is_active = 1", {"user_id": user_id}
+    )
+    if not item or item['stock'] < amount:
+        raise RuntimeError("庫存不足")
+
+    total_price = item['price'] * amount
+    if payment_method == "balance" and user['balance'] < total_price:
+        raise RuntimeError("餘額不足")
+
+    await database.execute(
+        """
+        INSERT INTO orders (order_id, user_id, item_id, amount, total_price,
+                            payment_method, status, is_quick_buy, created_at)
+        VALUES (:order_id, :user_id, :item_id, :amount, :total_price,
+                :payment_method, 'processing', 1, :created_at)
+        """,
+        {"order_id": order_id, "user_id": user_id, "item_id": item_id, "amount": amount,
+         "total_price": total_price, "payment_method": payment_method,
+         "created_at": datetime.utcnow()}
+    )
+    await database.execute(
+        "UPDATE items SET stock = stock - :amount WHERE id = :item_id",
+        {"amount": amount, "item_id": item_id}
+    )
+    if payment_method == "balance":
+        await database.execute(
+            "UPDATE users SET balance = balance - :amount WHERE id = :user_id",
+            {"amount": total_price, "user_id": user_id}
+        )
+    await database.execute(
+        """
+        UPDATE users SET total_orders = total_orders + 1,
+            total_spent = total_spent + :total_price,
+            quick_buy_success = quick_buy_success + 1
+        WHERE id = :user_id
+        """,
+        {"total_price": total_price, "user_id": user_id}
+    )
+    existing = await database.fetch_one(
+        "SELECT id FROM quick_buy_stats WHERE user_id = :user_id AND item_id = :item_id",
+        {"user_id": user_id, "item_id": item_id}
+    )
+    if existing:
+        await database.execute(
+            """
+            UPDATE quick_buy_stats SET success_count = success_count + 1,
+                total_amount = total_amount + :amount, total_spent = total_spent + :total_spent
+            WHERE user_id = :user_id AND item_id = :item_id
+            """,
+            {"amount": amount, "total_spent": total_price, "user_id": user_id, "item_id": item_id}
+        )
+    else:
+        await database.execute(
+            """
+            INSERT INTO quick_buy_stats (user_id, item_id, success_count, total_amount, total_spent)
+            VALUES (:user_id, :item_id, 1, :amount, :total_spent)
+            """,
+            {"amount": amount, "total_spent": total_price, "user_id": user_id, "item_id": item_id}
+        )
+    await database.execute(
+        "UPDATE orders SET status = 'completed', completed_at = :completed_at WHERE order_id = :order_id",
+        {"order_id": order_id, "completed_at": datetime.utcnow()}
+    )
+    await database.execute(
+        """
+        INSERT INTO activity_logs (user_id, action, description, created_at)
+        VALUES (:user_id, 'quick_buy', :description, :created_at)
+        """,
+        {"user_id": user_id, "description": f"速買成功: {item['name']} x{amount}",
+         "created_at": datetime.utcnow()}
+    )
+
+async def atomic_quick_buy(user_id: int, item_id: int, amount: int, payment_method: str):
+    """當前速買流程"""
+    await main.quick_buy_manager.process_quick_buy(user_id, item_id, amount, payment_method)
+
+async def run_scenario(name: str, func, args) -> dict:
+    """並發執行指定流程並統計延遲"""
+    latencies = []
+    failures = 0
+    queue = asyncio.Queue()
+    for _ in range(args.orders):
+        queue.put_nowait(None)
+
+    async def worker():
+        nonlocal failures
+        while True:
+            try:
+                queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            started = time.perf_counter()
+            try:
+                await func(args.user_id, args.item_id, args.amount, args.payment_method)
+                latencies.append(time.perf_counter() - started)
+            except Exception:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'name': name,
+        'orders': len(latencies),
+        'failures': failures,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else 0,
+        'p99_ms': latencies[int(len(latencies) * 0.99) - 1] * 1000 if latencies else 0,
+        'orders_per_second': len(latencies) / elapsed if elapsed else 0
+    }
+
+async def prepare(args):
+    """補足測試所需的庫存和餘額"""
+    database = main.db_manager.database
+    await database.execute(
+        "UPDATE items SET stock = stock + :stock WHERE id = :item_id",
+        {"stock": args.orders * args.amount * 2, "item_id": args.item_id}
+    )
+    await database.execute(
+        "UPDATE users SET balance = balance + 100000000 WHERE id = :user_id",
+        {"user_id": args.user_id}
+    )
+
+async def main_async(args):
+    main.settings.SKIP_DB = False
+    main.settings.DEBUG = False
+    await main.db_manager.connect()
+    try:
+        await prepare(args)
+
+        scenarios = []
+        if args.mode in ('legacy', 'both'):
+            scenarios.append(('legacy', legacy_quick_buy))
+        if args.mode in ('atomic', 'both'):
+            scenarios.append(('atomic', atomic_quick_buy))
+
+        print(f"{'流程':<10}{'成功':>8}{'失敗':>8}{'p50(ms)':>12}{'p99(ms)':>12}{'訂單/秒':>12}")
+        for name, func in scenarios:
+            result = await run_scenario(name, func, args)
+            print(
+                f"{result['name']:<10}{result['orders']:>8}{result['failures']:>8}"
+                f"{result['p50_ms']:>12.2f}{result['p99_ms']:>12.2f}{result['orders_per_second']:>12.1f}"
+            )
+    finally:
+        await main.db_manager.disconnect()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='速買性能基準測試')
+    parser.add_argument('--orders', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--user-id', type=int, default=2)
+    parser.add_argument('--item-id', type=int, default=1)
+    parser.add_argument('--amount', type=int, default=1)
+    parser.add_argument('--payment-method', default='balance')
+    parser.add_argument('--mode', choices=['legacy', 'atomic', 'both'], default='both')
+    asyncio.run(main_async(parser.parse_args()))
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 序列化基準測試
+Serialization Benchmark for 4D Tech Style Auto Sponsorship System
+
+比較商品列表、訂單列表和 WebSocket 消息的序列化耗時:
+- 默認路徑: 構造響應模型 -> jsonable_encoder -> json.dumps（FastAPI 返回模型列表時的處理）
+- 快速路徑: 預編譯序列化器 / orjson
+
+使用模擬的資料庫行（Decimal 價格、datetime 時間），不需要連接資料庫。
+
+用法:
+    cd backend
+    python benchmarks/bench_serialization.py --rows 100 --iterations 2000
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+from decimal import Decimal
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(BACKEND_DIR)
+os.makedirs('logs', exist_ok=True)
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+import main  # noqa: E402
+import fast_json  # noqa: E402
+
+def item_rows(count: int):
+    now = datetime(2024, 6, 1, 12, 0, 0, 123456)
+    return [
+        {
+            "id": i, "name": f"商品 {i}", "description": "4D科技風格贊助商品" * 3,
+            "price": Decimal("199.99") + i, "stock": 1000 - i, "category": "digital",
+            "image": f"/assets/items/{i}.png", "is_active": True, "is_quick_buy": i % 2 == 0,
+            "created_at": now - timedelta(minutes=i), "updated_at": now
+        }
+        for i in range(count)
+    ]
+
+def order_rows(count: int):
+    now = datetime(2024, 6, 1, 12, 0, 0, 123456)
+    return [
+        {
+            "id": i, "order_id": f"QB{i:013d}", "user_id": 2, "item_id": i % 20,
+            "amount": 1 + i % 3, "total_price": Decimal("599.97"), "payment_method": "balance",
+            "status": "completed", "is_quick_buy": True, "created_at": now - timedelta(seconds=i),
+            "completed_at": now, "notes": None
+        }
+        for i in range(count)
+    ]
+
+def default_path(model, rows) -> bytes:
+    """FastAPI 默認: 模型列表 -> jsonable_encoder -> Starlette JSONResponse.render"""
+    content = jsonable_encoder([model(**row) for row in rows])
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def status_message(index: int) -> dict:
+    return {
+        "type": "system_status",
+        "payload": {
+            "status": "online",
+            "stats": {"online_users": 10000, "today_orders": index, "system_load": "正常",
+                      "last_updated": datetime.utcnow().isoformat()}
+        }
+    }
+
+def measure(func, iterations: int) -> dict:
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1_000_000)
+    samples.sort()
+    return {
+        'p50_us': statistics.median(samples),
+        'p99_us': samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+    }
+
+def main_bench(args):
+    items = item_rows(args.rows)
+    orders = order_rows(args.rows)
+    message = status_message(1)
+
+    # 兩條路徑輸出的數據必須一致
+    assert json.loads(default_path(main.ItemResponse, items)) == json.loads(main.item_serializer.dump_many(items))
+    assert json.loads(default_path(main.OrderResponse, orders)) == json.loads(main.order_serializer.dump_many(orders))
+
+    cases = [
+        ("items 默認", lambda: default_path(main.ItemResponse, items)),
+        ("items 快速", lambda: main.item_serializer.dump_many(items)),
+        ("orders 默認", lambda: default_path(main.OrderResponse, orders)),
+        ("orders 快速", lambda: main.order_serializer.dump_many(orders)),
+        ("ws 默認", lambda: json.dumps(message)),
+        ("ws 快速", lambda: fast_json.dumps_str(message)),
+    ]
+
+    print(f"行數 {args.rows}, 迭代 {args.iterations}, orjson {'已啟用' if fast_json.orjson else '未安裝'}")
+    print(f"{'場景':<14}{'p50(us)':>12}{'p99(us)':>12}")
+    for name, func in cases:
+        result = measure(func, args.iterations)
+        print(f"{name:<14}{result['p50_us']:>12.1f}{result['p99_us']:>12.1f}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='序列化基準測試')
+    parser.add_argument('--rows', type=int, default=100)
+    parser.add_argument('--iterations', type=int, default=2000)
+    main_bench(parser.parse_args())
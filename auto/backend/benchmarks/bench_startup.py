@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 啟動時間基準測試
+Startup Benchmark for 4D Tech Style Auto Sponsorship System
+
+在全新的解釋器中多次測量兩個應用的:
+- 導入耗時（import main / import main_app）
+- 啟動耗時（main: 導入 + 執行 lifespan 啟動；main_app: 導入 + 第一個健康檢查請求）
+
+可設置時間預算，超出時以非零狀態退出，用於在 CI 中發現啟動回歸。
+--importtime 會列出導入最慢的模組。
+
+main 使用開發模式（SKIP_DB）啟動，不需要資料庫。
+
+用法:
+    cd backend
+    python benchmarks/bench_startup.py --runs 5 --budget-import-ms 3000 --budget-boot-ms 5000
+"""
+
+import os
+import re
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 在子進程中執行，輸出一行 JSON
+CHILD_SCRIPTS = {
+    'main': """
+import os, sys, time, json, asyncio
+os.makedirs('logs', exist_ok=True)
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def boot():
+    async with main.app.router.lifespan_context(main.app):
+        return time.perf_counter()
+
+booted = asyncio.run(boot())
+print(json.dumps({'import_ms': (imported - started) * 1000, 'boot_ms': (booted - started) * 1000}))
+""",
+    'main_app': """
+import os, sys, time, json
+os.makedirs('logs', exist_ok=True)
+started = time.perf_counter()
+import main_app
+imported = time.perf_counter()
+main_app.create_directories()
+main_app.app.test_client().get('/api/health')
+booted = time.perf_counter()
+print(json.dumps({'import_ms': (imported - started) * 1000, 'boot_ms': (booted - started) * 1000}))
+""",
+}
+
+def run_child(app: str, importtime: bool = False) -> subprocess.CompletedProcess:
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    command += ['-c', CHILD_SCRIPTS[app]]
+    env = dict(os.environ, PROVIDER_WARMUP='False')
+    return subprocess.run(command, cwd=BACKEND_DIR, env=env, capture_output=True, text=True, timeout=300)
+
+def measure(app: str, runs: int) -> dict:
+    samples = []
+    for _ in range(runs):
+        result = run_child(app)
+        if result.returncode != 0:
+            return {'error': result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'unknown'}
+        samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return {
+        'import_ms': statistics.median(sample['import_ms'] for sample in samples),
+        'boot_ms': statistics.median(sample['boot_ms'] for sample in samples),
+        'max_boot_ms': max(sample['boot_ms'] for sample in samples)
+    }
+
+def slowest_imports(app: str, top: int):
+    """解析 -X importtime 輸出，返回累計耗時最長的模組"""
+    result = run_child(app, importtime=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|\s+(.*)$', line)
+        if match:
+            rows.append((int(match.group(2)), match.group(3).strip()))
+    # 只看頂層導入（縮進最少），避免父子模組重複計算
+    top_level = [(cumulative, name) for cumulative, name in rows if not name.startswith('  ')]
+    return sorted(top_level, reverse=True)[:top]
+
+def main_bench(args) -> int:
+    print(f"運行次數 {args.runs}（取中位數）")
+    print(f"{'應用':<10}{'導入(ms)':>12}{'啟動(ms)':>12}{'最慢啟動(ms)':>14}")
+
+    over_budget = False
+    for app in args.apps:
+        result = measure(app, args.runs)
+        if 'error' in result:
+            print(f"{app:<10} 啟動失敗: {result['error']}")
+            over_budget = True
+            continue
+
+        print(f"{app:<10}{result['import_ms']:>12.1f}{result['boot_ms']:>12.1f}{result['max_boot_ms']:>14.1f}")
+        if args.budget_import_ms and result['import_ms'] > args.budget_import_ms:
+            print(f"  超出導入預算 {args.budget_import_ms}ms")
+            over_budget = True
+        if args.budget_boot_ms and result['boot_ms'] > args.budget_boot_ms:
+            print(f"  超出啟動預算 {args.budget_boot_ms}ms")
+            over_budget = True
+
+        if args.importtime:
+            for cumulative_us, name in slowest_imports(app, args.importtime):
+                print(f"    {cumulative_us / 1000:>10.1f}ms  {name}")
+
+    return 1 if over_budget else 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='啟動時間基準測試')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--apps', nargs='+', choices=list(CHILD_SCRIPTS), default=list(CHILD_SCRIPTS))
+    parser.add_argument('--budget-import-ms', type=float, default=0, help='導入耗時預算，0 表示不檢查')
+    parser.add_argument('--budget-boot-ms', type=float, default=0, help='啟動耗時預算，0 表示不檢查')
+    parser.add_argument('--importtime', type=int, default=0, metavar='N', help='列出導入最慢的 N 個模組')
+    sys.exit(main_bench(parser.parse_args()))
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - WebSocket 扇出基準測試
+WebSocket Fan-out Benchmark for 4D Tech Style Auto Sponsorship System
+
+使用模擬連接比較舊版逐個發送的廣播與扇出引擎:
+- broadcast() 調用返回所需時間
+- 所有正常客戶端收到消息所需時間
+- 慢客戶端的處理情況
+
+不需要資料庫或網絡，可直接執行。
+
+用法:
+    cd backend
+    python benchmarks/bench_ws_fanout.py --connections 10000 --slow-ratio 0.01 --slow-delay 0.05
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from ws_fanout import ConnectionManager  # noqa: E402
+
+# 斷開慢客戶端的警告會刷屏，只保留錯誤
+logging.basicConfig(level=logging.ERROR)
+
+class FakeWebSocket:
+    """模擬的 WebSocket 連接"""
+
+    def __init__(self, delay: float, done: asyncio.Event, counter: dict):
+        self.delay = delay
+        self.done = done
+        self.counter = counter
+        self.received = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, payload: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        else:
+            # 模擬寫入 socket 緩衝區的讓出點
+            await asyncio.sleep(0)
+        self.received += 1
+        # 正常客戶端收到最後一條消息即視為送達
+        if not self.delay and self.counter['final_marker'] in payload.replace(' ', ''):
+            self.counter['fast_received'] += 1
+            if self.counter['fast_received'] >= self.counter['fast_expected']:
+                self.done.set()
+
+    async def close(self, code: int = 1000, reason: str = ''):
+        pass
+
+class LegacyConnectionManager:
+    """舊版廣播：逐個連接序列化並等待發送"""
+
+    def __init__(self):
+        self.active_connections = {}
+
+    async def broadcast(self, message: dict):
+        for user_id, connection in self.active_connections.items():
+            try:
+                await connection.send_text(json.dumps(message))
+            except Exception:
+                pass
+
+def build_sockets(args, done: asyncio.Event, counter: dict):
+    rng = random.Random(args.seed)
+    sockets = []
+    for _ in range(args.connections):
+        slow = rng.random() < args.slow_ratio
+        sockets.append(FakeWebSocket(args.slow_delay if slow else 0, done, counter))
+    counter['fast_expected'] = sum(1 for socket in sockets if not socket.delay)
+    # 舊版與扇出引擎的 JSON 分隔符不同，比較時去掉空格
+    counter['final_marker'] = f'"today_orders":{args.messages - 1},'
+    return sockets
+
+def sample_message(index: int) -> dict:
+    return {
+        "type": "system_status",
+        "payload": {
+            "status": "online",
+            "stats": {"online_users": 10000, "today_orders": index, "system_load": "正常"}
+        }
+    }
+
+async def run_legacy(args) -> dict:
+    done, counter = asyncio.Event(), {'fast_received': 0}
+    manager = LegacyConnectionManager()
+    for user_id, socket in enumerate(build_sockets(args, done, counter)):
+        manager.active_connections[user_id] = socket
+
+    started = time.perf_counter()
+    call_ms = 0.0
+    for index in range(args.messages):
+        call_started = time.perf_counter()
+        await manager.broadcast(sample_message(index))
+        call_ms = max(call_ms, (time.perf_counter() - call_started) * 1000)
+        await asyncio.sleep(args.interval)
+    delivered_ms = (time.perf_counter() - started) * 1000
+
+    return {'name': 'legacy', 'broadcast_ms': call_ms, 'delivered_ms': delivered_ms, 'slow_dropped': 0}
+
+async def run_fanout(args) -> dict:
+    done, counter = asyncio.Event(), {'fast_received': 0}
+    manager = ConnectionManager(
+        queue_size=args.queue_size,
+        send_timeout=args.send_timeout,
+        coalesce_types=() if args.no_coalesce else ('system_status',)
+    )
+    for user_id, socket in enumerate(build_sockets(args, done, counter)):
+        await manager.connect(socket, user_id)
+
+    started = time.perf_counter()
+    call_ms = 0.0
+    for index in range(args.messages):
+        call_started = time.perf_counter()
+        await manager.broadcast(sample_message(index))
+        call_ms = max(call_ms, (time.perf_counter() - call_started) * 1000)
+        await asyncio.sleep(args.interval)
+    try:
+        await asyncio.wait_for(done.wait(), timeout=args.send_timeout * args.messages + 10)
+    except asyncio.TimeoutError:
+        print(f"警告: 只有 {counter['fast_received']}/{counter['fast_expected']} 個正常客戶端收到最後一條消息")
+    delivered_ms = (time.perf_counter() - started) * 1000
+
+    stats = manager.get_stats()
+    await manager.close_all()
+    return {
+        'name': 'fanout',
+        'broadcast_ms': call_ms,
+        'delivered_ms': delivered_ms,
+        'slow_dropped': stats['slow_consumers'],
+        'coalesced': stats['coalesced']
+    }
+
+async def main_async(args):
+    print(
+        f"連接數 {args.connections}, 慢客戶端比例 {args.slow_ratio:.2%}, "
+        f"慢客戶端延遲 {args.slow_delay * 1000:.0f}ms, 消息數 {args.messages}"
+    )
+    print(f"{'引擎':<10}{'broadcast(ms)':>16}{'全部送達(ms)':>16}{'斷開慢客戶端':>14}")
+
+    results = []
+    if args.mode in ('legacy', 'both'):
+        results.append(await run_legacy(args))
+    if args.mode in ('fanout', 'both'):
+        results.append(await run_fanout(args))
+
+    for result in results:
+        print(
+            f"{result['name']:<10}{result['broadcast_ms']:>16.2f}"
+            f"{result['delivered_ms']:>16.2f}{result['slow_dropped']:>14}"
+        )
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='WebSocket 扇出基準測試')
+    parser.add_argument('--connections', type=int, default=10000)
+    parser.add_argument('--messages', type=int, default=5)
+    parser.add_argument('--interval', type=float, default=0.0, help='兩次廣播之間的間隔（秒）')
+    parser.add_argument('--slow-ratio', type=float, default=0.01)
+    parser.add_argument('--slow-delay', type=float, default=0.05)
+    parser.add_argument('--queue-size', type=int, default=100)
+    parser.add_argument('--send-timeout', type=float, default=5.0)
+    parser.add_argument('--no-coalesce', action='store_true')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--mode', choices=['legacy', 'fanout', 'both'], default='both')
+    asyncio.run(main_async(parser.parse_args()))
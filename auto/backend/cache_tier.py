@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 緩存層
+Cache Tier for 4D Tech Style Auto Sponsorship System
+
+主要功能:
+- 統一的異步緩存接口（字符串鍵值）
+- 有界列表（最新在前的環形緩衝區）
+- 進程內 TTL/LRU 後端（未部署 Redis 時的默認選擇）
+- Redis 後端（redis 套件的 asyncio 客戶端，多 worker 共享）
+- 按配置選擇後端
+"""
+
+import logging
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+from ttl_cache import TTLCache
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # 未安裝 redis 時只能使用進程內後端
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+class CacheBackend:
+    """緩存後端接口"""
+
+    name = 'base'
+
+    async def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    async def get_list(self, key: str) -> Optional[List[str]]:
+        """讀取有界列表（最新在前），不存在時返回 None"""
+        raise NotImplementedError
+
+    async def set_list(self, key: str, values: List[str], maxlen: int, ttl: Optional[float] = None):
+        """整體寫入有界列表（values 最新在前）"""
+        raise NotImplementedError
+
+    async def push_list(self, key: str, value: str, maxlen: int, ttl: Optional[float] = None) -> bool:
+        """在列表已存在時加入最新一條並截斷，返回是否寫入"""
+        raise NotImplementedError
+
+    async def ping(self) -> bool:
+        return True
+
+    async def purge_expired(self) -> int:
+        """清理已過期的條目，返回清理數量"""
+        return 0
+
+    async def close(self):
+        pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'backend': self.name}
+
+class MemoryCacheBackend(CacheBackend):
+    """進程內後端（每個 worker 各自一份）"""
+
+    name = 'memory'
+
+    def __init__(self, maxsize: int = 10000, default_ttl: float = 300):
+        self.cache = TTLCache(maxsize=maxsize, ttl=default_ttl, name='cache_tier')
+
+    async def get(self, key: str) -> Optional[str]:
+        return self.cache.get(key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        self.cache.set(key, value, ttl)
+
+    async def delete(self, key: str):
+        self.cache.invalidate(key)
+
+    async def get_list(self, key: str) -> Optional[List[str]]:
+        values = self.cache.get(key)
+        return list(values) if values is not None else None
+
+    async def set_list(self, key: str, values: List[str], maxlen: int, ttl: Optional[float] = None):
+        self.cache.set(key, deque(values[:maxlen], maxlen=maxlen), ttl)
+
+    async def push_list(self, key: str, value: str, maxlen: int, ttl: Optional[float] = None) -> bool:
+        values = self.cache.get(key)
+        if values is None:
+            return False
+        values.appendleft(value)
+        self.cache.set(key, values, ttl)
+        return True
+
+    async def purge_expired(self) -> int:
+        return self.cache.purge_expired()
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = self.cache.get_stats()
+        stats['backend'] = self.name
+        return stats
+
+class RedisCacheBackend(CacheBackend):
+    """Redis 後端（過期由 Redis 自行處理）"""
+
+    name = 'redis'
+
+    def __init__(self, url: str, default_ttl: float = 300):
+        if aioredis is None:
+            raise RuntimeError("Redis 緩存需要安裝 redis 套件")
+        self.url = url
+        self.default_ttl = default_ttl
+        self.client = aioredis.from_url(url, encoding='utf-8', decode_responses=True)
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self.client.get(key)
+
+    async def set(self, key: str, value: str, ttl: Optional[float] = None):
+        await self.client.set(key, value, ex=int(self.default_ttl if ttl is None else ttl))
+
+    async def delete(self, key: str):
+        await self.client.delete(key)
+
+    async def get_list(self, key: str) -> Optional[List[str]]:
+        async with self.client.pipeline(transaction=False) as pipe:
+            exists, values = await pipe.exists(key).lrange(key, 0, -1).execute()
+        return values if exists else None
+
+    async def set_list(self, key: str, values: List[str], maxlen: int, ttl: Optional[float] = None):
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            # Redis 不保存空列表，空結果不緩存，下次讀取重新載入
+            if values:
+                pipe.rpush(key, *values[:maxlen])
+                pipe.expire(key, int(self.default_ttl if ttl is None else ttl))
+            await pipe.execute()
+
+    async def push_list(self, key: str, value: str, maxlen: int, ttl: Optional[float] = None) -> bool:
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.lpushx(key, value)
+            pipe.ltrim(key, 0, maxlen - 1)
+            pipe.expire(key, int(self.default_ttl if ttl is None else ttl))
+            length, _, _ = await pipe.execute()
+        return bool(length)
+
+    async def ping(self) -> bool:
+        return await self.client.ping()
+
+    async def close(self):
+        await self.client.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {'backend': self.name, 'url': self.url}
+
+def create_cache(backend: str,
+                 redis_url: str = None,
+                 maxsize: int = 10000,
+                 default_ttl: float = 300) -> CacheBackend:
+    """按配置創建緩存後端: memory 或 redis"""
+    if backend == 'redis':
+        return RedisCacheBackend(redis_url, default_ttl=default_ttl)
+    if backend != 'memory':
+        raise ValueError(f"不支持的緩存後端: {backend}")
+    return MemoryCacheBackend(maxsize=maxsize, default_ttl=default_ttl)
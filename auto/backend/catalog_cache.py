@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 商品目錄緩存
+Item Catalog Cache for 4D Tech Style Auto Sponsorship System
+
+主要功能:
+- 進程內商品目錄快照（帶版本號）
+- 預序列化的商品JSON，列表由緩存片段直接拼接
+- ETag 由響應內容的哈希生成（多個 worker、重啟後內容相同則 ETag 相同，內容不同則必然不同）
+- 按商品失效，下次讀取時只重新載入受影響的行
+- 失效經發布/訂閱廣播到所有 worker；快照超過 max_age 後整體重新載入（消息丟失或進程內後端時兜底）
+"""
+
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text, bindparam
+
+from pubsub import PubSubBackend
+
+logger = logging.getLogger(__name__)
+
+# 發布/訂閱頻道，消息格式 "{來源進程}:{商品ID,...}"，商品ID為 * 時重新載入整個目錄
+INVALIDATION_CHANNEL = 'catalog:invalidate'
+
+def payload_etag(payload: bytes) -> str:
+    """按響應內容生成弱 ETag"""
+    return f'W/"{hashlib.blake2b(payload, digest_size=16).hexdigest()}"'
+
+class CatalogEntry:
+    """單個商品的緩存條目"""
+
+    __slots__ = ('row', 'payload', 'etag', 'version')
+
+    def __init__(self, row: Dict[str, Any], payload: bytes, version: int):
+        self.row = row
+        self.payload = payload
+        self.etag = payload_etag(payload)
+        self.version = version
+
+class ItemCatalog:
+    """商品目錄快照（單事件循環使用）"""
+
+    def __init__(self,
+                 session_factory: Callable,
+                 serializer: Callable[[Dict[str, Any]], bytes],
+                 pubsub: Optional[PubSubBackend] = None,
+                 max_age: float = 30):
+        self.session_factory = session_factory
+        self.serializer = serializer
+        self.pubsub = pubsub
+        self.max_age = max_age
+        self.entries: Dict[int, CatalogEntry] = {}
+        self.version = 0
+        self.loaded = False
+        self.loaded_at = 0.0
+
+        self._origin = uuid.uuid4().hex[:12]
+        if pubsub is not None:
+            pubsub.add_channel_handler(INVALIDATION_CHANNEL, self._on_message)
+
+        self._ordered: List[CatalogEntry] = []
+        self._quick_buy: Optional[Tuple[bytes, str]] = None
+        self._dirty: set = set()
+        self._lock = asyncio.Lock()
+
+        # 統計信息
+        self.hits = 0
+        self.reloads = 0
+        self.not_modified = 0
+        self.remote_invalidations = 0
+
+    def invalidate(self, item_ids: Iterable[int]):
+        """標記商品已變更，下次讀取時重新載入，並通知其他 worker"""
+        item_ids = list(item_ids)
+        self._dirty.update(item_ids)
+        self._broadcast(','.join(str(item_id) for item_id in item_ids))
+
+    def invalidate_all(self):
+        """下次讀取時重新載入整個目錄，並通知其他 worker"""
+        self.loaded = False
+        self._broadcast('*')
+
+    def _broadcast(self, item_ids: str):
+        if self.pubsub is None or not item_ids:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # 不在事件循環中（腳本），由 max_age 兜底
+        loop.create_task(self._publish(f"{self._origin}:{item_ids}"))
+
+    async def _publish(self, data: str):
+        try:
+            await self.pubsub.publish(INVALIDATION_CHANNEL, data)
+        except Exception as e:
+            logger.error(f"廣播商品目錄失效失敗: {e}")
+
+    def _on_message(self, channel: str, data: str):
+        origin, item_ids = data.split(':', 1)
+        if origin == self._origin:
+            return
+        self.remote_invalidations += 1
+        if item_ids == '*':
+            self.loaded = False
+        else:
+            self._dirty.update(int(item_id) for item_id in item_ids.split(','))
+
+    async def _ensure_fresh(self):
+        """按需載入目錄或刷新已失效的商品"""
+        if self.loaded and time.monotonic() - self.loaded_at > self.max_age:
+            self.loaded = False
+
+        if self.loaded and not self._dirty:
+            self.hits += 1
+            return
+
+        async with self._lock:
+            if not self.loaded:
+                self._dirty.clear()
+                rows = await self._fetch(None)
+                self.version += 1
+                self.entries = {
+                    row['id']: CatalogEntry(row, self.serializer(row), self.version) for row in rows
+                }
+                self.loaded = True
+                self.loaded_at = time.monotonic()
+                self._rebuild()
+                logger.info(f"商品目錄已載入: {len(self.entries)} 個商品 (版本 {self.version})")
+                return
+
+            if self._dirty:
+                item_ids = list(self._dirty)
+                self._dirty.clear()
+                rows = {row['id']: row for row in await self._fetch(item_ids)}
+
+                self.version += 1
+                for item_id in item_ids:
+                    row = rows.get(item_id)
+                    if row is None:
+                        # 已下架或刪除
+                        self.entries.pop(item_id, None)
+                    else:
+                        self.entries[item_id] = CatalogEntry(row, self.serializer(row), self.version)
+                self.reloads += 1
+                self._rebuild()
+
+    async def _fetch(self, item_ids: Optional[List[int]]) -> List[Dict[str, Any]]:
+        """從資料庫讀取上架商品"""
+        query = "SELECT * FROM items WHERE is_active = 1"
+        params = {}
+        if item_ids is not None:
+            query += " AND id IN :item_ids"
+            params["item_ids"] = item_ids
+
+        stmt = text(query)
+        if item_ids is not None:
+            stmt = stmt.bindparams(bindparam('item_ids', expanding=True))
+
+        async with self.session_factory() as session:
+            result = await session.execute(stmt, params)
+            return [dict(row) for row in result.mappings().all()]
+
+    def _rebuild(self):
+        """重建排序列表並丟棄已拼接的列表JSON"""
+        self._ordered = sorted(
+            self.entries.values(),
+            key=lambda entry: (entry.row['created_at'], entry.row['id']),
+            reverse=True
+        )
+        self._quick_buy = None
+
+    @staticmethod
+    def _join(entries: Iterable[CatalogEntry]) -> bytes:
+        return b'[' + b','.join(entry.payload for entry in entries) + b']'
+
+    async def get_page(self,
+                       skip: int = 0,
+                       limit: int = 100,
+                       after: Optional[Tuple[datetime, int]] = None) -> Tuple[bytes, List[Dict[str, Any]], str]:
+        """按 (created_at, id) 倒序分頁，返回 JSON、本頁原始行和 ETag"""
+        await self._ensure_fresh()
+
+        entries = self._ordered
+        if after is not None:
+            entries = [entry for entry in entries if (entry.row['created_at'], entry.row['id']) < after]
+        else:
+            entries = entries[skip:]
+        page = entries[:limit]
+
+        payload = self._join(page)
+        return payload, [entry.row for entry in page], payload_etag(payload)
+
+    async def get_quick_buy(self) -> Tuple[bytes, str]:
+        """獲取速買商品列表JSON和ETag"""
+        await self._ensure_fresh()
+
+        if self._quick_buy is None:
+            payload = self._join(entry for entry in self._ordered if entry.row['is_quick_buy'])
+            self._quick_buy = (payload, payload_etag(payload))
+        return self._quick_buy
+
+    async def get_item(self, item_id: int) -> Optional[Tuple[bytes, str]]:
+        """獲取單個商品JSON和ETag，不存在時返回 None"""
+        await self._ensure_fresh()
+
+        entry = self.entries.get(item_id)
+        if entry is None:
+            return None
+        return entry.payload, entry.etag
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取統計信息"""
+        return {
+            'loaded': self.loaded,
+            'items': len(self.entries),
+            'version': self.version,
+            'dirty': len(self._dirty),
+            'remote_invalidations': self.remote_invalidations,
+            'hits': self.hits,
+            'reloads': self.reloads,
+            'not_modified': self.not_modified
+        }
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 鏈上轉賬掃描
+Chain Scanner for 4D Tech Style Auto Sponsorship System
+
+主要功能:
+- 每個網絡一個後台掃描器，每輪只拉取一次收款地址的新 Transfer 事件
+- 一輪內的所有事件與所有待付款訂單一起匹配（按唯一應付金額）
+- 按 confirmation_blocks 跟蹤確認數，足夠後標記訂單完成
+- 狀態變更回調（用於 WebSocket 推送）
+- 本地模擬鏈，離線測試完整流程
+
+狀態查詢只讀訂單存儲，不再訪問區塊鏈。多個 worker 同時掃描時，
+訂單狀態通過條件更新轉換，只有一個 worker 會觸發通知。
+"""
+
+import time
+import asyncio
+import logging
+import secrets
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from provider_http import ProviderHTTPClient
+
+logger = logging.getLogger(__name__)
+
+# ERC-20 Transfer(address,address,uint256) 事件簽名
+TRANSFER_TOPIC = '0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef'
+
+class TransferEvent(NamedTuple):
+    tx_hash: str
+    amount: Decimal
+    block_number: int
+
+class ChainSource:
+    """鏈上數據源：每次 poll 返回 (最新區塊, 上次 poll 之後的新轉入)"""
+
+    async def poll(self) -> Tuple[int, List[TransferEvent]]:
+        raise NotImplementedError
+
+class Web3TransferSource(ChainSource):
+    """通過 eth_getLogs 拉取 ERC-20 合約轉入收款地址的 Transfer 事件"""
+
+    def __init__(self, client_factory: Callable[[], Any], contract_address: str,
+                 wallet_address: str, decimals: int, lookback_blocks: int, max_range: int = 2000):
+        self.client_factory = client_factory
+        self.contract_address = contract_address
+        self.to_topic = '0x' + wallet_address.lower().replace('0x', '').rjust(64, '0')
+        self.scale = Decimal(10) ** decimals
+        self.lookback_blocks = lookback_blocks
+        self.max_range = max_range
+        self.next_block: Optional[int] = None
+
+    async def poll(self) -> Tuple[int, List[TransferEvent]]:
+        return await asyncio.to_thread(self._poll)
+
+    def _poll(self) -> Tuple[int, List[TransferEvent]]:
+        from web3 import Web3
+
+        web3 = self.client_factory()
+        latest = web3.eth.block_number
+        if self.next_block is None:
+            self.next_block = max(0, latest - self.lookback_blocks)
+
+        events = []
+        contract = Web3.to_checksum_address(self.contract_address)
+        while self.next_block <= latest:
+            to_block = min(latest, self.next_block + self.max_range - 1)
+            logs = web3.eth.get_logs({
+                'fromBlock': self.next_block,
+                'toBlock': to_block,
+                'address': contract,
+                'topics': [TRANSFER_TOPIC, None, self.to_topic]
+            })
+            for log in logs:
+                data = log['data']
+                value = int.from_bytes(data, 'big') if isinstance(data, (bytes, bytearray)) else int(data, 16)
+                tx_hash = log['transactionHash']
+                tx_hash = tx_hash.hex() if isinstance(tx_hash, (bytes, bytearray)) else tx_hash
+                events.append(TransferEvent(
+                    '0x' + tx_hash.replace('0x', ''), Decimal(value) / self.scale, log['blockNumber']
+                ))
+            self.next_block = to_block + 1
+
+        return latest, events
+
+class TronGridTransferSource(ChainSource):
+    """通過 TronGrid 拉取 TRC-20 合約轉入收款地址的記錄"""
+
+    def __init__(self, api_url: str, contract_address: str, wallet_address: str,
+                 decimals: int, lookback_seconds: int, timeout: int = 10):
+        self.http = ProviderHTTPClient(name='trongrid', base_url=api_url.rstrip('/'),
+                                       timeout=timeout, deadline=timeout * 3)
+        self.contract_address = contract_address
+        self.wallet_address = wallet_address
+        self.scale = Decimal(10) ** decimals
+        self.min_timestamp = int((time.time() - lookback_seconds) * 1000)
+        # TronGrid 轉賬記錄不含區塊號，只為新交易查詢一次
+        self._blocks: Dict[str, int] = {}
+
+    async def poll(self) -> Tuple[int, List[TransferEvent]]:
+        now_block = (await self.http.request('POST', '/wallet/getnowblock')).json()
+        latest = now_block['block_header']['raw_data']['number']
+
+        events = []
+        params = {
+            'only_to': 'true',
+            'contract_address': self.contract_address,
+            'min_timestamp': self.min_timestamp,
+            'order_by': 'block_timestamp,asc',
+            'limit': 200
+        }
+        url = f"/v1/accounts/{self.wallet_address}/transactions/trc20"
+        while True:
+            page = (await self.http.request('GET', url, params=params)).json()
+            for transfer in page.get('data', []):
+                tx_hash = transfer['transaction_id']
+                if tx_hash not in self._blocks:
+                    info = (await self.http.request(
+                        'POST', '/wallet/gettransactioninfobyid', json={'value': tx_hash}
+                    )).json()
+                    if 'blockNumber' not in info:
+                        continue  # 尚未上鏈，下一輪再查
+                    self._blocks[tx_hash] = info['blockNumber']
+                    events.append(TransferEvent(
+                        tx_hash, Decimal(transfer['value']) / self.scale, self._blocks[tx_hash]
+                    ))
+                self.min_timestamp = max(self.min_timestamp, transfer['block_timestamp'])
+
+            fingerprint = page.get('meta', {}).get('fingerprint')
+            if not fingerprint:
+                break
+            params['fingerprint'] = fingerprint
+
+        return latest, events
+
+class SimulatedChain(ChainSource):
+    """本地模擬鏈：send() 產生一筆轉入並出塊，mine() 繼續出塊"""
+
+    def __init__(self, start_block: int = 1):
+        self.block_number = start_block
+        self._unseen: List[TransferEvent] = []
+
+    def mine(self, blocks: int = 1) -> int:
+        self.block_number += blocks
+        return self.block_number
+
+    def send(self, amount, tx_hash: Optional[str] = None) -> str:
+        """模擬一筆轉入收款地址的交易（打包在下一個區塊）"""
+        tx_hash = tx_hash or '0x' + secrets.token_hex(32)
+        self.mine()
+        self._unseen.append(TransferEvent(tx_hash, Decimal(str(amount)), self.block_number))
+        return tx_hash
+
+    async def poll(self) -> Tuple[int, List[TransferEvent]]:
+        events, self._unseen = self._unseen, []
+        return self.block_number, events
+
+class ChainWatcher:
+    """單個網絡的掃描器：拉取轉入、匹配訂單、更新確認數"""
+
+    def __init__(self,
+                 network: str,
+                 source: ChainSource,
+                 store,
+                 allocator,
+                 required_confirmations: int,
+                 interval: float,
+                 on_status_change: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None):
+        self.network = network
+        self.source = source
+        self.store = store
+        self.allocator = allocator
+        self.required_confirmations = required_confirmations
+        self.interval = interval
+        self.on_status_change = on_status_change
+        self._task: Optional[asyncio.Task] = None
+
+        # 統計信息
+        self.latest_block = 0
+        self.cycles = 0
+        self.events_seen = 0
+        self.matched = 0
+        self.unmatched = 0
+        self.completed = 0
+        self.errors = 0
+        self.last_cycle_ms = 0.0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.scan_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"掃描 {self.network} 轉賬失敗: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def scan_once(self):
+        """一輪掃描：一次拉取、一次讀取待處理訂單、批量匹配"""
+        started = time.perf_counter()
+        latest, events = await self.source.poll()
+        self.latest_block = latest
+        self.events_seen += len(events)
+
+        orders = await self.store.open_orders(self.network)
+        processing = [order for order in orders if order['tx_hash']]
+        claimed = {order['tx_hash'] for order in processing}
+
+        # 未完成訂單的應付金額唯一，重建金額索引後每筆轉賬 O(1) 找到訂單
+        self.allocator.sync(self.network, orders)
+        by_id = {order['order_id']: order for order in orders}
+
+        for event in events:
+            if event.tx_hash in claimed:
+                continue
+            order = by_id.get(self.allocator.lookup(self.network, event.amount))
+            if order is None or order['tx_hash']:
+                self.unmatched += 1
+                logger.warning(f"{self.network} 轉賬 {event.tx_hash} ({event.amount} USDT) 沒有對應的訂單")
+                continue
+
+            fields = {'tx_hash': event.tx_hash, 'tx_block': event.block_number, 'confirmations': 0}
+            if await self.store.transition(order['order_id'], 'processing', ('pending',), **fields):
+                self.matched += 1
+                claimed.add(event.tx_hash)
+                order.update(fields, status='processing')
+                processing.append(order)
+                await self._notify(order)
+
+        for order in processing:
+            await self._update_confirmations(order, latest)
+
+        self.cycles += 1
+        self.last_cycle_ms = (time.perf_counter() - started) * 1000
+
+    async def _update_confirmations(self, order: Dict[str, Any], latest: int):
+        confirmations = max(0, latest - order['tx_block'] + 1)
+        if confirmations >= self.required_confirmations:
+            if await self.store.transition(order['order_id'], 'completed', ('processing',),
+                                           confirmations=confirmations):
+                self.completed += 1
+                self.allocator.release(self.network, order['total_amount'])
+                order.update(status='completed', confirmations=confirmations)
+                await self._notify(order)
+        elif confirmations != order['confirmations']:
+            await self.store.transition(order['order_id'], 'processing', ('processing',),
+                                        confirmations=confirmations)
+
+    async def _notify(self, order: Dict[str, Any]):
+        if self.on_status_change is None:
+            return
+        try:
+            await self.on_status_change(order)
+        except Exception as e:
+            logger.error(f"推送訂單 {order['order_id']} 狀態失敗: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取統計信息"""
+        return {
+            'network': self.network,
+            'running': self._task is not None,
+            'latest_block': self.latest_block,
+            'cycles': self.cycles,
+            'events_seen': self.events_seen,
+            'matched': self.matched,
+            'unmatched': self.unmatched,
+            'completed': self.completed,
+            'errors': self.errors,
+            'last_cycle_ms': round(self.last_cycle_ms, 2)
+        }
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 每日訂單計數器
+Daily Order Counters for 4D Tech Style Auto Sponsorship System
+
+主要功能:
+- 訂單創建時在內存中累加當日計數（速買訂單創建即完成，同時計入完成數）
+- 定期把增量合併到 daily_order_counters 匯總表
+- O(1) 讀取當日計數（已持久化總數 + 本進程未回寫增量）
+- 從既有訂單一次性回填
+
+日期按 UTC 計算，與 orders.created_at（utcnow）一致。
+本服務中訂單只在速買時創建且創建即完成，沒有之後再轉為完成的路徑；
+如果新增這類路徑，需要在狀態變更處累加 ORDERS_COMPLETED。
+
+回填用法:
+    cd backend
+    python daily_counters.py --backfill [--since 2024-01-01]
+"""
+
+import time
+import logging
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Callable, Dict, Any, Optional, Tuple
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+ORDERS_CREATED = 'orders_created'
+ORDERS_COMPLETED = 'orders_completed'
+QUICK_BUY_ORDERS = 'quick_buy_orders'
+
+# 增量合併
+UPSERT_SQL = """
+    INSERT INTO daily_order_counters (stat_date, counter, value)
+    VALUES (:stat_date, :counter, :value)
+    ON DUPLICATE KEY UPDATE value = value + VALUES(value)
+"""
+
+# 回填：按日重算並覆蓋（使用索引範圍條件，不對列套用函數過濾）
+BACKFILL_SQL = """
+    INSERT INTO daily_order_counters (stat_date, counter, value)
+    SELECT stat_date, counter, value FROM (
+        SELECT DATE(created_at) AS stat_date, 'orders_created' AS counter, COUNT(*) AS value
+        FROM orders WHERE created_at >= :since GROUP BY DATE(created_at)
+        UNION ALL
+        SELECT DATE(completed_at), 'orders_completed', COUNT(*)
+        FROM orders WHERE status = 'completed' AND completed_at >= :since GROUP BY DATE(completed_at)
+        UNION ALL
+        SELECT DATE(created_at), 'quick_buy_orders', COUNT(*)
+        FROM orders WHERE is_quick_buy = 1 AND created_at >= :since GROUP BY DATE(created_at)
+    ) AS daily
+    ON DUPLICATE KEY UPDATE value = VALUES(value)
+"""
+
+class DailyCounters:
+    """每日計數器（單事件循環使用）"""
+
+    def __init__(self, session_factory: Callable):
+        self.session_factory = session_factory
+        self._pending: Dict[Tuple[date, str], int] = defaultdict(int)  # 未回寫的增量
+        self._persisted: Dict[Tuple[date, str], int] = {}               # 最近一次讀回的總數
+
+        # 統計信息
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+
+    @staticmethod
+    def today() -> date:
+        return datetime.utcnow().date()
+
+    def incr(self, counter: str, amount: int = 1, day: Optional[date] = None):
+        """累加計數"""
+        self._pending[(day or self.today(), counter)] += amount
+
+    def record_order_created(self, is_quick_buy: bool = False, completed: bool = False):
+        """記錄新訂單（速買訂單寫入時即為已完成）"""
+        self.incr(ORDERS_CREATED)
+        if is_quick_buy:
+            self.incr(QUICK_BUY_ORDERS)
+        if completed:
+            self.incr(ORDERS_COMPLETED)
+
+    def get(self, counter: str, day: Optional[date] = None) -> int:
+        """讀取計數（所有進程已回寫的總數 + 本進程未回寫的增量）"""
+        key = (day or self.today(), counter)
+        return self._persisted.get(key, 0) + self._pending.get(key, 0)
+
+    def get_today(self) -> Dict[str, int]:
+        """當日全部計數"""
+        return {
+            counter: self.get(counter)
+            for counter in (ORDERS_CREATED, ORDERS_COMPLETED, QUICK_BUY_ORDERS)
+        }
+
+    async def flush(self):
+        """回寫增量並讀回當日總數"""
+        started = time.perf_counter()
+
+        # 先取出增量，回寫期間的新增量留到下一輪
+        pending, self._pending = self._pending, defaultdict(int)
+        today = self.today()
+
+        try:
+            async with self.session_factory() as session:
+                async with session.begin():
+                    for (stat_date, counter), value in pending.items():
+                        if value:
+                            await session.execute(
+                                text(UPSERT_SQL),
+                                {"stat_date": stat_date, "counter": counter, "value": value}
+                            )
+
+                    result = await session.execute(
+                        text("SELECT counter, value FROM daily_order_counters WHERE stat_date = :today"),
+                        {"today": today}
+                    )
+                    totals = {(today, row[0]): int(row[1]) for row in result}
+        except Exception as e:
+            # 回寫失敗時把增量放回，下一輪重試
+            for key, value in pending.items():
+                self._pending[key] += value
+            logger.error(f"回寫每日計數失敗: {e}")
+            return
+
+        # 只保留當日總數，舊日期自然淘汰
+        self._persisted = totals
+        self.flushes += 1
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+
+    async def backfill(self, since: date = date(1970, 1, 1)) -> int:
+        """從 orders 重算 since 之後每天的計數，返回寫入的行數"""
+        async with self.session_factory() as session:
+            async with session.begin():
+                result = await session.execute(
+                    text(BACKFILL_SQL),
+                    {"since": datetime.combine(since, datetime.min.time())}
+                )
+        logger.info(f"每日計數回填完成: 自 {since} 起, 影響 {result.rowcount} 行")
+        return result.rowcount
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取統計信息"""
+        return {
+            'today': self.get_today(),
+            'pending_keys': len(self._pending),
+            'flushes': self.flushes,
+            'last_flush_ms': round(self.last_flush_ms, 2)
+        }
+
+if __name__ == '__main__':
+    import asyncio
+    import argparse
+
+    parser = argparse.ArgumentParser(description='每日訂單計數器')
+    parser.add_argument('--backfill', action='store_true', help='從既有訂單回填 daily_order_counters')
+    parser.add_argument('--since', type=date.fromisoformat, default=date(1970, 1, 1))
+    args = parser.parse_args()
+
+    async def run():
+        import main
+        main.settings.SKIP_DB = False
+        await main.db_manager.connect()
+        try:
+            await DailyCounters(lambda: main.db_manager.session_maker()).backfill(args.since)
+        finally:
+            await main.db_manager.disconnect()
+
+    if args.backfill:
+        asyncio.run(run())
+    else:
+        parser.print_help()
@@ -17,12 +17,14 @@ import json
 import time
 import hashlib
 import logging
-import requests
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 from urllib.parse import urlencode, quote_plus
 from decimal import Decimal, ROUND_HALF_UP
 
+import metrics
+from provider_http import ProviderHTTPClient
+
 logger = logging.getLogger(__name__)
 
 class ECPayConfig:
@@ -39,9 +41,11 @@ class ECPayConfig:
     IS_SANDBOX = os.environ.get('ECPAY_SANDBOX', 'True').lower() == 'true'
     
     # 請求配置
-    TIMEOUT = 30
+    TIMEOUT = 30  # 單次請求超時（秒）
+    DEADLINE = 60  # 含重試的總時間（秒）
     MAX_RETRIES = 3
-    RETRY_DELAY = 1
+    RETRY_DELAY = 1  # 退避基數（秒），實際等待為 0 ~ RETRY_DELAY * 2^重試次數 的隨機值
+    MAX_CONNECTIONS = 20
     
     # 支付配置
     CURRENCY = 'TWD'
@@ -136,23 +140,31 @@ class ECPayService:
     def __init__(self):
         """初始化綠界科技服務"""
         self.config = ECPayConfig()
-        self.session = requests.Session()
         
-        # 設置請求頭
-        self.session.headers.update({
-            'Content-Type': 'application/x-www-form-urlencoded',
-            'User-Agent': 'JY-4D-Tech-Sponsor-System/1.0',
-            'Accept': 'text/html'
-        })
+        # 共享連接池的異步客戶端（超時、截止時間和退避見 provider_http.py）
+        self.http = ProviderHTTPClient(
+            name='ecpay',
+            base_url=self.config.BASE_URL,
+            headers={
+                'Content-Type': 'application/x-www-form-urlencoded',
+                'User-Agent': 'JY-4D-Tech-Sponsor-System/1.0',
+                'Accept': 'text/html'
+            },
+            timeout=self.config.TIMEOUT,
+            deadline=self.config.DEADLINE,
+            max_retries=self.config.MAX_RETRIES,
+            retry_delay=self.config.RETRY_DELAY,
+            max_connections=self.config.MAX_CONNECTIONS
+        )
         
         logger.info(f"綠界科技服務初始化完成 - 環境: {'測試' if self.config.IS_SANDBOX else '正式'}")
     
-    def is_available(self) -> bool:
+    async def is_available(self) -> bool:
         """檢查服務可用性"""
         try:
             # 綠界沒有健康檢查接口，嘗試訪問主頁
-            response = self.session.get(self.config.BASE_URL, timeout=10)
-            return response.status_code == 200
+            await self.http.request('GET', '', timeout=10, deadline=10)
+            return True
         except Exception as e:
             logger.warning(f"綠界科技服務不可用: {e}")
             return False
@@ -193,7 +205,7 @@ class ECPayService:
         # 四捨五入到分
         return float(Decimal(str(fee)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
     
-    def create_payment(self, 
+    async def create_payment(self, 
                       order_id: str,
                       amount: float,
                       description: str,
@@ -276,7 +288,7 @@ class ECPayService:
             request_data['CheckMacValue'] = self._generate_check_mac_value(request_data)
             
             # 發送請求
-            response = self._make_request('POST', '/Cashier/AioCheckOut/V5', request_data)
+            response = await self._make_request('POST', '/Cashier/AioCheckOut/V5', request_data)
             
             if 'form' in response.lower() and 'action' in response.lower():
                 # 解析HTML表單獲取支付URL
@@ -325,7 +337,7 @@ class ECPayService:
                 'message': '系統錯誤，請稍後重試'
             }
     
-    def query_payment_status(self, order_id: str) -> Dict:
+    async def query_payment_status(self, order_id: str) -> Dict:
         """查詢支付狀態"""
         try:
             request_data = {
@@ -338,7 +350,7 @@ class ECPayService:
             request_data['CheckMacValue'] = self._generate_check_mac_value(request_data)
             
             # 發送請求
-            response = self._make_request('POST', '/Cashier/QueryTradeInfo/V5', request_data)
+            response = await self._make_request('POST', '/Cashier/QueryTradeInfo/V5', request_data)
             
             # 解析響應
             if '=' in response and '&' in response:
@@ -461,35 +473,14 @@ class ECPayService:
             'cvs': self.config.CVS_CODES
         }
     
-    def _make_request(self, method: str, endpoint: str, data: Dict = None) -> str:
-        """發送HTTP請求"""
-        url = f"{self.config.BASE_URL}{endpoint}"
-        
-        for attempt in range(self.config.MAX_RETRIES):
-            try:
-                if method.upper() == 'GET':
-                    response = self.session.get(url, params=data, timeout=self.config.TIMEOUT)
-                else:
-                    response = self.session.post(url, data=data, timeout=self.config.TIMEOUT)
-                
-                response.raise_for_status()
-                return response.text
-                    
-            except requests.exceptions.Timeout:
-                logger.warning(f"綠界科技API請求超時 (嘗試 {attempt + 1}/{self.config.MAX_RETRIES})")
-                if attempt < self.config.MAX_RETRIES - 1:
-                    time.sleep(self.config.RETRY_DELAY * (attempt + 1))
-                    continue
-                raise
-                
-            except requests.exceptions.RequestException as e:
-                logger.error(f"綠界科技API請求失敗: {e}")
-                if attempt < self.config.MAX_RETRIES - 1:
-                    time.sleep(self.config.RETRY_DELAY * (attempt + 1))
-                    continue
-                raise
-        
-        return ''
+    @metrics.provider_request('ecpay')
+    async def _make_request(self, method: str, endpoint: str, data: Dict = None) -> str:
+        """發送HTTP請求（失敗時按退避策略重試，超過截止時間拋出異常）"""
+        if method.upper() == 'GET':
+            response = await self.http.request('GET', endpoint, params=data)
+        else:
+            response = await self.http.request('POST', endpoint, data=data)
+        return response.text
     
     def _generate_check_mac_value(self, data: Dict) -> str:
         """生成檢查碼"""
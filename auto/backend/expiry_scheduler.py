@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 訂單過期調度
+Order Expiry Scheduler for 4D Tech Style Auto Sponsorship System
+
+主要功能:
+- 分層時間輪保存訂單過期時間，啟動時從 expires_at 載入
+- 每個條目只存訂單行 id 和過期刻度（array，16 字節），百萬級訂單只佔十幾 MB
+- 到期的訂單按批次交給處理函數（批量 UPDATE、釋放資源、推送事件）
+- 訂單完成或取消時不從時間輪刪除，處理函數按狀態過濾（只過期仍為 pending 的訂單）
+- 線程（Flask）和事件循環（FastAPI）兩種運行方式
+"""
+
+import time
+import asyncio
+import inspect
+import logging
+import threading
+from array import array
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class TimerWheel:
+    """分層時間輪：第 L 層每格跨度為 slots^L 個刻度，到達格子邊界時下移一層"""
+
+    def __init__(self, now_tick: int, slots: int = 256, levels: int = 3):
+        self.slots = slots
+        self.levels = levels
+        self.now_tick = now_tick
+        # 每格兩個平行數組：訂單行 id、過期刻度
+        self._wheel = [[(array('q'), array('q')) for _ in range(slots)] for _ in range(levels)]
+        self._overflow = (array('q'), array('q'))  # 超出最高層範圍
+        self._due = array('q')
+        self.size = 0
+
+    def add(self, item_id: int, deadline_tick: int):
+        self.size += 1
+        self._place(item_id, deadline_tick)
+
+    def _place(self, item_id: int, deadline_tick: int):
+        delta = deadline_tick - self.now_tick
+        if delta <= 0:
+            self._due.append(item_id)
+            return
+        span = self.slots
+        for level in range(self.levels):
+            if delta < span:
+                ids, ticks = self._wheel[level][(deadline_tick // (span // self.slots)) % self.slots]
+                ids.append(item_id)
+                ticks.append(deadline_tick)
+                return
+            span *= self.slots
+        self._overflow[0].append(item_id)
+        self._overflow[1].append(deadline_tick)
+
+    def advance(self, to_tick: int) -> array:
+        """推進到 to_tick，返回所有已到期的訂單行 id"""
+        while self.now_tick < to_tick:
+            self.now_tick += 1
+            tick = self.now_tick
+            # 先從高層往低層下移到達邊界的格子，再取第 0 層當前格
+            for level in range(self.levels - 1, 0, -1):
+                span = self.slots ** level
+                if tick % span == 0:
+                    self._cascade(self._wheel[level], (tick // span) % self.slots)
+                    if level == self.levels - 1:
+                        self._cascade_overflow()
+            ids, _ = self._wheel[0][tick % self.slots]
+            if ids:
+                self._due.extend(ids)
+                self._wheel[0][tick % self.slots] = (array('q'), array('q'))
+
+        due, self._due = self._due, array('q')
+        self.size -= len(due)
+        return due
+
+    def _cascade(self, level_slots: List[Tuple[array, array]], index: int):
+        ids, ticks = level_slots[index]
+        if not ids:
+            return
+        level_slots[index] = (array('q'), array('q'))
+        for item_id, deadline_tick in zip(ids, ticks):
+            self._place(item_id, deadline_tick)
+
+    def _cascade_overflow(self):
+        ids, ticks = self._overflow
+        if not ids:
+            return
+        self._overflow = (array('q'), array('q'))
+        for item_id, deadline_tick in zip(ids, ticks):
+            self._place(item_id, deadline_tick)
+
+    def memory_bytes(self) -> int:
+        """條目數組佔用的內存（不含空數組本身）"""
+        total = self._due.itemsize * len(self._due)
+        for level_slots in self._wheel:
+            for ids, ticks in level_slots:
+                total += ids.itemsize * (len(ids) + len(ticks))
+        return total + self._overflow[0].itemsize * 2 * len(self._overflow[0])
+
+class ExpiryScheduler:
+    """按訂單過期時間批量觸發處理函數"""
+
+    def __init__(self,
+                 name: str,
+                 handler: Callable[[List[int]], Any],
+                 tick_seconds: float = 1.0,
+                 batch_size: int = 500):
+        """
+        handler: 接收一批到期的訂單行 id，返回實際過期的數量（可以是協程函數）
+        tick_seconds: 時間輪刻度，過期最多延遲一個刻度
+        """
+        self.name = name
+        self.handler = handler
+        self.tick_seconds = tick_seconds
+        self.batch_size = batch_size
+        self.wheel = TimerWheel(self._tick(time.time()))
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stop = threading.Event()
+
+        # 統計信息
+        self.scheduled = 0
+        self.fired = 0
+        self.expired = 0
+        self.errors = 0
+        self.last_batch_ms = 0.0
+
+    def _tick(self, timestamp: float) -> int:
+        # 向上取整，保證不會提前過期
+        return -int(-timestamp // self.tick_seconds)
+
+    def schedule(self, item_id: int, expires_at: datetime):
+        """登記訂單的過期時間（expires_at 為本地時間）"""
+        with self._lock:
+            self.wheel.add(item_id, self._tick(expires_at.timestamp()))
+            self.scheduled += 1
+
+    def load(self, rows: Iterable[Tuple[int, Any]]) -> int:
+        """啟動時批量載入 (訂單行 id, expires_at)；expires_at 可以是 datetime 或 ISO 字符串"""
+        count = 0
+        for item_id, expires_at in rows:
+            if isinstance(expires_at, str):
+                expires_at = datetime.fromisoformat(expires_at)
+            self.schedule(item_id, expires_at)
+            count += 1
+        logger.info(f"過期調度 {self.name} 載入 {count} 個待過期訂單")
+        return count
+
+    def collect_due(self, now: Optional[float] = None) -> array:
+        """推進時間輪，返回到期的訂單行 id"""
+        with self._lock:
+            return self.wheel.advance(self._tick(time.time() if now is None else now))
+
+    def _batches(self, due: array) -> Iterable[List[int]]:
+        for start in range(0, len(due), self.batch_size):
+            yield due[start:start + self.batch_size].tolist()
+
+    def _record(self, batch: List[int], expired: Any, started: float):
+        self.fired += len(batch)
+        self.expired += expired or 0
+        self.last_batch_ms = (time.perf_counter() - started) * 1000
+
+    def fire_due(self, now: Optional[float] = None) -> int:
+        """同步處理所有到期訂單，返回實際過期的數量"""
+        expired_before = self.expired
+        for batch in self._batches(self.collect_due(now)):
+            started = time.perf_counter()
+            try:
+                self._record(batch, self.handler(batch), started)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"過期調度 {self.name} 處理失敗: {e}")
+        return self.expired - expired_before
+
+    async def fire_due_async(self) -> int:
+        """在事件循環中處理所有到期訂單（handler 可以是協程函數）"""
+        expired_before = self.expired
+        for batch in self._batches(self.collect_due()):
+            started = time.perf_counter()
+            try:
+                result = self.handler(batch)
+                if inspect.isawaitable(result):
+                    result = await result
+                self._record(batch, result, started)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"過期調度 {self.name} 處理失敗: {e}")
+        return self.expired - expired_before
+
+    def start(self):
+        """在後台線程中按刻度觸發（Flask）"""
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stop.wait(self.tick_seconds):
+                self.fire_due()
+
+        self._thread = threading.Thread(target=run, name=f'expiry-{self.name}', daemon=True)
+        self._thread.start()
+
+    def start_async(self):
+        """在當前事件循環中按刻度觸發（FastAPI）"""
+        if self._task is not None:
+            return
+
+        async def run():
+            while True:
+                await asyncio.sleep(self.tick_seconds)
+                await self.fire_due_async()
+
+        self._task = asyncio.create_task(run())
+
+    async def stop_async(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stop(self):
+        self._stop.set()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取統計信息"""
+        with self._lock:
+            pending = self.wheel.size
+            memory_bytes = self.wheel.memory_bytes()
+        return {
+            'name': self.name,
+            'pending': pending,
+            'memory_bytes': memory_bytes,
+            'scheduled': self.scheduled,
+            'fired': self.fired,
+            'expired': self.expired,
+            'errors': self.errors,
+            'last_batch_ms': round(self.last_batch_ms, 2)
+        }
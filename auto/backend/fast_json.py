@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 快速 JSON 序列化
+Fast JSON Serialization for 4D Tech Style Auto Sponsorship System
+
+主要功能:
+- 基於 orjson 的 dumps/loads（未安裝時回退到標準庫 json）
+- Decimal 與 FastAPI 默認編碼一致（整數值輸出為 int，其餘為 float）
+- datetime/date 輸出 ISO 8601，Pydantic 模型按字段輸出
+- 響應模型的預編譯序列化器（驗證與序列化都在 pydantic-core 中完成）
+"""
+
+import json
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Mapping
+
+try:
+    import orjson
+except ImportError:  # 未安裝 orjson 時使用標準庫
+    orjson = None
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+
+def _default(obj: Any) -> Any:
+    """orjson 不支持的類型"""
+    if isinstance(obj, Decimal):
+        return int(obj) if obj.as_tuple().exponent >= 0 else float(obj)
+    if hasattr(obj, 'model_dump'):
+        return obj.model_dump()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, bytes):
+        return obj.decode('utf-8')
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    # 標準庫回退路徑需要自行處理日期時間
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    raise TypeError(f"無法序列化類型 {type(obj).__name__}")
+
+def dumps(obj: Any) -> bytes:
+    """序列化為 UTF-8 JSON 字節"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=_OPTIONS)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def dumps_str(obj: Any) -> str:
+    """序列化為字符串（WebSocket 文本幀、緩存值）"""
+    return dumps(obj).decode('utf-8')
+
+def loads(data: Any) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+class ModelSerializer:
+    """單個響應模型的預編譯序列化器"""
+
+    def __init__(self, model):
+        from pydantic import TypeAdapter
+
+        self.model = model
+        self.adapter = TypeAdapter(model)
+        self.list_adapter = TypeAdapter(List[model])
+
+    def dump(self, row: Dict[str, Any]) -> bytes:
+        """資料庫行 -> JSON（按模型字段驗證和轉換類型）"""
+        return self.adapter.dump_json(self.adapter.validate_python(row))
+
+    def dump_many(self, rows: Iterable[Mapping[str, Any]]) -> bytes:
+        """多行 -> JSON 數組"""
+        return self.list_adapter.dump_json(self.list_adapter.validate_python([dict(row) for row in rows]))
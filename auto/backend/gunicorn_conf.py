@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - gunicorn 配置
+Gunicorn Configuration for 4D Tech Style Auto Sponsorship System
+
+啟用 Prometheus 多進程模式，/metrics 彙總所有 worker 的指標。
+為每個 worker 分配唯一的訂單ID進程編號: ORDER_ID_WORKER_BASE + worker 序號
+（多台主機部署時每台主機設置不重疊的 ORDER_ID_WORKER_BASE）。
+
+用法:
+    cd backend
+    gunicorn -c gunicorn_conf.py main:app
+"""
+
+import os
+import shutil
+import tempfile
+
+# 必須在 worker 導入 prometheus_client 之前設置
+multiproc_dir = os.environ.setdefault(
+    'PROMETHEUS_MULTIPROC_DIR',
+    os.path.join(tempfile.gettempdir(), 'sponsor_prometheus')
+)
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8080')
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'uvicorn.workers.UvicornWorker')
+order_id_worker_base = int(os.environ.get('ORDER_ID_WORKER_BASE', 0))
+
+def on_starting(server):
+    """清空上一次運行留下的指標文件"""
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir, exist_ok=True)
+
+def pre_fork(server, worker):
+    """在 master 中為新 worker 分配未被存活 worker 使用的最小序號（重啟的 worker 沿用空出的序號）"""
+    used = {getattr(other, 'order_id_slot', None) for other in server.WORKERS.values()}
+    slot = next(index for index in range(len(used) + 1) if index not in used)
+    worker_id = order_id_worker_base + slot
+    if worker_id > 1023:
+        raise RuntimeError(f"訂單ID進程編號 {worker_id} 超出 0-1023，請調整 ORDER_ID_WORKER_BASE")
+    worker.order_id_slot = slot
+
+def post_fork(server, worker):
+    """worker 進程導入應用前設置訂單ID進程編號"""
+    os.environ['ORDER_ID_WORKER_ID'] = str(order_id_worker_base + worker.order_id_slot)
+
+def child_exit(server, worker):
+    """worker 退出時移除其 live 指標"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 延遲創建的服務實例
+Lazy Provider for 4D Tech Style Auto Sponsorship System
+
+主要功能:
+- 支付服務商客戶端和重量級 SDK 在首次使用時才創建
+- 線程安全（Flask 線程模式下可並發訪問）
+- 可選的後台預熱，不阻塞啟動
+- 創建失敗不緩存，下一次使用時重試
+"""
+
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable
+
+logger = logging.getLogger(__name__)
+
+class LazyProvider:
+    """首次訪問屬性時才調用 factory 創建實例的代理"""
+
+    def __init__(self, factory: Callable[[], Any], name: str):
+        self._factory = factory
+        self._name = name
+        self._instance = None
+        self._lock = threading.Lock()
+
+        # 統計信息
+        self._init_ms = 0.0
+        self._failures = 0
+
+    @property
+    def loaded(self) -> bool:
+        return self._instance is not None
+
+    def get(self) -> Any:
+        """返回實例，必要時創建"""
+        instance = self._instance
+        if instance is not None:
+            return instance
+
+        with self._lock:
+            if self._instance is None:
+                started = time.perf_counter()
+                try:
+                    self._instance = self._factory()
+                except Exception as e:
+                    self._failures += 1
+                    logger.error(f"創建服務 {self._name} 失敗: {e}")
+                    raise
+                self._init_ms = (time.perf_counter() - started) * 1000
+                logger.info(f"服務 {self._name} 已創建 ({self._init_ms:.1f}ms)")
+            return self._instance
+
+    def __getattr__(self, item: str) -> Any:
+        # 只有代理自身沒有的屬性才會到這裡
+        return getattr(self.get(), item)
+
+    def warm_up(self) -> threading.Thread:
+        """在後台線程中創建實例，失敗只記錄日誌"""
+        def run():
+            try:
+                self.get()
+            except Exception:
+                pass
+
+        thread = threading.Thread(target=run, name=f"warm-up-{self._name}", daemon=True)
+        thread.start()
+        return thread
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取統計信息"""
+        return {
+            'name': self._name,
+            'loaded': self.loaded,
+            'init_ms': round(self._init_ms, 2),
+            'failures': self._failures
+        }
+
+def warm_up_all(providers: Iterable[LazyProvider]):
+    """後台預熱多個服務，各自獨立，單個服務商不可用不影響其他服務"""
+    for provider in providers:
+        provider.warm_up()
@@ -10,6 +10,7 @@
 
 import os
 import sys
+import time
 import asyncio
 import logging
 from datetime import datetime, timedelta
@@ -17,7 +18,7 @@ from typing import Optional, List, Dict, Any
 from contextlib import asynccontextmanager
 
 # FastAPI 相關導入
-from fastapi import FastAPI, HTTPException, Depends, status, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, status, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
@@ -29,15 +30,13 @@ from pydantic import BaseModel, EmailStr, field_validator
 
 # 資料庫相關
 import aiomysql
-# import aioredis  # 暫時註解掉，因為版本相容性問題
-from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String, Float, DateTime, Boolean, Text, ForeignKey
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String, Float, DateTime, Boolean, Text, ForeignKey, text
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base, relationship
 from databases import Database
 
 # 安全相關
 import jwt
-from passlib.context import CryptContext
 from passlib.hash import bcrypt
 
 # 任務調度
@@ -46,13 +45,32 @@ from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.triggers.cron import CronTrigger
 
 # 其他工具
-import json
 import uuid
 import hashlib
 import secrets
 from decimal import Decimal
 from enum import Enum
 
+# 進程內緩存
+from ttl_cache import TTLCache
+from stock_ledger import StockLedger
+from write_behind import WriteBehindQueue, build_values_clause
+from order_id import generate_order_id, use_default_worker_id
+from pagination import KEYSET_CONDITION, cursor_params, decode_cursor, next_cursor
+from catalog_cache import ItemCatalog
+from ws_fanout import ConnectionManager
+from pubsub import create_pubsub
+from daily_counters import DailyCounters, ORDERS_CREATED
+from cache_tier import create_cache
+from recent_activity import RecentActivityFeed
+from password_pool import PasswordHasher, PasswordPoolBusy
+from token_auth import TokenService, RevocationList, InvalidToken
+from usdt_service import USDTPaymentService
+from usdt_store import SQLUSDTOrderStore
+import fast_json
+from fast_json import ModelSerializer
+import metrics
+
 # 配置日誌
 logging.basicConfig(
     level=logging.INFO,
@@ -92,6 +110,9 @@ class Settings:
     SECRET_KEY = "your-secret-key-here-change-in-production"
     ALGORITHM = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES = 30
+    REFRESH_TOKEN_EXPIRE_DAYS = 7
+    TOKEN_CACHE_SIZE = 50000  # 已驗證令牌摘要的緩存條數
+    TOKEN_REVOCATION_POLL_SECONDS = 10  # 輪詢 revoked_tokens 的間隔（發布/訂閱為 memory 時的跨 worker 同步）
     
     # 安全配置
     ALLOWED_HOSTS = ["localhost", "127.0.0.1"]
@@ -100,6 +121,56 @@ class Settings:
     QUICK_BUY_TIMEOUT = 30  # 秒
     MAX_QUICK_BUY_AMOUNT = 100
     
+    # 用戶緩存配置
+    USER_CACHE_TTL = 30  # 秒
+    USER_CACHE_SIZE = 10000
+    
+    # 商品目錄快照最長使用時間（秒），失效廣播丟失時兜底
+    CATALOG_MAX_AGE = 30
+    
+    # 速買庫存帳本配置
+    STOCK_LEDGER_ENABLED = True
+    STOCK_LEDGER_CHUNK = 50  # 每次向資料庫申請的配額
+    STOCK_LEDGER_FLUSH_SECONDS = 1
+    STOCK_LEDGER_STALE_SECONDS = 60
+    STOCK_LEDGER_SYNC_SECONDS = 30  # 同步速買商品集合的間隔
+    
+    # 延遲批量寫入配置（活動日誌、速買統計）
+    WRITE_BEHIND_MAX_SIZE = 10000
+    WRITE_BEHIND_BATCH_SIZE = 500
+    WRITE_BEHIND_FLUSH_SECONDS = 1
+    
+    # WebSocket 扇出配置
+    WS_QUEUE_SIZE = 100  # 每個連接最多排隊的消息數
+    WS_SEND_TIMEOUT = 5  # 秒，超時視為慢客戶端
+    WS_COALESCE_TYPES = ["system_status"]  # 只保留最新一條的消息類型
+    
+    # 發布/訂閱配置（多個 worker 部署時使用 redis，讓消息送達持有連接的 worker）
+    PUBSUB_BACKEND = os.getenv("PUBSUB_BACKEND", "memory")  # memory / redis
+    
+    # 緩存層配置（多個 worker 部署時使用 redis 共享）
+    CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")  # memory / redis
+    CACHE_MAX_ENTRIES = 10000
+    CACHE_DEFAULT_TTL = 300  # 秒
+    SYSTEM_STATS_TTL = 600  # 秒，統計任務每5分鐘刷新
+    
+    # 用戶最近活動環形緩衝區
+    RECENT_ACTIVITY_SIZE = 10
+    RECENT_ACTIVITY_TTL = 3600  # 秒，閒置用戶的緩衝區過期後按需重新載入
+    
+    # 密碼哈希進程池（bcrypt 不在事件循環中執行）
+    BCRYPT_ROUNDS = 12  # 低於此值的舊哈希在登入時自動更新
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+    PASSWORD_HASH_MAX_WAITING = 200  # 超過時登入/註冊返回 503
+    
+    # 每日訂單計數器回寫間隔
+    DAILY_COUNTERS_FLUSH_SECONDS = 10
+    
+    # USDT 鏈上掃描（多 worker 部署時可只在一個 worker 上啟用）
+    USDT_SCANNER_ENABLED = os.getenv("USDT_SCANNER_ENABLED", "True").lower() == "true"
+    USDT_SCAN_INTERVAL = 5  # 秒
+    USDT_SIMULATED_CHAIN = os.getenv("USDT_SIMULATED_CHAIN", "False").lower() == "true"  # 離線測試
+    
     @property
     def database_url(self):
         return f"mysql+aiomysql://{self.DB_USER}:{self.DB_PASSWORD}@{self.DB_HOST}:{self.DB_PORT}/{self.DB_NAME}"
@@ -163,6 +234,7 @@ class Order(Base):
     payment_method = Column(String(50), nullable=False)
     status = Column(String(20), default="pending")
     is_quick_buy = Column(Boolean, default=False)
+    stock_settled = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     completed_at = Column(DateTime)
@@ -229,6 +301,12 @@ class UserLogin(BaseModel):
     email: EmailStr
     password: str
 
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class LogoutRequest(BaseModel):
+    refresh_token: Optional[str] = None
+
 class UserResponse(BaseModel):
     id: int
     username: str
@@ -295,16 +373,52 @@ class PreferencesUpdate(BaseModel):
     theme: Optional[str] = None
     language: Optional[str] = None
 
+# 響應模型的預編譯序列化器
+item_serializer = ModelSerializer(ItemResponse)
+order_serializer = ModelSerializer(OrderResponse)
+
+class InstrumentedDatabase(Database):
+    """記錄每條語句耗時的 Database"""
+    
+    async def fetch_all(self, query, values=None):
+        with metrics.time_query(query):
+            return await super().fetch_all(query, values)
+    
+    async def fetch_one(self, query, values=None):
+        with metrics.time_query(query):
+            return await super().fetch_one(query, values)
+    
+    async def fetch_val(self, query, values=None, column=0):
+        with metrics.time_query(query):
+            return await super().fetch_val(query, values, column)
+    
+    async def execute(self, query, values=None):
+        with metrics.time_query(query):
+            return await super().execute(query, values)
+    
+    async def execute_many(self, query, values):
+        with metrics.time_query(query):
+            return await super().execute_many(query, values)
+
 # 資料庫連接管理
 class DatabaseManager:
     def __init__(self):
         self.engine = None
         self.database = None
-        self.redis = None
+        self.cache = None
         self.session_maker = None
     
     async def connect(self):
         try:
+            # 緩存層（不依賴資料庫，開發模式下也可用）
+            self.cache = create_cache(
+                settings.CACHE_BACKEND,
+                redis_url=settings.redis_url,
+                maxsize=settings.CACHE_MAX_ENTRIES,
+                default_ttl=settings.CACHE_DEFAULT_TTL
+            )
+            logger.info(f"緩存層已初始化: {self.cache.name}")
+            
             # 開發模式：跳過資料庫連接
             if settings.SKIP_DB:
                 logger.info("開發模式：跳過資料庫連接")
@@ -319,6 +433,7 @@ class DatabaseManager:
                 pool_pre_ping=True,
                 pool_recycle=3600
             )
+            metrics.instrument_sqlalchemy(self.engine.sync_engine)
             
             self.session_maker = async_sessionmaker(
                 self.engine,
@@ -326,16 +441,9 @@ class DatabaseManager:
                 expire_on_commit=False
             )
             
-            self.database = Database(settings.database_url)
+            self.database = InstrumentedDatabase(settings.database_url)
             await self.database.connect()
             
-            # Redis 連接
-            # self.redis = await aioredis.from_url(
-            #     settings.redis_url,
-            #     encoding="utf-8",
-            #     decode_responses=True
-            # )
-            
             logger.info("資料庫連接成功")
             
         except Exception as e:
@@ -346,8 +454,8 @@ class DatabaseManager:
         try:
             if self.database:
                 await self.database.disconnect()
-            if self.redis:
-                await self.redis.close()
+            if self.cache:
+                await self.cache.close()
             if self.engine:
                 await self.engine.dispose()
             logger.info("資料庫連接已關閉")
@@ -364,38 +472,108 @@ class DatabaseManager:
 # 實例化資料庫管理器
 db_manager = DatabaseManager()
 
-# 密碼加密
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-security = HTTPBearer()
+# 發布/訂閱後端（WebSocket 投遞、令牌吊銷和商品目錄失效共用）
+pubsub = create_pubsub(settings.PUBSUB_BACKEND, settings.redis_url)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+# 已認證用戶緩存（按用戶ID）
+user_cache = TTLCache(
+    maxsize=settings.USER_CACHE_SIZE,
+    ttl=settings.USER_CACHE_TTL,
+    name='users'
+)
 
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+# 商品目錄快照（預序列化JSON，失效經發布/訂閱同步到所有 worker）
+item_catalog = ItemCatalog(
+    session_factory=lambda: db_manager.session_maker(),
+    serializer=item_serializer.dump,
+    pubsub=pubsub,
+    max_age=settings.CATALOG_MAX_AGE
+)
 
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, settings.SECRET_KEY, algorithm=settings.ALGORITHM)
-    return encoded_jwt
+# 速買商品庫存帳本（回寫庫存後使對應商品的目錄緩存失效）
+stock_ledger = StockLedger(
+    session_factory=lambda: db_manager.session_maker(),
+    chunk_size=settings.STOCK_LEDGER_CHUNK,
+    stale_after=settings.STOCK_LEDGER_STALE_SECONDS,
+    on_settled=item_catalog.invalidate
+)
+
+# 每日訂單計數器
+daily_counters = DailyCounters(session_factory=lambda: db_manager.session_maker())
+
+# USDT 支付服務（進程內共享，連接資料庫後訂單存入 usdt_orders 表）
+usdt_service = USDTPaymentService(simulated=settings.USDT_SIMULATED_CHAIN)
+
+async def load_recent_activities(user_id: int, limit: int) -> List[dict]:
+    """從 activity_logs 載入用戶最近活動（緩衝區未命中時）"""
+    activities = await db_manager.database.fetch_all(
+        query="""
+            SELECT action, description, created_at 
+            FROM activity_logs 
+            WHERE user_id = :user_id 
+            ORDER BY created_at DESC 
+            LIMIT :limit
+        """,
+        values={"user_id": user_id, "limit": limit}
+    )
+    return [
+        RecentActivityFeed.format_entry(activity['action'], activity['description'], activity['created_at'])
+        for activity in activities
+    ]
+
+# 用戶最近活動（緩存層中的環形緩衝區）
+recent_activity = RecentActivityFeed(
+    cache_factory=lambda: db_manager.cache,
+    loader=load_recent_activities,
+    size=settings.RECENT_ACTIVITY_SIZE,
+    ttl=settings.RECENT_ACTIVITY_TTL
+)
+
+# 活動日誌與速買統計的延遲寫入隊列
+write_behind = WriteBehindQueue(
+    max_size=settings.WRITE_BEHIND_MAX_SIZE,
+    batch_size=settings.WRITE_BEHIND_BATCH_SIZE,
+    flush_interval=settings.WRITE_BEHIND_FLUSH_SECONDS,
+    name='activity_and_stats'
+)
 
-def verify_token(token: str):
+# 密碼加密（在獨立進程池中執行）
+password_hasher = PasswordHasher(
+    params=settings.BCRYPT_ROUNDS,
+    workers=settings.PASSWORD_HASH_WORKERS,
+    max_waiting=settings.PASSWORD_HASH_MAX_WAITING
+)
+security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
+
+async def verify_password(plain_password: str, hashed_password: str):
+    """返回 (是否匹配, 新哈希)；哈希參數過時時新哈希不為 None"""
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        user_id: int = payload.get("sub")
-        if user_id is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="無效的認證憑證",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        return user_id
-    except jwt.PyJWTError:
+        return await password_hasher.verify(plain_password, hashed_password)
+    except PasswordPoolBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+async def get_password_hash(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PasswordPoolBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+# 令牌簽發與驗證（已驗證令牌緩存 + 跨 worker 吊銷列表）
+token_service = TokenService(
+    secret=settings.SECRET_KEY,
+    algorithm=settings.ALGORITHM,
+    access_ttl=settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    refresh_ttl=settings.REFRESH_TOKEN_EXPIRE_DAYS * 86400,
+    revocations=RevocationList(session_factory=lambda: db_manager.session_maker(), pubsub=pubsub),
+    cache_size=settings.TOKEN_CACHE_SIZE
+)
+
+def verify_token(token: str, token_type: str = "access"):
+    """驗證令牌並返回 TokenClaims"""
+    try:
+        return token_service.verify(token, token_type)
+    except InvalidToken:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="無效的認證憑證",
@@ -404,7 +582,12 @@ def verify_token(token: str):
 
 # 依賴注入
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    user_id = verify_token(credentials.credentials)
+    user_id = int(verify_token(credentials.credentials).subject)
+    
+    # 優先讀取緩存
+    cached_user = user_cache.get(user_id)
+    if cached_user is not None:
+        return dict(cached_user)
     
     query = "SELECT * FROM users WHERE id = :user_id AND is_active = 1"
     user = await db_manager.database.fetch_one(query=query, values={"user_id": user_id})
@@ -416,182 +599,187 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    user = dict(user)
+    user_cache.set(user_id, user)
     return dict(user)
 
+async def get_current_admin(current_user: dict = Depends(get_current_user)):
+    if not current_user.get('is_admin'):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="權限不足")
+    return current_user
+
 # WebSocket 連接管理
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[int, WebSocket] = {}
-    
-    async def connect(self, websocket: WebSocket, user_id: int):
-        await websocket.accept()
-        self.active_connections[user_id] = websocket
-        logger.info(f"用戶 {user_id} WebSocket 已連接")
-    
-    def disconnect(self, user_id: int):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
-            logger.info(f"用戶 {user_id} WebSocket 已斷開")
-    
-    async def send_personal_message(self, message: dict, user_id: int):
-        if user_id in self.active_connections:
-            try:
-                await self.active_connections[user_id].send_text(json.dumps(message))
-            except Exception as e:
-                logger.error(f"發送消息給用戶 {user_id} 失敗: {e}")
-                self.disconnect(user_id)
-    
-    async def broadcast(self, message: dict):
-        disconnected_users = []
-        for user_id, connection in self.active_connections.items():
-            try:
-                await connection.send_text(json.dumps(message))
-            except Exception as e:
-                logger.error(f"廣播消息給用戶 {user_id} 失敗: {e}")
-                disconnected_users.append(user_id)
-        
-        # 清理斷開的連接
-        for user_id in disconnected_users:
-            self.disconnect(user_id)
+manager = ConnectionManager(
+    queue_size=settings.WS_QUEUE_SIZE,
+    send_timeout=settings.WS_SEND_TIMEOUT,
+    coalesce_types=settings.WS_COALESCE_TYPES,
+    pubsub=pubsub
+)
+
+# 速買SQL：條件扣減庫存和餘額，並更新用戶統計（單條語句，無競態）
+# 可售庫存需扣除各進程庫存帳本持有的配額（商品剛取消速買標記或本進程帳本未載入時）
+QUICK_BUY_DEDUCT_SQL = """
+    UPDATE items i JOIN users u ON u.id = :user_id
+    SET i.stock = i.stock - :amount,
+        u.balance = u.balance - :debit,
+        u.total_orders = u.total_orders + 1,
+        u.total_spent = u.total_spent + :total_price,
+        u.quick_buy_success = u.quick_buy_success + 1
+    WHERE i.id = :item_id AND i.is_active = 1 AND i.price = :price
+      AND i.stock - (SELECT COALESCE(SUM(a.quota), 0) FROM stock_allocations a WHERE a.item_id = :item_id) >= :amount
+      AND u.is_active = 1 AND u.balance >= :debit
+"""
+
+# 速買SQL：庫存由帳本預留時，只扣減餘額並更新用戶統計
+QUICK_BUY_LEDGER_DEDUCT_SQL = """
+    UPDATE users
+    SET balance = balance - :debit,
+        total_orders = total_orders + 1,
+        total_spent = total_spent + :total_price,
+        quick_buy_success = quick_buy_success + 1
+    WHERE id = :user_id AND is_active = 1 AND balance >= :debit
+"""
+
+# 速買SQL：直接寫入已完成訂單
+QUICK_BUY_ORDER_SQL = """
+    INSERT INTO orders (order_id, user_id, item_id, amount, total_price,
+                        payment_method, status, is_quick_buy, stock_settled, created_at, completed_at)
+    VALUES (:order_id, :user_id, :item_id, :amount, :total_price,
+            :payment_method, 'completed', 1, :stock_settled, :created_at, :created_at)
+"""
+
+# 批量寫入SQL：速買統計增量合併（依賴 unique_user_item 唯一鍵）
+QUICK_BUY_STATS_COLUMNS = (
+    "user_id", "item_id", "success_count", "failed_count",
+    "total_amount", "total_spent", "last_purchase", "created_at"
+)
+QUICK_BUY_STATS_UPSERT_SQL = """
+    INSERT INTO quick_buy_stats ({columns})
+    VALUES {values}
+    ON DUPLICATE KEY UPDATE
+        success_count = success_count + VALUES(success_count),
+        failed_count = failed_count + VALUES(failed_count),
+        total_amount = total_amount + VALUES(total_amount),
+        total_spent = total_spent + VALUES(total_spent),
+        last_purchase = COALESCE(VALUES(last_purchase), last_purchase),
+        updated_at = VALUES(created_at)
+"""
 
-manager = ConnectionManager()
+# 批量寫入SQL：活動日誌
+ACTIVITY_LOG_COLUMNS = ("user_id", "action", "description", "ip_address", "user_agent", "created_at")
+ACTIVITY_LOG_INSERT_SQL = """
+    INSERT INTO activity_logs ({columns})
+    VALUES {values}
+"""
 
 # 速買管理器
 class QuickBuyManager:
-    def __init__(self):
-        self.processing_orders = set()
-    
     async def process_quick_buy(self, user_id: int, item_id: int, amount: int, payment_method: str):
-        # 生成唯一訂單ID
-        order_id = f"QB{datetime.now().strftime('%Y%m%d%H%M%S')}{secrets.randbelow(1000):03d}"
-        
-        # 檢查是否正在處理
-        if order_id in self.processing_orders:
-            raise HTTPException(status_code=400, detail="訂單正在處理中")
+        # 生成唯一且按時間排序的訂單ID
+        order_id = generate_order_id('QB')
         
-        self.processing_orders.add(order_id)
+        # 速買商品由庫存帳本預留，避免所有請求爭用同一行
+        use_ledger = stock_ledger.manages(item_id)
+        reserved = False
+        item = None
         
         try:
-            # 開始事務
-            async with db_manager.session_maker() as session:
-                # 檢查商品
-                item_query = "SELECT * FROM items WHERE id = :item_id AND is_active = 1"
-                item = await db_manager.database.fetch_one(
-                    query=item_query, 
-                    values={"item_id": item_id}
-                )
-                
-                if not item:
-                    raise HTTPException(status_code=404, detail="商品不存在")
-                
-                if item['stock'] < amount:
+            # 檢查商品（價格在事務內由條件更新再次校驗）
+            item_query = "SELECT id, name, price FROM items WHERE id = :item_id AND is_active = 1"
+            item = await db_manager.database.fetch_one(
+                query=item_query, 
+                values={"item_id": item_id}
+            )
+            
+            if not item:
+                raise HTTPException(status_code=404, detail="商品不存在")
+            
+            price = item['price']
+            total_price = price * amount
+            created_at = datetime.utcnow()
+            values = {
+                "order_id": order_id,
+                "user_id": user_id,
+                "item_id": item_id,
+                "amount": amount,
+                "price": price,
+                "total_price": total_price,
+                "debit": total_price if payment_method == "balance" else 0,
+                "payment_method": payment_method,
+                "stock_settled": 0 if use_ledger else 1,
+                "created_at": created_at
+            }
+            
+            if use_ledger:
+                reserved = await stock_ledger.reserve(item_id, amount)
+                if not reserved:
                     raise HTTPException(status_code=400, detail="庫存不足")
-                
-                # 檢查用戶餘額
-                user_query = "SELECT * FROM users WHERE id = :user_id AND is_active = 1"
-                user = await db_manager.database.fetch_one(
-                    query=user_query,
-                    values={"user_id": user_id}
-                )
-                
-                if not user:
-                    raise HTTPException(status_code=404, detail="用戶不存在")
-                
-                total_price = item['price'] * amount
-                
-                if payment_method == "balance" and user['balance'] < total_price:
-                    raise HTTPException(status_code=400, detail="餘額不足")
-                
-                # 創建訂單
-                order_insert = """
-                    INSERT INTO orders (order_id, user_id, item_id, amount, total_price, 
-                                      payment_method, status, is_quick_buy, created_at)
-                    VALUES (:order_id, :user_id, :item_id, :amount, :total_price, 
-                           :payment_method, 'processing', 1, :created_at)
-                """
-                
-                await db_manager.database.execute(
-                    query=order_insert,
-                    values={
-                        "order_id": order_id,
-                        "user_id": user_id,
-                        "item_id": item_id,
-                        "amount": amount,
-                        "total_price": total_price,
-                        "payment_method": payment_method,
-                        "created_at": datetime.utcnow()
-                    }
-                )
-                
-                # 扣除庫存
-                stock_update = "UPDATE items SET stock = stock - :amount WHERE id = :item_id"
-                await db_manager.database.execute(
-                    query=stock_update,
-                    values={"amount": amount, "item_id": item_id}
-                )
-                
-                # 扣除餘額（如果使用餘額支付）
-                if payment_method == "balance":
-                    balance_update = "UPDATE users SET balance = balance - :amount WHERE id = :user_id"
-                    await db_manager.database.execute(
-                        query=balance_update,
-                        values={"amount": total_price, "user_id": user_id}
-                    )
-                
-                # 更新用戶統計
-                stats_update = """
-                    UPDATE users SET 
-                        total_orders = total_orders + 1,
-                        total_spent = total_spent + :total_price,
-                        quick_buy_success = quick_buy_success + 1
-                    WHERE id = :user_id
-                """
-                await db_manager.database.execute(
-                    query=stats_update,
-                    values={"total_price": total_price, "user_id": user_id}
-                )
-                
-                # 更新速買統計
-                await self.update_quick_buy_stats(user_id, item_id, amount, total_price, True)
-                
-                # 完成訂單
-                order_complete = """
-                    UPDATE orders SET status = 'completed', completed_at = :completed_at 
-                    WHERE order_id = :order_id
-                """
-                await db_manager.database.execute(
-                    query=order_complete,
-                    values={"order_id": order_id, "completed_at": datetime.utcnow()}
-                )
-                
-                # 記錄活動日誌
-                await self.log_activity(
-                    user_id, 
-                    "quick_buy", 
-                    f"速買成功: {item['name']} x{amount}"
-                )
-                
-                # 發送WebSocket通知
-                await manager.send_personal_message({
-                    "type": "quick_buy_result",
-                    "payload": {
-                        "success": True,
-                        "orderId": order_id,
-                        "message": "速買成功！",
-                        "totalPrice": total_price
-                    }
-                }, user_id)
-                
-                return {
+            
+            deduct_sql = QUICK_BUY_LEDGER_DEDUCT_SQL if use_ledger else QUICK_BUY_DEDUCT_SQL
+            
+            # 單一事務：條件扣減、寫入已完成訂單
+            async with db_manager.session_maker() as session:
+                async with session.begin():
+                    result = await session.execute(text(deduct_sql), values)
+                    
+                    if result.rowcount == 0:
+                        status_code, detail = await self._diagnose_failure(
+                            session, values, check_stock=not use_ledger
+                        )
+                        raise HTTPException(status_code=status_code, detail=detail)
+                    
+                    await session.execute(text(QUICK_BUY_ORDER_SQL), values)
+            
+            if reserved:
+                stock_ledger.commit(item_id, order_id, amount)
+                reserved = False
+            else:
+                # 庫存已直接扣減
+                item_catalog.invalidate([item_id])
+            
+            # 速買訂單寫入即為已完成
+            daily_counters.record_order_created(is_quick_buy=True, completed=True)
+            metrics.QUICK_BUY_ORDERS.labels("success", "").inc()
+            
+            # 更新速買統計（延遲批量寫入）
+            await self.update_quick_buy_stats(user_id, item_id, amount, total_price, True)
+            
+            # 記錄活動日誌
+            await self.log_activity(
+                user_id, 
+                "quick_buy", 
+                f"速買成功: {item['name']} x{amount}"
+            )
+            
+            # 發送WebSocket通知
+            await manager.send_personal_message({
+                "type": "quick_buy_result",
+                "payload": {
                     "success": True,
-                    "order_id": order_id,
-                    "total_price": total_price,
-                    "message": "速買成功！"
+                    "orderId": order_id,
+                    "message": "速買成功！",
+                    "totalPrice": float(total_price)
                 }
+            }, user_id)
+            
+            return {
+                "success": True,
+                "order_id": order_id,
+                "total_price": float(total_price),
+                "message": "速買成功！"
+            }
                 
         except Exception as e:
-            # 記錄錯誤
-            await self.update_quick_buy_stats(user_id, item_id, amount, 0, False)
+            # 歸還未提交的預留
+            if reserved:
+                stock_ledger.release(item_id, amount)
+            
+            reason = str(e.status_code) if isinstance(e, HTTPException) else type(e).__name__
+            metrics.QUICK_BUY_ORDERS.labels("failure", reason).inc()
+            
+            # 記錄錯誤（商品不存在時沒有可關聯的統計行）
+            if item is not None:
+                await self.update_quick_buy_stats(user_id, item_id, amount, 0, False)
             await self.log_activity(
                 user_id, 
                 "quick_buy_failed", 
@@ -610,90 +798,90 @@ class QuickBuyManager:
             raise e
         
         finally:
-            self.processing_orders.discard(order_id)
-    
-    async def update_quick_buy_stats(self, user_id: int, item_id: int, amount: int, total_spent: float, success: bool):
-        # 檢查是否存在統計記錄
-        check_query = "SELECT id FROM quick_buy_stats WHERE user_id = :user_id AND item_id = :item_id"
-        existing = await db_manager.database.fetch_one(
-            query=check_query,
-            values={"user_id": user_id, "item_id": item_id}
+            # 餘額和統計已變更，使用戶緩存失效
+            user_cache.invalidate(user_id)
+    
+    async def _diagnose_failure(self, session, values: dict, check_stock: bool = True):
+        """條件更新未命中時，找出失敗原因（僅在失敗路徑執行）"""
+        result = await session.execute(
+            text("""
+                SELECT
+                    (SELECT stock FROM items WHERE id = :item_id AND is_active = 1) AS stock,
+                    (SELECT COALESCE(SUM(quota), 0) FROM stock_allocations WHERE item_id = :item_id) AS allocated,
+                    (SELECT price FROM items WHERE id = :item_id AND is_active = 1) AS price,
+                    (SELECT balance FROM users WHERE id = :user_id AND is_active = 1) AS balance
+            """),
+            values
         )
+        row = result.mappings().first()
         
-        if existing:
-            # 更新現有記錄
-            if success:
-                update_query = """
-                    UPDATE quick_buy_stats SET 
-                        success_count = success_count + 1,
-                        total_amount = total_amount + :amount,
-                        total_spent = total_spent + :total_spent,
-                        last_purchase = :last_purchase,
-                        updated_at = :updated_at
-                    WHERE user_id = :user_id AND item_id = :item_id
-                """
-            else:
-                update_query = """
-                    UPDATE quick_buy_stats SET 
-                        failed_count = failed_count + 1,
-                        updated_at = :updated_at
-                    WHERE user_id = :user_id AND item_id = :item_id
-                """
-            
-            values = {
-                "user_id": user_id,
-                "item_id": item_id,
-                "updated_at": datetime.utcnow()
-            }
-            
-            if success:
-                values.update({
-                    "amount": amount,
-                    "total_spent": total_spent,
-                    "last_purchase": datetime.utcnow()
-                })
-            
-            await db_manager.database.execute(query=update_query, values=values)
-        else:
-            # 創建新記錄
-            insert_query = """
-                INSERT INTO quick_buy_stats 
-                (user_id, item_id, success_count, failed_count, total_amount, total_spent, last_purchase, created_at)
-                VALUES (:user_id, :item_id, :success_count, :failed_count, :total_amount, :total_spent, :last_purchase, :created_at)
-            """
-            
-            values = {
-                "user_id": user_id,
-                "item_id": item_id,
-                "success_count": 1 if success else 0,
-                "failed_count": 0 if success else 1,
-                "total_amount": amount if success else 0,
-                "total_spent": total_spent if success else 0,
-                "last_purchase": datetime.utcnow() if success else None,
-                "created_at": datetime.utcnow()
-            }
-            
-            await db_manager.database.execute(query=insert_query, values=values)
+        if row['stock'] is None:
+            return 404, "商品不存在"
+        if row['balance'] is None:
+            return 404, "用戶不存在"
+        if check_stock and row['stock'] - row['allocated'] < values['amount']:
+            return 400, "庫存不足"
+        if row['price'] != values['price']:
+            return 409, "商品價格已變更，請重試"
+        if row['balance'] < values['debit']:
+            return 400, "餘額不足"
+        return 409, "訂單處理衝突，請重試"
+    
+    async def update_quick_buy_stats(self, user_id: int, item_id: int, amount: int, total_spent: float, success: bool):
+        now = datetime.utcnow()
+        await write_behind.put("quick_buy_stats", {
+            "user_id": user_id,
+            "item_id": item_id,
+            "success_count": 1 if success else 0,
+            "failed_count": 0 if success else 1,
+            "total_amount": amount if success else 0,
+            "total_spent": total_spent if success else 0,
+            "last_purchase": now if success else None,
+            "created_at": now
+        })
     
     async def log_activity(self, user_id: int, action: str, description: str, ip_address: str = None, user_agent: str = None):
-        insert_query = """
-            INSERT INTO activity_logs (user_id, action, description, ip_address, user_agent, created_at)
-            VALUES (:user_id, :action, :description, :ip_address, :user_agent, :created_at)
-        """
+        now = datetime.utcnow()
+        await write_behind.put("activity_logs", {
+            "user_id": user_id,
+            "action": action,
+            "description": description,
+            "ip_address": ip_address,
+            "user_agent": user_agent,
+            "created_at": now
+        })
+        await recent_activity.record(user_id, action, description, now)
+    
+    async def write_quick_buy_stats(self, records: List[dict]):
+        """合併同一用戶/商品的統計增量後批量 upsert"""
+        merged = {}
+        for record in records:
+            key = (record["user_id"], record["item_id"])
+            row = merged.get(key)
+            if row is None:
+                merged[key] = dict(record)
+                continue
+            row["success_count"] += record["success_count"]
+            row["failed_count"] += record["failed_count"]
+            row["total_amount"] += record["total_amount"]
+            row["total_spent"] += record["total_spent"]
+            if record["last_purchase"] is not None:
+                row["last_purchase"] = record["last_purchase"]
+            row["created_at"] = record["created_at"]
         
-        await db_manager.database.execute(
-            query=insert_query,
-            values={
-                "user_id": user_id,
-                "action": action,
-                "description": description,
-                "ip_address": ip_address,
-                "user_agent": user_agent,
-                "created_at": datetime.utcnow()
-            }
-        )
+        values_sql, params = build_values_clause(QUICK_BUY_STATS_COLUMNS, list(merged.values()))
+        query = QUICK_BUY_STATS_UPSERT_SQL.format(columns=", ".join(QUICK_BUY_STATS_COLUMNS), values=values_sql)
+        await db_manager.database.execute(query=query, values=params)
+    
+    async def write_activity_logs(self, records: List[dict]):
+        """多行插入活動日誌"""
+        values_sql, params = build_values_clause(ACTIVITY_LOG_COLUMNS, records)
+        query = ACTIVITY_LOG_INSERT_SQL.format(columns=", ".join(ACTIVITY_LOG_COLUMNS), values=values_sql)
+        await db_manager.database.execute(query=query, values=params)
 
 quick_buy_manager = QuickBuyManager()
+write_behind.register("quick_buy_stats", quick_buy_manager.write_quick_buy_stats)
+write_behind.register("activity_logs", quick_buy_manager.write_activity_logs)
 
 # 應用程序生命週期管理
 @asynccontextmanager
@@ -725,6 +913,92 @@ async def lifespan(app: FastAPI):
         name='更新系統統計'
     )
     
+    scheduler.add_job(
+        func=update_ws_metrics,
+        trigger=IntervalTrigger(seconds=15),
+        id='update_ws_metrics',
+        name='更新WebSocket指標'
+    )
+    
+    # 訂閱 WebSocket 消息頻道
+    await manager.start()
+    
+    # 啟動延遲寫入隊列
+    if db_manager.database is not None:
+        write_behind.start()
+        
+        # 載入當日計數並定期回寫
+        await daily_counters.flush()
+        scheduler.add_job(
+            func=daily_counters.flush,
+            trigger=IntervalTrigger(seconds=settings.DAILY_COUNTERS_FLUSH_SECONDS),
+            id='flush_daily_counters',
+            name='回寫每日訂單計數'
+        )
+    
+    # 載入令牌吊銷列表，定期輪詢其他 worker 的吊銷並清理過期記錄
+    if db_manager.session_maker is not None:
+        await token_service.revocations.load()
+        
+        scheduler.add_job(
+            func=token_service.revocations.poll,
+            trigger=IntervalTrigger(seconds=settings.TOKEN_REVOCATION_POLL_SECONDS),
+            id='poll_revoked_tokens',
+            name='同步令牌吊銷記錄'
+        )
+        
+        scheduler.add_job(
+            func=token_service.revocations.purge_expired,
+            trigger=IntervalTrigger(hours=1),
+            id='purge_revoked_tokens',
+            name='清理過期令牌吊銷記錄'
+        )
+    
+    # USDT 訂單存入資料庫（多 worker 共享，重啟不丟失）
+    if db_manager.session_maker is not None:
+        usdt_service.store = SQLUSDTOrderStore(session_factory=lambda: db_manager.session_maker())
+    
+    # 訂單到期時由時間輪調度過期並推送；定期批量過期只作兜底（例如其他 worker 停止後遺留的訂單）
+    await usdt_service.start_expiry(on_status_change=push_usdt_status)
+    scheduler.add_job(
+        func=usdt_service.expire_orders,
+        trigger=IntervalTrigger(minutes=10),
+        id='expire_usdt_orders',
+        name='標記過期USDT訂單'
+    )
+    
+    # 每個網絡一個鏈上掃描器，匹配到轉賬或確認完成時推送給下單用戶
+    if settings.USDT_SCANNER_ENABLED:
+        usdt_service.start_watchers(
+            interval=settings.USDT_SCAN_INTERVAL,
+            on_status_change=push_usdt_status
+        )
+    
+    # 載入速買庫存帳本
+    if settings.STOCK_LEDGER_ENABLED and db_manager.session_maker is not None:
+        await stock_ledger.load()
+        
+        scheduler.add_job(
+            func=stock_ledger.flush,
+            trigger=IntervalTrigger(seconds=settings.STOCK_LEDGER_FLUSH_SECONDS),
+            id='flush_stock_ledger',
+            name='回寫庫存帳本'
+        )
+        
+        scheduler.add_job(
+            func=stock_ledger.reconcile,
+            trigger=IntervalTrigger(seconds=settings.STOCK_LEDGER_STALE_SECONDS),
+            id='reconcile_stock_ledger',
+            name='庫存帳本對帳'
+        )
+        
+        scheduler.add_job(
+            func=stock_ledger.sync_items,
+            trigger=IntervalTrigger(seconds=settings.STOCK_LEDGER_SYNC_SECONDS),
+            id='sync_stock_ledger_items',
+            name='同步速買商品集合'
+        )
+    
     scheduler.start()
     logger.info("系統啟動完成")
     
@@ -733,14 +1007,29 @@ async def lifespan(app: FastAPI):
     # 關閉時執行
     logger.info("🔄 正在關閉系統...")
     scheduler.shutdown()
+    await usdt_service.stop_watchers()
+    await usdt_service.stop_expiry()
+    await manager.stop()
+    await write_behind.stop()
+    if db_manager.database is not None:
+        await daily_counters.flush()
+    await stock_ledger.close()
     await db_manager.disconnect()
+    password_hasher.shutdown()
     logger.info("系統已安全關閉")
 
 # 創建FastAPI應用
+class FastJSONResponse(JSONResponse):
+    """默認響應類（orjson 序列化）"""
+    
+    def render(self, content: Any) -> bytes:
+        return fast_json.dumps(content)
+
 app = FastAPI(
     title=settings.APP_NAME,
     version=settings.APP_VERSION,
     description="4D科技風格的最高階自動贊助系統",
+    default_response_class=FastJSONResponse,
     lifespan=lifespan
 )
 
@@ -751,6 +1040,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 app.add_middleware(
@@ -758,6 +1048,22 @@ app.add_middleware(
     allowed_hosts=settings.ALLOWED_HOSTS
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """按路由模板記錄請求延遲（不使用原始路徑，避免標籤基數膨脹）"""
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        metrics.observe_request(
+            "api", request.method, route.path if route else "unmatched",
+            status_code, time.perf_counter() - started
+        )
+
 # 靜態文件服務
 import os
 frontend_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "frontend")
@@ -767,8 +1073,11 @@ app.mount("/static", StaticFiles(directory=frontend_path), name="static")
 async def cleanup_expired_sessions():
     """清理過期的Redis會話"""
     try:
-        # 這裡可以添加清理邏輯
-        logger.info("執行會話清理任務")
+        # 清理緩存層中已過期的條目（Redis 後端由 Redis 自行過期）
+        purged = 0
+        if db_manager.cache is not None:
+            purged = await db_manager.cache.purge_expired()
+        logger.info(f"執行會話清理任務: 清理 {purged} 個過期條目")
     except Exception as e:
         logger.error(f"會話清理任務失敗: {e}")
 
@@ -778,19 +1087,8 @@ async def update_system_stats():
         # 計算在線用戶數
         online_users = len(manager.active_connections)
         
-        # 計算今日訂單數 - 檢查資料庫連接
-        today_orders_count = 0
-        if db_manager.database is not None:
-            today = datetime.now().date()
-            today_orders_query = """
-                SELECT COUNT(*) as count FROM orders 
-                WHERE DATE(created_at) = :today
-            """
-            today_orders = await db_manager.database.fetch_one(
-                query=today_orders_query,
-                values={"today": today}
-            )
-            today_orders_count = today_orders['count'] if today_orders else 0
+        # 今日訂單數（內存計數器，無需掃描訂單表）
+        today_orders_count = daily_counters.get(ORDERS_CREATED)
         
         # 存儲統計信息
         stats = {
@@ -800,22 +1098,41 @@ async def update_system_stats():
             "last_update": datetime.utcnow().isoformat()
         }
         
-        # 如果Redis可用則存儲
-        if hasattr(db_manager, 'redis') and db_manager.redis is not None:
-            await db_manager.redis.set("system_stats", json.dumps(stats))
+        # 記錄用戶緩存命中率，用於調整緩存大小
+        cache_stats = user_cache.get_stats()
+        logger.info(
+            f"用戶緩存命中率: {cache_stats['hit_ratio']:.2%} "
+            f"(條目 {cache_stats['size']}/{cache_stats['maxsize']}, 淘汰 {cache_stats['evictions']})"
+        )
+        
+        # 記錄延遲寫入隊列狀態
+        queue_stats = write_behind.get_stats()
+        logger.info(
+            f"延遲寫入隊列深度: {queue_stats['depth']}/{queue_stats['max_size']} "
+            f"(最近回寫 {queue_stats['last_flush_ms']}ms, 丟棄 {queue_stats['dropped']})"
+        )
+        
+        # 存入緩存層，供儀表板讀取
+        if db_manager.cache is not None:
+            await db_manager.cache.set("system_stats", fast_json.dumps_str(stats), ttl=settings.SYSTEM_STATS_TTL)
         
-        # 廣播系統狀態更新
+        # 廣播系統狀態更新（每個 worker 都執行此任務，只推送給本 worker 的連接）
         await manager.broadcast({
             "type": "system_status",
             "payload": {
                 "status": "online",
                 "stats": stats
             }
-        })
+        }, local=True)
         
     except Exception as e:
         logger.error(f"更新系統統計失敗: {e}")
 
+async def update_ws_metrics():
+    """更新 WebSocket 指標（各 worker 上報本進程的值，多進程模式下求和）"""
+    metrics.WS_CONNECTIONS.set(manager.connection_count())
+    metrics.WS_QUEUE_DEPTH.set(manager.queued_messages())
+
 # API 路由
 @app.get("/")
 async def root():
@@ -836,21 +1153,38 @@ async def health_check():
         "version": settings.APP_VERSION
     }
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus 指標"""
+    await update_ws_metrics()
+    payload, content_type = metrics.render_latest()
+    return Response(content=payload, media_type=content_type)
+
 @app.get("/health")
 async def simple_health_check():
     try:
         # 檢查資料庫連接
         await db_manager.database.fetch_one("SELECT 1")
         
-        # 檢查Redis連接
-        await db_manager.redis.ping()
+        # 檢查緩存層
+        await db_manager.cache.ping()
         
         return {
             "status": "healthy",
             "timestamp": datetime.utcnow().isoformat(),
             "database": "connected",
-            "redis": "connected",
-            "websocket_connections": len(manager.active_connections)
+            "cache": db_manager.cache.get_stats(),
+            "websocket_connections": manager.connection_count(),
+            "websocket_fanout": manager.get_stats(),
+            "user_cache": user_cache.get_stats(),
+            "stock_ledger": stock_ledger.get_stats(),
+            "write_behind": write_behind.get_stats(),
+            "item_catalog": item_catalog.get_stats(),
+            "daily_counters": daily_counters.get_stats(),
+            "recent_activity": recent_activity.get_stats(),
+            "password_hasher": password_hasher.get_stats(),
+            "token_auth": token_service.get_stats(),
+            "usdt_scanner": usdt_service.get_watcher_stats()
         }
     except Exception as e:
         return {
@@ -872,7 +1206,7 @@ async def register(user: UserCreate):
         raise HTTPException(status_code=400, detail="用戶已存在")
     
     # 創建新用戶
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
     
     query = """
         INSERT INTO users (username, email, password_hash, created_at)
@@ -910,20 +1244,27 @@ async def login(user: UserLogin):
         values={"email": user.email}
     )
     
-    if not db_user or not verify_password(user.password, db_user['password_hash']):
+    if not db_user:
         raise HTTPException(status_code=400, detail="郵箱或密碼錯誤")
     
-    # 更新最後登入時間
-    await db_manager.database.execute(
-        query="UPDATE users SET last_login = :last_login WHERE id = :user_id",
-        values={"last_login": datetime.utcnow(), "user_id": db_user['id']}
-    )
+    verified, new_hash = await verify_password(user.password, db_user['password_hash'])
+    if not verified:
+        raise HTTPException(status_code=400, detail="郵箱或密碼錯誤")
     
-    # 創建訪問令牌
-    access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": str(db_user['id'])}, expires_delta=access_token_expires
-    )
+    # 更新最後登入時間（舊參數的哈希一併更新）
+    if new_hash is not None:
+        await db_manager.database.execute(
+            query="UPDATE users SET last_login = :last_login, password_hash = :password_hash WHERE id = :user_id",
+            values={"last_login": datetime.utcnow(), "password_hash": new_hash, "user_id": db_user['id']}
+        )
+    else:
+        await db_manager.database.execute(
+            query="UPDATE users SET last_login = :last_login WHERE id = :user_id",
+            values={"last_login": datetime.utcnow(), "user_id": db_user['id']}
+        )
+    
+    # 創建訪問令牌和刷新令牌
+    tokens = token_service.issue_pair(str(db_user['id']))
     
     # 記錄登入活動
     await quick_buy_manager.log_activity(
@@ -933,12 +1274,42 @@ async def login(user: UserLogin):
     return {
         "success": True,
         "data": {
-            "token": access_token,
-            "token_type": "bearer",
+            **tokens,
             "user": UserResponse.from_orm(db_user)
         }
     }
 
+@app.post("/api/auth/refresh")
+async def refresh_token(body: RefreshRequest):
+    # 刷新令牌只能使用一次，換發後舊令牌立即吊銷
+    try:
+        tokens = await token_service.refresh(body.refresh_token)
+    except InvalidToken:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="無效的認證憑證",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return {"success": True, "data": tokens}
+
+@app.post("/api/auth/logout")
+async def logout(body: Optional[LogoutRequest] = None,
+                 credentials: HTTPAuthorizationCredentials = Depends(security)):
+    claims = verify_token(credentials.credentials)
+    await token_service.revoke(claims)
+    
+    # 同時吊銷客戶端提交的刷新令牌
+    if body is not None and body.refresh_token:
+        try:
+            refresh_claims = token_service.verify(body.refresh_token, "refresh")
+            if refresh_claims.subject == claims.subject:
+                await token_service.revoke(refresh_claims)
+        except InvalidToken:
+            pass
+    
+    await quick_buy_manager.log_activity(int(claims.subject), "logout", "用戶登出")
+    return {"success": True, "message": "已登出"}
+
 @app.get("/api/auth/verify")
 async def verify_auth(current_user: dict = Depends(get_current_user)):
     return {
@@ -949,33 +1320,57 @@ async def verify_auth(current_user: dict = Depends(get_current_user)):
     }
 
 # 商品相關路由
+def _page_values(cursor: Optional[str], skip: int, limit: int) -> Dict[str, Any]:
+    """分頁查詢參數：有游標時按游標定位，否則沿用 skip"""
+    values = {"limit": limit, "skip": 0 if cursor else skip}
+    if cursor:
+        try:
+            values.update(cursor_params(cursor))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="無效的分頁游標")
+    return values
+
+def _set_next_cursor(response: Response, rows: List[Any], limit: int):
+    """通過 X-Next-Cursor 響應頭返回下一頁游標"""
+    cursor = next_cursor(rows, limit)
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+
+def _catalog_response(request: Request, payload: bytes, etag: str) -> Response:
+    """返回預序列化JSON，客戶端ETag未變時返回304"""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        item_catalog.not_modified += 1
+        return Response(status_code=304, headers=headers)
+    return Response(content=payload, media_type="application/json", headers=headers)
+
 @app.get("/api/items", response_model=List[ItemResponse])
-async def get_items(skip: int = 0, limit: int = 100):
-    query = "SELECT * FROM items WHERE is_active = 1 ORDER BY created_at DESC LIMIT :limit OFFSET :skip"
-    items = await db_manager.database.fetch_all(
-        query=query,
-        values={"limit": limit, "skip": skip}
-    )
-    return [ItemResponse(**dict(item)) for item in items]
+async def get_items(request: Request, skip: int = 0, limit: int = 100, cursor: Optional[str] = None):
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="無效的分頁游標")
+    
+    payload, rows, etag = await item_catalog.get_page(skip=skip, limit=limit, after=after)
+    response = _catalog_response(request, payload, etag)
+    _set_next_cursor(response, rows, limit)
+    return response
 
 @app.get("/api/items/quick-buy", response_model=List[ItemResponse])
-async def get_quick_buy_items():
-    query = "SELECT * FROM items WHERE is_active = 1 AND is_quick_buy = 1 ORDER BY created_at DESC"
-    items = await db_manager.database.fetch_all(query=query)
-    return [ItemResponse(**dict(item)) for item in items]
+async def get_quick_buy_items(request: Request):
+    payload, etag = await item_catalog.get_quick_buy()
+    return _catalog_response(request, payload, etag)
 
 @app.get("/api/items/{item_id}", response_model=ItemResponse)
-async def get_item(item_id: int):
-    query = "SELECT * FROM items WHERE id = :item_id AND is_active = 1"
-    item = await db_manager.database.fetch_one(
-        query=query,
-        values={"item_id": item_id}
-    )
-    
-    if not item:
+async def get_item(item_id: int, request: Request):
+    cached = await item_catalog.get_item(item_id)
+    if cached is None:
         raise HTTPException(status_code=404, detail="商品不存在")
     
-    return ItemResponse(**dict(item))
+    payload, etag = cached
+    return _catalog_response(request, payload, etag)
 
 # 訂單相關路由
 @app.post("/api/orders/quick-buy")
@@ -1002,21 +1397,25 @@ async def create_quick_buy_order(
 async def get_user_orders(
     current_user: dict = Depends(get_current_user),
     skip: int = 0,
-    limit: int = 50
+    limit: int = 50,
+    cursor: Optional[str] = None
 ):
-    query = """
+    values = _page_values(cursor, skip, limit)
+    values["user_id"] = current_user['id']
+    keyset = f"AND {KEYSET_CONDITION}" if cursor else ""
+    query = f"""
         SELECT * FROM orders 
-        WHERE user_id = :user_id 
-        ORDER BY created_at DESC 
+        WHERE user_id = :user_id {keyset}
+        ORDER BY created_at DESC, id DESC 
         LIMIT :limit OFFSET :skip
     """
     
-    orders = await db_manager.database.fetch_all(
-        query=query,
-        values={"user_id": current_user['id'], "limit": limit, "skip": skip}
-    )
+    orders = await db_manager.database.fetch_all(query=query, values=values)
     
-    return [OrderResponse(**dict(order)) for order in orders]
+    # 直接返回序列化結果，跳過 FastAPI 對返回值的再次驗證和編碼
+    response = Response(content=order_serializer.dump_many(orders), media_type="application/json")
+    _set_next_cursor(response, orders, limit)
+    return response
 
 # 用戶偏好設置路由
 @app.get("/api/user/preferences")
@@ -1070,6 +1469,39 @@ async def update_user_preferences(
     
     return {"success": True, "message": "偏好設置已更新"}
 
+# 管理員路由
+@app.post("/api/admin/users/{user_id}/deactivate")
+async def deactivate_user(user_id: int, current_admin: dict = Depends(get_current_admin)):
+    await db_manager.database.execute(
+        query="UPDATE users SET is_active = 0, updated_at = :updated_at WHERE id = :user_id",
+        values={"user_id": user_id, "updated_at": datetime.utcnow()}
+    )
+    
+    # 停用後立即使緩存失效
+    user_cache.invalidate(user_id)
+    
+    await quick_buy_manager.log_activity(
+        current_admin['id'], "deactivate_user", f"停用用戶: {user_id}"
+    )
+    
+    return {"success": True, "message": "用戶已停用"}
+
+@app.post("/api/admin/cache/catalog/invalidate")
+async def invalidate_catalog(current_admin: dict = Depends(get_current_admin)):
+    # 直接修改資料庫中的商品後，手動重新載入目錄
+    item_catalog.invalidate_all()
+    return {"success": True, "message": "商品目錄將在下次請求時重新載入"}
+
+@app.get("/api/admin/cache/stats")
+async def get_cache_stats(current_admin: dict = Depends(get_current_admin)):
+    return {
+        "success": True,
+        "data": {
+            "user_cache": user_cache.get_stats(),
+            "item_catalog": item_catalog.get_stats()
+        }
+    }
+
 # 支付方式路由
 @app.get("/api/payment/methods")
 async def get_payment_methods():
@@ -1102,38 +1534,18 @@ async def get_payment_methods():
 # 統計相關路由
 @app.get("/api/stats/dashboard")
 async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
-    # 獲取系統統計
-    system_stats_raw = await db_manager.redis.get("system_stats")
-    system_stats = json.loads(system_stats_raw) if system_stats_raw else {}
-    
-    # 獲取用戶最近活動
-    activities_query = """
-        SELECT action, description, created_at 
-        FROM activity_logs 
-        WHERE user_id = :user_id 
-        ORDER BY created_at DESC 
-        LIMIT 10
-    """
-    
-    activities = await db_manager.database.fetch_all(
-        query=activities_query,
-        values={"user_id": current_user['id']}
-    )
+    # 獲取系統統計（今日訂單數直接讀取計數器）
+    system_stats_raw = await db_manager.cache.get("system_stats")
+    system_stats = fast_json.loads(system_stats_raw) if system_stats_raw else {}
     
-    recent_activities = [
-        {
-            "type": activity['action'],
-            "message": activity['description'],
-            "timestamp": activity['created_at'].isoformat()
-        }
-        for activity in activities
-    ]
+    # 獲取用戶最近活動（環形緩衝區，未命中時才查詢 activity_logs）
+    recent_activities = await recent_activity.get(current_user['id'])
     
     return {
         "success": True,
         "data": {
             "onlineUsers": system_stats.get("online_users", 0),
-            "todayOrders": system_stats.get("today_orders", 0),
+            "todayOrders": daily_counters.get(ORDERS_CREATED),
             "systemLoad": system_stats.get("system_load", "正常"),
             "recentActivities": recent_activities
         }
@@ -1146,36 +1558,37 @@ async def websocket_endpoint(websocket: WebSocket, token: str = None):
         await websocket.close(code=1008, reason="需要認證令牌")
         return
     
+    user_id = None
     try:
-        user_id = verify_token(token)
-        await manager.connect(websocket, user_id)
+        user_id = int(verify_token(token).subject)
+        connection = await manager.connect(websocket, user_id)
         
-        # 發送歡迎消息
-        await manager.send_personal_message({
+        # 發送歡迎消息（只發給本連接，不發給該用戶的其他分頁）
+        manager.reply(connection, {
             "type": "notification",
             "payload": {
                 "message": "WebSocket連接成功！",
                 "type": "success"
             }
-        }, user_id)
+        })
         
         while True:
             # 保持連接活躍
             data = await websocket.receive_text()
-            message = json.loads(data)
+            message = fast_json.loads(data)
             
             # 處理客戶端消息
             if message.get("type") == "ping":
-                await manager.send_personal_message({
+                manager.reply(connection, {
                     "type": "pong",
                     "payload": {"timestamp": datetime.utcnow().isoformat()}
-                }, user_id)
+                })
             
     except WebSocketDisconnect:
-        manager.disconnect(user_id)
+        manager.disconnect(user_id, websocket)
     except Exception as e:
         logger.error(f"WebSocket錯誤: {e}")
-        manager.disconnect(user_id)
+        manager.disconnect(user_id, websocket)
         await websocket.close(code=1011, reason="服務器錯誤")
 
 # 錯誤處理
@@ -1207,17 +1620,26 @@ async def general_exception_handler(request, exc):
 async def get_usdt_networks():
     """獲取支持的USDT網絡"""
     try:
-        from usdt_service import USDTPaymentService
-        usdt_service = USDTPaymentService()
         networks = usdt_service.get_supported_networks()
         return {"success": True, "data": networks}
     except Exception as e:
         logger.error(f"獲取USDT網絡失敗: {e}")
         return {"success": False, "message": "獲取網絡信息失敗"}
 
+async def push_usdt_status(order: dict):
+    """USDT 訂單狀態變更時通過 WebSocket 推送給下單用戶"""
+    if order.get('user_id'):
+        await manager.send_personal_message({
+            "type": "payment_status",
+            "payload": usdt_service.status_payload(order)
+        }, order['user_id'])
+
 @app.post("/api/usdt/create-order")
-async def create_usdt_order(request: Request):
-    """創建USDT支付訂單"""
+async def create_usdt_order(request: Request,
+                            credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)):
+    """創建USDT支付訂單（登入用戶會收到狀態變更的 WebSocket 推送）"""
+    user_id = int(verify_token(credentials.credentials).subject) if credentials else None
+    
     try:
         data = await request.json()
         amount = data.get('amount')
@@ -1226,12 +1648,10 @@ async def create_usdt_order(request: Request):
         if not amount or amount <= 0:
             return {"success": False, "message": "無效的金額"}
         
-        from usdt_service import USDTPaymentService
-        usdt_service = USDTPaymentService()
-        
-        result = usdt_service.create_payment_order(
+        result = await usdt_service.create_payment_order(
             amount=amount,
-            network=network
+            network=network,
+            user_id=user_id
         )
         
         return result
@@ -1244,9 +1664,6 @@ async def create_usdt_order(request: Request):
 async def get_usdt_status(order_id: str):
     """獲取USDT支付狀態"""
     try:
-        from usdt_service import USDTPaymentService
-        usdt_service = USDTPaymentService()
-        
         result = await usdt_service.check_payment_status(order_id)
         return result
         
@@ -1258,10 +1675,7 @@ async def get_usdt_status(order_id: str):
 async def cancel_usdt_order(order_id: str):
     """取消USDT訂單"""
     try:
-        from usdt_service import USDTPaymentService
-        usdt_service = USDTPaymentService()
-        
-        result = usdt_service.cancel_order(order_id)
+        result = await usdt_service.cancel_order(order_id)
         return result
         
     except Exception as e:
@@ -1269,22 +1683,23 @@ async def cancel_usdt_order(order_id: str):
         return {"success": False, "message": "取消訂單失敗"}
 
 @app.get("/api/usdt/history")
-async def get_usdt_history(limit: int = 50):
-    """獲取USDT訂單歷史"""
+async def get_usdt_history(response: Response, limit: int = 50, cursor: Optional[str] = None):
+    """獲取USDT訂單歷史（按創建時間倒序，下一頁游標見 X-Next-Cursor 響應頭）"""
     try:
-        from usdt_service import USDTPaymentService
-        usdt_service = USDTPaymentService()
-        
-        history = usdt_service.get_order_history(limit)
-        return {"success": True, "data": history}
-        
-    except Exception as e:
-        logger.error(f"獲取USDT歷史失敗: {e}")
-        return {"success": False, "message": "獲取歷史失敗"}
+        history, next_page = await usdt_service.get_order_history(limit, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="無效的分頁游標")
+    
+    if next_page:
+        response.headers["X-Next-Cursor"] = next_page
+    return {"success": True, "data": history}
 
 if __name__ == "__main__":
     import uvicorn
     
+    # 單進程啟動；多 worker 部署使用 gunicorn_conf.py 分配訂單ID進程編號
+    use_default_worker_id(0)
+    
     logger.info(f"啟動服務器: http://{settings.HOST}:{settings.PORT}")
     logger.info(f"WebSocket服務: ws://{settings.HOST}:{settings.WS_PORT}/ws")
     logger.info(f"健康檢查: http://{settings.HOST}:{settings.PORT}/health")
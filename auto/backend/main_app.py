@@ -17,6 +17,7 @@ Main Application Server for 4D Tech Style Auto Sponsorship System
 import os
 import sys
 import json
+import time
 import asyncio
 import logging
 from datetime import datetime, timedelta
@@ -24,10 +25,9 @@ from typing import Dict, List, Optional, Any
 from pathlib import Path
 
 # Web框架
-from flask import Flask, request, jsonify, render_template, send_from_directory, session
+from flask import Flask, Response, g, request, jsonify, render_template, send_from_directory, session
 from flask_cors import CORS
 from flask_socketio import SocketIO, emit, join_room, leave_room
-from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 
 # 資料庫
@@ -36,14 +36,15 @@ from contextlib import contextmanager
 
 # 支付服務
 from payment_gateway import PaymentGateway
-from speedpay_service import SpeedPayService
-from ecpay_service import ECPayService
-from newebpay_service import NewebPayService
+from order_id import use_default_worker_id
 from webhook_handler import WebhookHandler
+from payment_reconciler import PaymentReconciler
 
 # 模型
 from models.payment import Payment
 from models.transaction import Transaction
+from password_pool import PasswordHasher, PasswordPoolBusy, SCHEME_WERKZEUG
+import metrics
 
 # 配置日誌
 logging.basicConfig(
@@ -84,6 +85,25 @@ class AppConfig:
     MAX_LOGIN_ATTEMPTS = 5
     RATE_LIMIT_PER_MINUTE = 60
     
+    # 密碼哈希（在獨立進程池中執行，舊方法的哈希登入時自動更新）
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:600000'
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_MAX_WAITING = 200
+    
+    # 啟動後在後台預熱支付服務商客戶端
+    PROVIDER_WARMUP = os.environ.get('PROVIDER_WARMUP', 'True').lower() == 'true'
+    PROVIDER_HEALTH_CHECKS = os.environ.get('PROVIDER_HEALTH_CHECKS', 'True').lower() == 'true'
+    PROVIDER_HEALTH_INTERVAL = 30  # 秒，後台探測服務商的間隔
+    
+    # 後台對賬：批量過期超時訂單，並向服務商查詢未完成訂單的狀態
+    RECONCILE_ENABLED = os.environ.get('RECONCILE_ENABLED', 'True').lower() == 'true'
+    RECONCILE_INTERVAL = int(os.environ.get('RECONCILE_INTERVAL', 60))  # 秒
+    RECONCILE_BATCH_SIZE = 200
+    RECONCILE_CONCURRENCY = 8  # 每個服務商同時進行的查詢數
+    
+    # 訂單到期時由時間輪調度過期（對賬中的批量過期作為兜底）
+    EXPIRY_SCHEDULER_ENABLED = os.environ.get('EXPIRY_SCHEDULER_ENABLED', 'True').lower() == 'true'
+    
     # WebSocket配置
     SOCKETIO_ASYNC_MODE = 'threading'
     SOCKETIO_CORS_ALLOWED_ORIGINS = "*"
@@ -108,12 +128,11 @@ socketio = SocketIO(app,
                    cors_allowed_origins=AppConfig.SOCKETIO_CORS_ALLOWED_ORIGINS,
                    async_mode=AppConfig.SOCKETIO_ASYNC_MODE)
 
-# 初始化支付服務
+# 初始化支付服務（服務商客戶端由支付閘道在首次使用時創建，與閘道共用同一實例）
 payment_gateway = PaymentGateway()
-speedpay_service = SpeedPayService()
-ecpay_service = ECPayService()
-newebpay_service = NewebPayService()
-webhook_handler = WebhookHandler()
+speedpay_service = payment_gateway.speedpay
+ecpay_service = payment_gateway.ecpay
+newebpay_service = payment_gateway.newebpay
 
 class DatabaseManager:
     """資料庫管理器"""
@@ -225,20 +244,58 @@ class DatabaseManager:
     
     def execute_query(self, query: str, params: tuple = ()) -> List[Dict]:
         """執行查詢"""
-        with self.get_connection() as conn:
+        with self.get_connection() as conn, metrics.time_query(query):
             cursor = conn.execute(query, params)
             return [dict(row) for row in cursor.fetchall()]
     
     def execute_update(self, query: str, params: tuple = ()) -> int:
         """執行更新"""
-        with self.get_connection() as conn:
+        with self.get_connection() as conn, metrics.time_query(query):
             cursor = conn.execute(query, params)
             conn.commit()
             return cursor.rowcount
+    
+    def execute_insert(self, query: str, params: tuple = ()) -> int:
+        """執行插入，返回新行的 id"""
+        with self.get_connection() as conn, metrics.time_query(query):
+            cursor = conn.execute(query, params)
+            conn.commit()
+            return cursor.lastrowid
 
 # 初始化資料庫管理器
 db_manager = DatabaseManager(AppConfig.DATABASE_PATH)
 
+def push_payment_status(order: Dict):
+    """對賬、過期調度和支付回調發現的訂單狀態變更推送給訂單房間和管理員"""
+    payload = {
+        'order_id': order['order_id'],
+        'user_id': order.get('user_id'),
+        'status': order['status'],
+        'timestamp': datetime.now().isoformat()
+    }
+    socketio.emit('payment_status', payload, room=order['order_id'])
+    socketio.emit('payment_status', payload, room='admin')
+
+payment_reconciler = PaymentReconciler(
+    payment_gateway,
+    db_manager,
+    interval=AppConfig.RECONCILE_INTERVAL,
+    batch_size=AppConfig.RECONCILE_BATCH_SIZE,
+    concurrency=AppConfig.RECONCILE_CONCURRENCY,
+    notify=push_payment_status
+)
+
+# 支付回調（經支付閘道驗證並更新訂單，同時丟棄輪詢緩存的服務商狀態）
+webhook_handler = WebhookHandler(payment_gateway, notify=push_payment_status)
+
+# 密碼哈希進程池
+password_hasher = PasswordHasher(
+    scheme=SCHEME_WERKZEUG,
+    params=AppConfig.PASSWORD_HASH_METHOD,
+    workers=AppConfig.PASSWORD_HASH_WORKERS,
+    max_waiting=AppConfig.PASSWORD_HASH_MAX_WAITING
+)
+
 class AuthManager:
     """認證管理器"""
     
@@ -246,7 +303,7 @@ class AuthManager:
     def create_user(username: str, email: str, password: str, phone: str = None) -> Dict:
         """創建用戶"""
         try:
-            password_hash = generate_password_hash(password)
+            password_hash = password_hasher.hash_sync(password)
             
             query = '''
                 INSERT INTO users (username, email, password_hash, phone)
@@ -272,6 +329,8 @@ class AuthManager:
                 return {'success': False, 'message': '電子郵件已存在'}
             else:
                 return {'success': False, 'message': '創建用戶失敗'}
+        except PasswordPoolBusy as e:
+            return {'success': False, 'message': str(e)}
         except Exception as e:
             logger.error(f"創建用戶失敗: {e}")
             return {'success': False, 'message': '系統錯誤'}
@@ -288,14 +347,21 @@ class AuthManager:
             if not user['is_active']:
                 return {'success': False, 'message': '帳戶已停用'}
             
-            if not check_password_hash(user['password_hash'], password):
+            verified, new_hash = password_hasher.verify_sync(password, user['password_hash'])
+            if not verified:
                 return {'success': False, 'message': '密碼錯誤'}
             
-            # 更新最後登入時間
-            db_manager.execute_update(
-                'UPDATE users SET updated_at = CURRENT_TIMESTAMP WHERE id = ?',
-                (user['id'],)
-            )
+            # 更新最後登入時間（舊方法的哈希一併更新）
+            if new_hash is not None:
+                db_manager.execute_update(
+                    'UPDATE users SET password_hash = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                    (new_hash, user['id'])
+                )
+            else:
+                db_manager.execute_update(
+                    'UPDATE users SET updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                    (user['id'],)
+                )
             
             logger.info(f"用戶登入成功: {email}")
             
@@ -311,6 +377,8 @@ class AuthManager:
                 'message': '登入成功'
             }
             
+        except PasswordPoolBusy as e:
+            return {'success': False, 'message': str(e)}
         except Exception as e:
             logger.error(f"用戶認證失敗: {e}")
             return {'success': False, 'message': '系統錯誤'}
@@ -333,6 +401,21 @@ class AuthManager:
         )
         return users[0] if users else None
 
+# 請求指標
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """按路由模板記錄請求延遲"""
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe_request('app', request.method, route, response.status_code, time.perf_counter() - started)
+    return response
+
 # 路由定義
 
 @app.route('/')
@@ -347,6 +430,12 @@ def static_files(filename):
 
 # API路由
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus 指標"""
+    payload, content_type = metrics.render_latest()
+    return Response(payload, mimetype=content_type)
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """健康檢查"""
@@ -358,7 +447,10 @@ def health_check():
             'database': 'connected',
             'payment_gateway': 'active',
             'websocket': 'running'
-        }
+        },
+        'providers': payment_gateway.get_provider_stats(),
+        'provider_health': payment_gateway.get_health_stats(),
+        'reconciler': payment_reconciler.get_stats()
     })
 
 @app.route('/api/auth/register', methods=['POST'])
@@ -545,12 +637,14 @@ def admin_dashboard():
 def handle_connect():
     """WebSocket連接"""
     logger.info(f"WebSocket客戶端連接: {request.sid}")
+    metrics.WS_CONNECTIONS.inc()
     emit('connected', {'message': '連接成功'})
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """WebSocket斷開連接"""
     logger.info(f"WebSocket客戶端斷開: {request.sid}")
+    metrics.WS_CONNECTIONS.dec()
 
 @socketio.on('join_room')
 def handle_join_room(data):
@@ -610,6 +704,9 @@ def create_directories():
 def main():
     """主函數"""
     try:
+        # 單進程啟動，與 FastAPI 服務（默認 0）使用不同的訂單ID進程編號
+        use_default_worker_id(1)
+        
         # 創建必要目錄
         create_directories()
         
@@ -618,6 +715,15 @@ def main():
         logger.info(f"調試模式: {AppConfig.DEBUG}")
         logger.info(f"資料庫路徑: {AppConfig.DATABASE_PATH}")
         
+        if AppConfig.PROVIDER_WARMUP:
+            payment_gateway.warm_up()
+        if AppConfig.PROVIDER_HEALTH_CHECKS:
+            payment_gateway.start_health_checks(AppConfig.PROVIDER_HEALTH_INTERVAL)
+        if AppConfig.EXPIRY_SCHEDULER_ENABLED:
+            payment_gateway.start_expiry(push_payment_status)
+        if AppConfig.RECONCILE_ENABLED:
+            payment_reconciler.start()
+        
         # 啟動應用
         socketio.run(
             app,
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - Prometheus 指標
+Prometheus Metrics for 4D Tech Style Auto Sponsorship System
+
+主要功能:
+- 按路由模板的請求延遲直方圖（FastAPI 與 Flask 應用共用）
+- 按語句名稱的資料庫查詢延遲
+- WebSocket 連接數與發送隊列深度
+- 速買成功/失敗計數
+- 支付服務商請求延遲與錯誤數（並通知觀察者，例如熔斷器）
+- 多進程模式（gunicorn 多 worker）下彙總所有 worker 的指標
+
+多進程部署時需要在啟動前設置 PROMETHEUS_MULTIPROC_DIR 指向一個空目錄，
+並在 worker 退出時清理其指標文件（見 gunicorn_conf.py）。
+"""
+
+import os
+import re
+import time
+import asyncio
+import functools
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+)
+from prometheus_client import multiprocess
+
+MULTIPROC_DIR_ENV = 'PROMETHEUS_MULTIPROC_DIR'
+
+# 查詢延遲較短，使用更細的桶
+DB_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds',
+    'HTTP 請求延遲（按路由模板）',
+    ['app', 'method', 'route', 'status']
+)
+
+DB_QUERY_LATENCY = Histogram(
+    'db_query_duration_seconds',
+    '資料庫語句延遲（按語句名稱）',
+    ['statement'],
+    buckets=DB_BUCKETS
+)
+
+WS_CONNECTIONS = Gauge(
+    'websocket_connections',
+    'WebSocket 連接數',
+    multiprocess_mode='livesum'
+)
+
+WS_QUEUE_DEPTH = Gauge(
+    'websocket_outbound_queue_depth',
+    'WebSocket 發送隊列中等待的消息數',
+    multiprocess_mode='livesum'
+)
+
+QUICK_BUY_ORDERS = Counter(
+    'quick_buy_orders_total',
+    '速買請求數',
+    ['result', 'reason']
+)
+
+PROVIDER_LATENCY = Histogram(
+    'payment_provider_request_duration_seconds',
+    '支付服務商 API 請求延遲（含重試）',
+    ['provider', 'endpoint']
+)
+
+PROVIDER_ERRORS = Counter(
+    'payment_provider_request_errors_total',
+    '支付服務商 API 請求失敗數',
+    ['provider', 'endpoint', 'error']
+)
+
+@functools.lru_cache(maxsize=1024)
+def statement_name(query: str) -> str:
+    """從 SQL 推導低基數的語句名稱，例如 select_orders、update_items"""
+    match = re.match(r'\s*(\w+)', query)
+    if match is None:
+        return 'unknown'
+    verb = match.group(1).lower()
+
+    if verb in ('insert', 'replace'):
+        table = re.search(r'\binto\s+`?(\w+)', query, re.IGNORECASE)
+    elif verb == 'update':
+        table = re.search(r'\bupdate\s+`?(\w+)', query, re.IGNORECASE)
+    else:
+        table = re.search(r'\bfrom\s+`?(\w+)', query, re.IGNORECASE)
+    return f"{verb}_{table.group(1).lower()}" if table else verb
+
+@contextmanager
+def time_query(query):
+    """記錄一條語句的耗時"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        DB_QUERY_LATENCY.labels(statement_name(str(query))).observe(time.perf_counter() - started)
+
+def observe_request(app: str, method: str, route: str, status: int, seconds: float):
+    REQUEST_LATENCY.labels(app, method, route, str(status)).observe(seconds)
+
+def instrument_sqlalchemy(engine):
+    """為 SQLAlchemy 引擎（異步引擎傳入 sync_engine）註冊語句計時"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['query_started'].pop()
+        DB_QUERY_LATENCY.labels(statement_name(statement)).observe(time.perf_counter() - started)
+
+    @event.listens_for(engine, 'handle_error')
+    def _error(context):
+        # 執行失敗時 after_cursor_execute 不會觸發
+        if context.connection is not None and context.connection.info.get('query_started'):
+            context.connection.info['query_started'].pop()
+
+# 服務商請求結果的觀察者（例如熔斷器），調用參數為 (provider, endpoint, error, seconds)
+_provider_observers: List[Callable] = []
+
+def add_provider_observer(observer: Callable):
+    _provider_observers.append(observer)
+
+def _observe_provider(provider: str, endpoint: str, error: Optional[BaseException], seconds: float):
+    PROVIDER_LATENCY.labels(provider, endpoint).observe(seconds)
+    if error is not None:
+        PROVIDER_ERRORS.labels(provider, endpoint, type(error).__name__).inc()
+    for observer in _provider_observers:
+        observer(provider, endpoint, error, seconds)
+
+def provider_request(provider: str):
+    """裝飾支付服務的 _make_request(method, endpoint, ...)（同步或異步），記錄延遲和錯誤"""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(self, method, endpoint, *args, **kwargs):
+                started = time.perf_counter()
+                error = None
+                try:
+                    return await func(self, method, endpoint, *args, **kwargs)
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    _observe_provider(provider, endpoint, error, time.perf_counter() - started)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(self, method, endpoint, *args, **kwargs):
+            started = time.perf_counter()
+            error = None
+            try:
+                return func(self, method, endpoint, *args, **kwargs)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                _observe_provider(provider, endpoint, error, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+def render_latest() -> Tuple[bytes, str]:
+    """輸出指標；多進程模式下彙總所有 worker 寫入的數據"""
+    if os.environ.get(MULTIPROC_DIR_ENV):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
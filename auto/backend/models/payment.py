@@ -12,12 +12,13 @@ Payment Model for 4D Tech Style Auto Sponsorship System
 """
 
 import json
-import uuid
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 from enum import Enum
 from decimal import Decimal, ROUND_HALF_UP
 
+from order_id import generate_order_id
+
 class PaymentStatus(Enum):
     """支付狀態枚舉"""
     PENDING = 'pending'          # 待支付
@@ -92,9 +93,7 @@ class PaymentOrder:
     
     def _generate_order_id(self) -> str:
         """生成訂單ID"""
-        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-        random_part = str(uuid.uuid4()).replace('-', '')[:8].upper()
-        return f"JY{timestamp}{random_part}"
+        return generate_order_id('JY')
     
     def validate(self) -> Dict[str, Any]:
         """驗證訂單數據"""
@@ -17,7 +17,6 @@ import json
 import time
 import hashlib
 import logging
-import requests
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 from urllib.parse import urlencode, quote_plus
@@ -26,6 +25,9 @@ import base64
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import pad, unpad
 
+import metrics
+from provider_http import ProviderHTTPClient
+
 logger = logging.getLogger(__name__)
 
 class NewebPayConfig:
@@ -42,9 +44,11 @@ class NewebPayConfig:
     IS_SANDBOX = os.environ.get('NEWEBPAY_SANDBOX', 'True').lower() == 'true'
     
     # 請求配置
-    TIMEOUT = 30
+    TIMEOUT = 30  # 單次請求超時（秒）
+    DEADLINE = 60  # 含重試的總時間（秒）
     MAX_RETRIES = 3
-    RETRY_DELAY = 1
+    RETRY_DELAY = 1  # 退避基數（秒），實際等待為 0 ~ RETRY_DELAY * 2^重試次數 的隨機值
+    MAX_CONNECTIONS = 20
     
     # 支付配置
     CURRENCY = 'TWD'
@@ -166,23 +170,31 @@ class NewebPayService:
     def __init__(self):
         """初始化藍新金流服務"""
         self.config = NewebPayConfig()
-        self.session = requests.Session()
         
-        # 設置請求頭
-        self.session.headers.update({
-            'Content-Type': 'application/x-www-form-urlencoded',
-            'User-Agent': 'JY-4D-Tech-Sponsor-System/1.0',
-            'Accept': 'application/json'
-        })
+        # 共享連接池的異步客戶端（超時、截止時間和退避見 provider_http.py）
+        self.http = ProviderHTTPClient(
+            name='newebpay',
+            base_url=self.config.BASE_URL,
+            headers={
+                'Content-Type': 'application/x-www-form-urlencoded',
+                'User-Agent': 'JY-4D-Tech-Sponsor-System/1.0',
+                'Accept': 'application/json'
+            },
+            timeout=self.config.TIMEOUT,
+            deadline=self.config.DEADLINE,
+            max_retries=self.config.MAX_RETRIES,
+            retry_delay=self.config.RETRY_DELAY,
+            max_connections=self.config.MAX_CONNECTIONS
+        )
         
         logger.info(f"藍新金流服務初始化完成 - 環境: {'測試' if self.config.IS_SANDBOX else '正式'}")
     
-    def is_available(self) -> bool:
+    async def is_available(self) -> bool:
         """檢查服務可用性"""
         try:
             # 藍新沒有健康檢查接口，嘗試訪問主頁
-            response = self.session.get(self.config.BASE_URL, timeout=10)
-            return response.status_code == 200
+            await self.http.request('GET', '', timeout=10, deadline=10)
+            return True
         except Exception as e:
             logger.warning(f"藍新金流服務不可用: {e}")
             return False
@@ -223,7 +235,7 @@ class NewebPayService:
         # 四捨五入到分
         return float(Decimal(str(fee)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
     
-    def create_payment(self, 
+    async def create_payment(self, 
                       order_id: str,
                       amount: float,
                       description: str,
@@ -308,7 +320,7 @@ class NewebPayService:
             }
             
             # 發送請求
-            response = self._make_request('POST', '/MPG/mpg_gateway', request_data)
+            response = await self._make_request('POST', '/MPG/mpg_gateway', request_data)
             
             if response:
                 # 藍新金流返回HTML表單，需要解析
@@ -355,7 +367,7 @@ class NewebPayService:
                 'message': '系統錯誤，請稍後重試'
             }
     
-    def query_payment_status(self, order_id: str) -> Dict:
+    async def query_payment_status(self, order_id: str) -> Dict:
         """查詢支付狀態"""
         try:
             # 構建查詢資料
@@ -370,7 +382,7 @@ class NewebPayService:
             }
             
             # 發送請求
-            response = self._make_request('POST', '/API/QueryTradeInfo', query_data)
+            response = await self._make_request('POST', '/API/QueryTradeInfo', query_data)
             
             if response:
                 try:
@@ -517,35 +529,14 @@ class NewebPayService:
             'cvs': self.config.CVS_CODES
         }
     
-    def _make_request(self, method: str, endpoint: str, data: Dict = None) -> str:
-        """發送HTTP請求"""
-        url = f"{self.config.BASE_URL}{endpoint}"
-        
-        for attempt in range(self.config.MAX_RETRIES):
-            try:
-                if method.upper() == 'GET':
-                    response = self.session.get(url, params=data, timeout=self.config.TIMEOUT)
-                else:
-                    response = self.session.post(url, data=data, timeout=self.config.TIMEOUT)
-                
-                response.raise_for_status()
-                return response.text
-                    
-            except requests.exceptions.Timeout:
-                logger.warning(f"藍新金流API請求超時 (嘗試 {attempt + 1}/{self.config.MAX_RETRIES})")
-                if attempt < self.config.MAX_RETRIES - 1:
-                    time.sleep(self.config.RETRY_DELAY * (attempt + 1))
-                    continue
-                raise
-                
-            except requests.exceptions.RequestException as e:
-                logger.error(f"藍新金流API請求失敗: {e}")
-                if attempt < self.config.MAX_RETRIES - 1:
-                    time.sleep(self.config.RETRY_DELAY * (attempt + 1))
-                    continue
-                raise
-        
-        return ''
+    @metrics.provider_request('newebpay')
+    async def _make_request(self, method: str, endpoint: str, data: Dict = None) -> str:
+        """發送HTTP請求（失敗時按退避策略重試，超過截止時間拋出異常）"""
+        if method.upper() == 'GET':
+            response = await self.http.request('GET', endpoint, params=data)
+        else:
+            response = await self.http.request('POST', endpoint, data=data)
+        return response.text
     
     def _encrypt_trade_info(self, trade_info: Dict) -> str:
         """加密交易資料"""
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 訂單ID生成器
+Order ID Generator for 4D Tech Style Auto Sponsorship System
+
+主要功能:
+- 類 Snowflake 的 63 位訂單ID（毫秒時間戳 + 進程編號 + 序號）
+- 按時間排序，多進程不重複，無需訪問資料庫
+- 固定長度大寫 base36 編碼，字典序即時間序
+- 符合綠界（20位字母數字）與藍新（30位字母數字底線）的訂單編號規則
+
+位元分配: 41 位毫秒時間戳（自 2024-01-01 起約 69 年）| 10 位進程編號 | 12 位序號
+
+進程編號必須由部署指定（ORDER_ID_WORKER_ID，0-1023，所有主機的所有進程互不相同），
+不從主機名或進程ID推導，避免不同主機或進程ID重用時編號相同。
+- gunicorn: gunicorn_conf.py 按 ORDER_ID_WORKER_BASE + worker 序號為每個 worker 設置
+- 單進程啟動（python main.py / python main_app.py）: 未配置時使用該入口的默認編號
+未配置時第一次生成訂單ID即拋出 RuntimeError。
+"""
+
+import os
+import time
+import threading
+
+# 自定義紀元 2024-01-01T00:00:00Z（毫秒）
+EPOCH_MS = 1704067200000
+
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+# 63 位整數的 base36 編碼最長 13 位
+ENCODED_LENGTH = 13
+ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+def _configured_worker_id() -> int:
+    """讀取部署指定的進程編號，未配置時拋出 RuntimeError"""
+    configured = os.environ.get('ORDER_ID_WORKER_ID')
+    if configured is None:
+        raise RuntimeError(
+            "未配置 ORDER_ID_WORKER_ID：多進程或多主機部署必須為每個進程指定 "
+            f"0-{MAX_WORKER_ID} 之間的唯一編號（gunicorn 請使用 gunicorn_conf.py）"
+        )
+    return int(configured)
+
+def use_default_worker_id(worker_id: int):
+    """單進程入口調用：未配置 ORDER_ID_WORKER_ID 時使用該入口的默認編號（子進程繼承）"""
+    os.environ.setdefault('ORDER_ID_WORKER_ID', str(worker_id))
+
+def encode_base36(value: int) -> str:
+    """把整數編碼為固定長度的大寫 base36 字符串"""
+    chars = []
+    while value:
+        value, remainder = divmod(value, 36)
+        chars.append(ALPHABET[remainder])
+    return ''.join(reversed(chars)).rjust(ENCODED_LENGTH, '0')
+
+class OrderIdGenerator:
+    """訂單ID生成器（線程安全）"""
+
+    def __init__(self, worker_id: int = None):
+        # 未指定時在第一次生成時讀取配置，入口有機會先設置默認編號
+        self._worker_id = None
+        if worker_id is not None:
+            self._set_worker_id(worker_id)
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def _set_worker_id(self, worker_id: int):
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"worker_id 必須在 0-{MAX_WORKER_ID} 之間")
+        self._worker_id = worker_id
+
+    @property
+    def worker_id(self) -> int:
+        if self._worker_id is None:
+            self._set_worker_id(_configured_worker_id())
+        return self._worker_id
+
+    def next_int(self) -> int:
+        """生成下一個整數ID"""
+        worker_id = self.worker_id
+        with self._lock:
+            now_ms = int(time.time() * 1000) - EPOCH_MS
+
+            # 時鐘回撥時沿用上一個時間戳，保證單調遞增
+            if now_ms < self._last_ms:
+                now_ms = self._last_ms
+
+            if now_ms == self._last_ms:
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    # 同一毫秒內序號用盡，等待下一毫秒
+                    while now_ms <= self._last_ms:
+                        now_ms = int(time.time() * 1000) - EPOCH_MS
+            else:
+                self._sequence = 0
+
+            self._last_ms = now_ms
+            return (now_ms << (WORKER_BITS + SEQUENCE_BITS)) | (worker_id << SEQUENCE_BITS) | self._sequence
+
+    def generate(self, prefix: str = '') -> str:
+        """生成帶前綴的訂單ID，例如 QB02T829UX2E6TC"""
+        return f"{prefix}{encode_base36(self.next_int())}"
+
+# 進程內共享的生成器
+order_id_generator = OrderIdGenerator()
+
+def generate_order_id(prefix: str = '') -> str:
+    """使用共享生成器生成訂單ID"""
+    return order_id_generator.generate(prefix)
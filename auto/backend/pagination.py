@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 游標分頁
+Keyset Pagination for 4D Tech Style Auto Sponsorship System
+
+主要功能:
+- 按 (created_at, id) 倒序的游標分頁
+- 不透明游標編碼與解碼
+- 生成游標過濾條件
+"""
+
+import base64
+from datetime import datetime
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+# 游標之後的記錄（按 created_at DESC, id DESC 排序）
+KEYSET_CONDITION = """
+    (created_at < :cursor_created_at
+     OR (created_at = :cursor_created_at AND id < :cursor_id))
+"""
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    """把 (created_at, id) 編碼為不透明游標"""
+    raw = f"{created_at.isoformat()}|{row_id}".encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """解碼游標，格式錯誤時拋出 ValueError"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, row_id = base64.urlsafe_b64decode(padded).decode('utf-8').split('|')
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception as e:
+        raise ValueError(f"無效的分頁游標: {cursor}") from e
+
+def cursor_params(cursor: str) -> Dict[str, Any]:
+    """游標對應的查詢參數"""
+    created_at, row_id = decode_cursor(cursor)
+    return {"cursor_created_at": created_at, "cursor_id": row_id}
+
+def next_cursor(rows: Sequence[Any], limit: int) -> Optional[str]:
+    """本頁已滿時返回下一頁游標，否則返回 None"""
+    if not rows or len(rows) < limit:
+        return None
+    last = rows[-1]
+    return encode_cursor(last['created_at'], last['id'])
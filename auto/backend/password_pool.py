@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 密碼哈希進程池
+Password Hashing Pool for 4D Tech Style Auto Sponsorship System
+
+主要功能:
+- bcrypt / werkzeug 密碼哈希與驗證在獨立進程池中執行，不阻塞事件循環
+- 並發上限與排隊上限，排隊過長時快速拒絕
+- 排隊時間與計算時間統計
+- 驗證通過且哈希參數過時（同一算法、參數較弱）時返回新哈希，由調用方寫回
+
+同時提供異步接口（FastAPI）和同步接口（Flask 線程模式）。
+"""
+
+import time
+import asyncio
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SCHEME_BCRYPT = 'bcrypt'      # passlib bcrypt（main.py）
+SCHEME_WERKZEUG = 'werkzeug'  # werkzeug generate_password_hash（main_app.py）
+
+# 以下函數在工作進程中執行
+
+_contexts: Dict[int, Any] = {}
+
+def _bcrypt_context(rounds: int):
+    """每個工作進程按 rounds 緩存一個 CryptContext"""
+    context = _contexts.get(rounds)
+    if context is None:
+        from passlib.context import CryptContext
+        # 低於當前 rounds 的舊哈希視為需要更新
+        context = CryptContext(
+            schemes=["bcrypt"],
+            deprecated="auto",
+            bcrypt__default_rounds=rounds,
+            bcrypt__min_rounds=rounds
+        )
+        _contexts[rounds] = context
+    return context
+
+def _werkzeug_method(hashed: str) -> str:
+    return hashed.split('$', 1)[0]
+
+def _werkzeug_params(method: str) -> Tuple[str, Tuple[int, ...]]:
+    """拆分 werkzeug method 為 (算法, 數值參數)，例如 pbkdf2:sha256:600000 -> ('pbkdf2:sha256', (600000,))"""
+    name = []
+    numbers = []
+    for part in method.split(':'):
+        if part.isdigit():
+            numbers.append(int(part))
+        elif numbers:
+            return method, ()  # 無法識別的格式
+        else:
+            name.append(part)
+    return ':'.join(name), tuple(numbers)
+
+def _werkzeug_needs_update(hashed: str, method: str) -> bool:
+    """只有與配置相同算法且參數較弱時才需要更新；其他算法（例如 scrypt）保持不變，避免降級"""
+    stored_name, stored_numbers = _werkzeug_params(_werkzeug_method(hashed))
+    target_name, target_numbers = _werkzeug_params(method)
+    if stored_name != target_name or len(stored_numbers) != len(target_numbers):
+        return False
+    return (all(old <= new for old, new in zip(stored_numbers, target_numbers))
+            and stored_numbers != target_numbers)
+
+def _hash_in_worker(scheme: str, password: str, params: Any) -> str:
+    if scheme == SCHEME_BCRYPT:
+        return _bcrypt_context(params).hash(password)
+    from werkzeug.security import generate_password_hash
+    return generate_password_hash(password, method=params)
+
+def _verify_in_worker(scheme: str, password: str, hashed: str, params: Any) -> Tuple[bool, Optional[str]]:
+    if scheme == SCHEME_BCRYPT:
+        return _bcrypt_context(params).verify_and_update(password, hashed)
+
+    from werkzeug.security import generate_password_hash, check_password_hash
+    if not check_password_hash(hashed, password):
+        return False, None
+    if _werkzeug_needs_update(hashed, params):
+        return True, generate_password_hash(password, method=params)
+    return True, None
+
+def _warm_up():
+    """預先載入哈希庫，避免第一次請求承擔導入時間"""
+    try:
+        import passlib.context  # noqa: F401
+    except ImportError:
+        pass
+
+class PasswordPoolBusy(Exception):
+    """排隊請求過多"""
+
+class PasswordHasher:
+    """在進程池中執行密碼哈希"""
+
+    def __init__(self,
+                 scheme: str = SCHEME_BCRYPT,
+                 params: Any = 12,
+                 workers: int = 2,
+                 max_concurrency: Optional[int] = None,
+                 max_waiting: int = 100):
+        """
+        params: bcrypt 為 rounds，werkzeug 為 method（例如 pbkdf2:sha256:600000）
+        max_concurrency: 同時提交到進程池的任務數，默認等於進程數
+        max_waiting: 等待提交的請求上限，超過時拋出 PasswordPoolBusy
+        """
+        self.scheme = scheme
+        self.params = params
+        self.workers = workers
+        self.max_concurrency = max_concurrency or workers
+        self.max_waiting = max_waiting
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+        self._async_slots: Optional[asyncio.Semaphore] = None
+        self._sync_slots = threading.BoundedSemaphore(self.max_concurrency)
+
+        # 統計信息
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.total_queue_ms = 0.0
+        self.max_queue_ms = 0.0
+        self.total_run_ms = 0.0
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        # 首次使用時才創建；spawn 避免在持有線程和事件循環的進程中 fork
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('spawn'),
+                        initializer=_warm_up
+                    )
+        return self._executor
+
+    def _admit(self):
+        if self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise PasswordPoolBusy("密碼驗證請求過多，請稍後再試")
+        self.waiting += 1
+
+    def _started(self, queued_at: float) -> float:
+        self.waiting -= 1
+        self.in_flight += 1
+        started = time.perf_counter()
+        queue_ms = (started - queued_at) * 1000
+        self.total_queue_ms += queue_ms
+        self.max_queue_ms = max(self.max_queue_ms, queue_ms)
+        return started
+
+    def _finished(self, started: float):
+        self.in_flight -= 1
+        self.completed += 1
+        self.total_run_ms += (time.perf_counter() - started) * 1000
+
+    async def _run_async(self, func, *args):
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.max_concurrency)
+
+        self._admit()
+        queued_at = time.perf_counter()
+        try:
+            await self._async_slots.acquire()
+        except BaseException:
+            self.waiting -= 1
+            raise
+        started = self._started(queued_at)
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, func, *args)
+        finally:
+            self._finished(started)
+            self._async_slots.release()
+
+    def _run_sync(self, func, *args):
+        # 計數器在多線程下只用於統計，不要求精確
+        self._admit()
+        queued_at = time.perf_counter()
+        self._sync_slots.acquire()
+        started = self._started(queued_at)
+        try:
+            return self.executor.submit(func, *args).result()
+        finally:
+            self._finished(started)
+            self._sync_slots.release()
+
+    def _count_rehash(self, result: Tuple[bool, Optional[str]]) -> Tuple[bool, Optional[str]]:
+        if result[1] is not None:
+            self.rehashed += 1
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self._run_async(_hash_in_worker, self.scheme, password, self.params)
+
+    async def verify(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        """返回 (是否匹配, 新哈希)；新哈希不為 None 時調用方應寫回"""
+        return self._count_rehash(
+            await self._run_async(_verify_in_worker, self.scheme, password, hashed, self.params)
+        )
+
+    def hash_sync(self, password: str) -> str:
+        return self._run_sync(_hash_in_worker, self.scheme, password, self.params)
+
+    def verify_sync(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        return self._count_rehash(
+            self._run_sync(_verify_in_worker, self.scheme, password, hashed, self.params)
+        )
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取統計信息"""
+        return {
+            'scheme': self.scheme,
+            'workers': self.workers,
+            'max_concurrency': self.max_concurrency,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'rehashed': self.rehashed,
+            'avg_queue_ms': round(self.total_queue_ms / self.completed, 2) if self.completed else 0.0,
+            'max_queue_ms': round(self.max_queue_ms, 2),
+            'avg_run_ms': round(self.total_run_ms / self.completed, 2) if self.completed else 0.0
+        }
@@ -14,19 +14,27 @@ Payment Gateway for 4D Tech Style Auto Sponsorship System
 
 import os
 import json
+import time
 import uuid
 import hashlib
 import logging
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any, Tuple
+from typing import Callable, Dict, List, Optional, Any, Tuple
 from decimal import Decimal, ROUND_HALF_UP
 from enum import Enum
 
 # 支付服務
+from order_id import generate_order_id
 from speedpay_service import SpeedPayService
 from ecpay_service import ECPayService
 from newebpay_service import NewebPayService
 from usdt_service import USDTPaymentService
+from lazy_provider import LazyProvider, warm_up_all
+from provider_http import SyncFacade
+from provider_health import ProviderHealthMonitor
+from status_coalescer import StatusQueryCoalescer
+from expiry_scheduler import ExpiryScheduler
+import metrics
 
 # 模型
 from models.payment import Payment
@@ -64,16 +72,42 @@ class PaymentGateway:
     
     def __init__(self):
         """初始化支付閘道"""
-        self.speedpay = SpeedPayService()
-        self.ecpay = ECPayService()
-        self.newebpay = NewebPayService()
-        self.usdt = USDTPaymentService()
+        # 服務商客戶端在首次使用時創建，避免拖慢啟動或被不可用的端點阻塞
+        # 服務方法是異步的，閘道在 Flask 線程中通過 SyncFacade 同步調用
+        self.speedpay = LazyProvider(lambda: SyncFacade(SpeedPayService()), 'speedpay')
+        self.ecpay = LazyProvider(lambda: SyncFacade(ECPayService()), 'ecpay')
+        self.newebpay = LazyProvider(lambda: SyncFacade(NewebPayService()), 'newebpay')
+        self.usdt = LazyProvider(lambda: SyncFacade(USDTPaymentService()), 'usdt')
+        self.provider_map = {
+            'speedpay': self.speedpay,
+            'ecpay': self.ecpay,
+            'newebpay': self.newebpay,
+            'usdt': self.usdt
+        }
+        
+        # 健康狀態由後台探測和真實請求驅動，列表和下單只讀緩存狀態
+        self.health = ProviderHealthMonitor(
+            probes={name: (lambda provider=provider: provider.is_available())
+                    for name, provider in self.provider_map.items()}
+        )
+        metrics.add_provider_observer(self.health.observe_request)
+        
+        # 服務商狀態查詢：同一訂單的並發輪詢合併為一次上游請求，結果短時間緩存
+        self.status_queries = StatusQueryCoalescer(
+            ttl={'speedpay': 5, 'ecpay': 10, 'newebpay': 10, 'usdt': 3},
+            min_interval=3
+        )
+        
+        # 訂單過期時間輪：到期的待支付訂單批量過期並推送
+        self.expiry = ExpiryScheduler('payment_orders', self.expire_order_ids)
+        self.on_status_change: Optional[Callable[[Dict], None]] = None
         
         # 支付方式配置
         self.payment_methods = {
             PaymentMethod.SPEEDPAY.value: {
                 'name': '速買配',
                 'service': self.speedpay,
+                'provider': 'speedpay',
                 'enabled': True,
                 'priority': 1,
                 'fee_rate': 0.025,  # 2.5%
@@ -86,6 +120,7 @@ class PaymentGateway:
             PaymentMethod.ECPAY.value: {
                 'name': '綠界科技',
                 'service': self.ecpay,
+                'provider': 'ecpay',
                 'enabled': True,
                 'priority': 2,
                 'fee_rate': 0.028,  # 2.8%
@@ -98,6 +133,7 @@ class PaymentGateway:
             PaymentMethod.NEWEBPAY.value: {
                 'name': '藍新金流',
                 'service': self.newebpay,
+                'provider': 'newebpay',
                 'enabled': True,
                 'priority': 3,
                 'fee_rate': 0.030,  # 3.0%
@@ -110,6 +146,7 @@ class PaymentGateway:
             PaymentMethod.USDT_ERC20.value: {
                 'name': 'USDT (ERC-20)',
                 'service': self.usdt,
+                'provider': 'usdt',
                 'enabled': True,
                 'priority': 4,
                 'fee_rate': 0.005,  # 0.5%
@@ -124,6 +161,7 @@ class PaymentGateway:
             PaymentMethod.USDT_TRC20.value: {
                 'name': 'USDT (TRC-20)',
                 'service': self.usdt,
+                'provider': 'usdt',
                 'enabled': True,
                 'priority': 5,
                 'fee_rate': 0.003,  # 0.3%
@@ -239,6 +277,108 @@ class PaymentGateway:
         
         logger.info("支付閘道初始化完成")
     
+    @property
+    def providers(self) -> List[LazyProvider]:
+        return list(self.provider_map.values())
+    
+    def warm_up(self):
+        """在後台創建所有服務商客戶端，不阻塞啟動"""
+        warm_up_all(self.providers)
+    
+    def start_health_checks(self, interval: float = 30):
+        """啟動後台健康探測"""
+        self.health.interval = interval
+        self.health.start()
+    
+    def start_expiry(self, on_status_change: Optional[Callable[[Dict], None]] = None, page_size: int = 10000):
+        """載入所有待支付訂單的過期時間並啟動過期調度（USDT 訂單由 USDT 服務自己的調度過期）"""
+        from main_app import db_manager
+        
+        self.on_status_change = on_status_change
+        last_id = 0
+        while True:
+            page = db_manager.execute_query(
+                'SELECT id, expires_at FROM payment_orders WHERE status = ? AND id > ? ORDER BY id LIMIT ?',
+                (PaymentStatus.PENDING.value, last_id, page_size)
+            )
+            if not page:
+                break
+            self.expiry.load((row['id'], row['expires_at']) for row in page if row['expires_at'])
+            last_id = page[-1]['id']
+        self.expiry.start()
+        try:
+            self.usdt.start_expiry()
+        except Exception as e:
+            logger.error(f"啟動 USDT 訂單過期調度失敗: {e}")
+    
+    def expire_order_ids(self, ids: List[int]) -> int:
+        """過期調度的處理函數：一個事務內批量過期仍為待支付且已到期的訂單"""
+        from main_app import db_manager
+        
+        now = datetime.now().isoformat()
+        placeholders = ', '.join('?' * len(ids))
+        with db_manager.get_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            expired = [dict(row) for row in conn.execute(
+                f'SELECT id, order_id, user_id FROM payment_orders '
+                f'WHERE id IN ({placeholders}) AND status = ? AND expires_at <= ?',
+                (*ids, PaymentStatus.PENDING.value, now)
+            )]
+            if expired:
+                conn.execute(
+                    f'UPDATE payment_orders SET status = ?, updated_at = ? '
+                    f'WHERE id IN ({", ".join("?" * len(expired))})',
+                    (PaymentStatus.EXPIRED.value, now, *(row['id'] for row in expired))
+                )
+            conn.commit()
+        
+        for row in expired:
+            self.status_queries.invalidate(row['order_id'])
+            if self.on_status_change is not None:
+                try:
+                    self.on_status_change(dict(row, status=PaymentStatus.EXPIRED.value))
+                except Exception as e:
+                    logger.error(f"推送訂單 {row['order_id']} 狀態失敗: {e}")
+        return len(expired)
+    
+    def get_provider_stats(self) -> List[Dict]:
+        """各服務商客戶端的創建狀態"""
+        return [provider.get_stats() for provider in self.providers]
+    
+    def get_health_stats(self) -> Dict:
+        """各服務商的探測結果和熔斷器狀態"""
+        stats = self.health.get_stats()
+        stats['status_queries'] = self.status_queries.get_stats()
+        stats['expiry'] = self.expiry.get_stats()
+        return stats
+    
+    def failover_candidates(self, payment_method: str, amount: float) -> List[str]:
+        """請求的支付方式及其備選（同幣種、金額在限額內，按 priority 排序）
+        
+        USDT 的網絡由用戶選擇並決定付款地址，不做切換。
+        """
+        requested = self.payment_methods[payment_method]
+        if 'network' in requested:
+            return [payment_method]
+        
+        alternatives = [
+            method_id for method_id, config in self.payment_methods.items()
+            if method_id != payment_method
+            and config['enabled']
+            and 'network' not in config
+            and config['supported_currencies'] == requested['supported_currencies']
+            and config['min_amount'] <= amount <= config['max_amount']
+        ]
+        alternatives.sort(key=lambda method_id: self.payment_methods[method_id]['priority'])
+        return [payment_method] + alternatives
+    
+    def select_payment_method(self, payment_method: str, amount: float) -> Optional[str]:
+        """選出第一個可用的支付方式；返回的方式須在調用後 record_method"""
+        for method_id in self.failover_candidates(payment_method, amount):
+            if self.health.acquire(self.payment_methods[method_id]['provider'], method_id):
+                return method_id
+        return None
+    
     def get_available_payment_methods(self, amount: float = None) -> List[Dict]:
         """獲取可用支付方式"""
         available_methods = []
@@ -252,13 +392,8 @@ class PaymentGateway:
                 if amount < config['min_amount'] or amount > config['max_amount']:
                     continue
             
-            # 檢查服務可用性
-            try:
-                service = config['service']
-                if hasattr(service, 'is_available') and not service.is_available():
-                    continue
-            except Exception as e:
-                logger.warning(f"檢查支付方式 {method_id} 可用性失敗: {e}")
+            # 檢查服務可用性（後台探測結果和熔斷器狀態，不發起請求）
+            if not self.health.is_usable(config['provider'], method_id):
                 continue
             
             available_methods.append({
@@ -343,9 +478,7 @@ class PaymentGateway:
     
     def generate_order_id(self) -> str:
         """生成訂單ID"""
-        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-        random_part = str(uuid.uuid4()).replace('-', '')[:8].upper()
-        return f"JY{timestamp}{random_part}"
+        return generate_order_id('JY')
     
     def create_payment_order(self, 
                            user_id: Optional[int],
@@ -388,6 +521,20 @@ class PaymentGateway:
                     'message': f'支付金額不能超過 {method_config["max_amount"]} 元'
                 }
             
+            # 已知不可用的服務商直接切換到備選支付方式
+            requested_method = payment_method
+            payment_method = self.select_payment_method(requested_method, amount)
+            if payment_method is None:
+                return {
+                    'success': False,
+                    'message': '支付服務暫時不可用，請稍後重試或選擇其他支付方式'
+                }
+            if payment_method != requested_method:
+                logger.warning(f"支付方式 {requested_method} 不可用，切換到 {payment_method}")
+            method_config = self.payment_methods[payment_method]
+            provider_ok = None
+            started = time.perf_counter()
+            
             # 生成訂單ID
             order_id = self.generate_order_id()
             
@@ -397,44 +544,52 @@ class PaymentGateway:
             # 設置過期時間（30分鐘）
             expires_at = datetime.now() + timedelta(minutes=30)
             
-            # 創建支付訂單記錄
-            from main_app import db_manager
-            
-            query = '''
-                INSERT INTO payment_orders (
+            try:
+                # 創建支付訂單記錄
+                from main_app import db_manager
+                
+                query = '''
+                    INSERT INTO payment_orders (
+                        order_id, user_id, package_id, amount, original_amount,
+                        discount_amount, discount_code, payment_method, status,
+                        expires_at, created_at, updated_at
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
+                '''
+                
+                row_id = db_manager.execute_insert(query, (
                     order_id, user_id, package_id, amount, original_amount,
-                    discount_amount, discount_code, payment_method, status,
-                    expires_at, created_at, updated_at
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)
-            '''
-            
-            db_manager.execute_update(query, (
-                order_id, user_id, package_id, amount, original_amount,
-                discount_amount, discount_code, payment_method, PaymentStatus.PENDING.value,
-                expires_at.isoformat()
-            ))
-            
-            # 調用對應支付服務創建支付
-            service = method_config['service']
-            
-            # USDT支付特殊處理
-            if payment_method in [PaymentMethod.USDT_ERC20.value, PaymentMethod.USDT_TRC20.value]:
-                network = method_config.get('network', 'erc20')
-                payment_result = service.create_payment_order(
-                    amount=amount,
-                    network=network,
-                    order_id=order_id
-                )
-            else:
-                # 傳統支付方式
-                payment_result = service.create_payment(
-                    order_id=order_id,
-                    amount=amount,
-                    description=f"{package_info['name']} - {package_id}",
-                    customer_info=customer_info,
-                    callback_url=f"/webhook/{payment_method}",
-                    return_url=f"/payment/result?order_id={order_id}"
-                )
+                    discount_amount, discount_code, payment_method, PaymentStatus.PENDING.value,
+                    expires_at.isoformat()
+                ))
+                self.expiry.schedule(row_id, expires_at)
+                
+                # 調用對應支付服務創建支付
+                service = method_config['service']
+                started = time.perf_counter()
+                provider_ok = False
+                
+                # USDT支付特殊處理
+                if payment_method in [PaymentMethod.USDT_ERC20.value, PaymentMethod.USDT_TRC20.value]:
+                    network = method_config.get('network', 'erc20')
+                    payment_result = service.create_payment_order(
+                        amount=amount,
+                        network=network,
+                        order_id=order_id
+                    )
+                else:
+                    # 傳統支付方式
+                    payment_result = service.create_payment(
+                        order_id=order_id,
+                        amount=amount,
+                        description=f"{package_info['name']} - {package_id}",
+                        customer_info=customer_info,
+                        callback_url=f"/webhook/{payment_method}",
+                        return_url=f"/payment/result?order_id={order_id}"
+                    )
+                provider_ok = bool(payment_result['success'])
+            finally:
+                # 下單結果驅動該支付方式的熔斷器
+                self.health.record_method(payment_method, provider_ok, time.perf_counter() - started)
             
             if not payment_result['success']:
                 # 更新訂單狀態為失敗
@@ -463,6 +618,7 @@ class PaymentGateway:
                 'amount': amount,
                 'fee': fee,
                 'payment_method': payment_method,
+                'requested_payment_method': requested_method,
                 'expires_at': expires_at.isoformat(),
                 'package_info': package_info,
                 'message': '支付訂單創建成功'
@@ -475,6 +631,10 @@ class PaymentGateway:
                 'message': '系統錯誤，請稍後重試'
             }
     
+    def invalidate_payment_status(self, order_id: str):
+        """訂單收到回調後丟棄緩存的服務商狀態"""
+        self.status_queries.invalidate(order_id)
+    
     def get_payment_status(self, order_id: str) -> Dict:
         """獲取支付狀態"""
         try:
@@ -498,22 +658,24 @@ class PaymentGateway:
             if order['status'] == PaymentStatus.PENDING.value:
                 expires_at = datetime.fromisoformat(order['expires_at'])
                 if datetime.now() > expires_at:
-                    # 更新為過期狀態
-                    db_manager.execute_update(
-                        'UPDATE payment_orders SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE order_id = ?',
-                        (PaymentStatus.EXPIRED.value, order_id)
-                    )
+                    # 過期調度最多延遲一個刻度，讀到時直接過期
+                    self.expire_order_ids([order['id']])
                     order['status'] = PaymentStatus.EXPIRED.value
             
             # 如果是待支付或處理中狀態，查詢支付服務商狀態
             if order['status'] in [PaymentStatus.PENDING.value, PaymentStatus.PROCESSING.value]:
                 payment_method = order['payment_method']
-                if payment_method in self.payment_methods:
+                # 服務商已知不可用時直接返回本地狀態，不等待超時
+                if payment_method in self.payment_methods and self.health.is_usable(
+                        self.payment_methods[payment_method]['provider']):
                     service = self.payment_methods[payment_method]['service']
                     
                     try:
-                        service_status = service.query_payment_status(order_id)
-                        if service_status['success'] and service_status.get('status'):
+                        service_status = self.status_queries.query(
+                            self.payment_methods[payment_method]['provider'], order_id,
+                            lambda: service.query_payment_status(order_id)
+                        )
+                        if service_status and service_status['success'] and service_status.get('status'):
                             new_status = service_status['status']
                             
                             # 更新訂單狀態
@@ -593,6 +755,7 @@ class PaymentGateway:
                 'UPDATE payment_orders SET status = ?, updated_at = ?, paid_at = ? WHERE order_id = ?',
                 (payment_status, update_data['updated_at'], update_data.get('paid_at'), order_id)
             )
+            self.invalidate_payment_status(order_id)
             
             # 創建交易記錄
             transaction_id = f"TXN{datetime.now().strftime('%Y%m%d%H%M%S')}{str(uuid.uuid4())[:8].upper()}"
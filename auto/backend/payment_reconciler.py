@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 支付訂單對賬
+Payment Order Reconciliation for 4D Tech Style Auto Sponsorship System
+
+主要功能:
+- 每輪一條 UPDATE 批量過期所有超時的待支付訂單（兜底，正常由過期調度按時過期）
+- 其餘待支付/處理中訂單按批次讀取，按服務商分組並發查詢（每個服務商有並發上限）
+- 狀態變更按批次在一個事務中寫回，只更新狀態未被回調改變的訂單
+- 過期和狀態變更通過回調推送（WebSocket）
+- 每輪報告吞吐量和延遲
+
+查詢經過支付閘道的狀態查詢合併器，與用戶輪詢共享進行中的請求和緩存結果；
+熔斷或探測失敗的服務商本輪跳過。USDT 訂單由鏈上掃描器處理，不在此對賬。
+"""
+
+import time
+import logging
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+OPEN_STATUSES = ('pending', 'processing')
+
+class PaymentReconciler:
+    """定期對賬待支付和處理中的訂單"""
+
+    def __init__(self,
+                 gateway,
+                 db_manager,
+                 interval: float = 60,
+                 batch_size: int = 200,
+                 concurrency: int = 8,
+                 notify: Optional[Callable[[Dict[str, Any]], None]] = None):
+        """
+        gateway: PaymentGateway（支付方式配置、健康狀態、狀態查詢合併器）
+        concurrency: 每個服務商同時進行的查詢數
+        notify: 訂單狀態變更回調，參數含 order_id、user_id、status
+        """
+        self.gateway = gateway
+        self.db_manager = db_manager
+        self.interval = interval
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.notify = notify
+
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._previous_started: Optional[float] = None
+
+        # 統計信息
+        self.runs = 0
+        self.errors = 0
+        self.total_expired = 0
+        self.total_checked = 0
+        self.total_changed = 0
+        self.last_run: Dict[str, Any] = {}
+
+    def run_once(self) -> Dict[str, Any]:
+        """執行一輪對賬，返回本輪報告"""
+        started = time.monotonic()
+        report = {'expired': 0, 'checked': 0, 'changed': 0, 'skipped': 0, 'failed': 0}
+
+        report['expired'] = self._expire_overdue()
+
+        last_id = 0
+        while True:
+            batch = self.db_manager.execute_query(
+                f"SELECT id, order_id, user_id, payment_method, status FROM payment_orders "
+                f"WHERE status IN ({', '.join('?' * len(OPEN_STATUSES))}) AND id > ? ORDER BY id LIMIT ?",
+                OPEN_STATUSES + (last_id, self.batch_size)
+            )
+            if not batch:
+                break
+            last_id = batch[-1]['id']
+            self._reconcile_batch(batch, report)
+            if len(batch) < self.batch_size:
+                break
+
+        finished = time.monotonic()
+        duration = finished - started
+        report.update(
+            duration_ms=round(duration * 1000, 1),
+            throughput=round(report['checked'] / duration, 1) if duration > 0 else 0.0,
+            # 每輪都會檢查所有未完成訂單，服務商狀態最多延遲到上一輪開始之後才被發現
+            lag_seconds=round(finished - (self._previous_started or started), 1),
+            finished_at=datetime.now().isoformat()
+        )
+        self._previous_started = started
+
+        self.runs += 1
+        self.total_expired += report['expired']
+        self.total_checked += report['checked']
+        self.total_changed += report['changed']
+        self.last_run = report
+        if report['expired'] or report['changed'] or report['failed']:
+            logger.info(f"訂單對賬完成: {report}")
+        return report
+
+    def _expire_overdue(self) -> int:
+        """一條 UPDATE 過期所有超時的待支付訂單（同一寫事務內先取出訂單用於推送）"""
+        now = datetime.now().isoformat()
+        with self.db_manager.get_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            expired = [dict(row) for row in conn.execute(
+                "SELECT order_id, user_id FROM payment_orders WHERE status = 'pending' AND expires_at < ?",
+                (now,)
+            )]
+            if expired:
+                conn.execute(
+                    "UPDATE payment_orders SET status = 'expired', updated_at = ? "
+                    "WHERE status = 'pending' AND expires_at < ?",
+                    (now, now)
+                )
+            conn.commit()
+
+        for order in expired:
+            self._notify(dict(order, status='expired'))
+        return len(expired)
+
+    def _reconcile_batch(self, batch: List[Dict], report: Dict[str, Any]):
+        """按服務商分組並發查詢一批訂單，變更在一個事務中寫回"""
+        jobs = []
+        for order in batch:
+            config = self.gateway.payment_methods.get(order['payment_method'])
+            provider = config and config['provider']
+            if (not provider or provider == 'usdt'
+                    or not self.gateway.health.is_usable(provider, order['payment_method'])):
+                report['skipped'] += 1
+                continue
+            jobs.append((order, provider, config['service']))
+
+        if not jobs:
+            return
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.concurrency * len(self.gateway.provider_map),
+                thread_name_prefix='reconcile'
+            )
+
+        futures = [(order, self._executor.submit(self._query, order, provider, service))
+                   for order, provider, service in jobs]
+        changes = []
+        for order, future in futures:
+            try:
+                result = future.result()
+            except Exception as e:
+                report['failed'] += 1
+                logger.warning(f"對賬查詢訂單 {order['order_id']} 失敗: {e}")
+                continue
+            if result is None:
+                report['skipped'] += 1  # 剛被用戶輪詢查詢過，下一輪再查
+                continue
+            report['checked'] += 1
+            if result['success'] and result.get('status') and result['status'] != order['status']:
+                changes.append((order, result['status']))
+
+        report['changed'] += self._write_back(changes)
+
+    def _query(self, order: Dict, provider: str, service) -> Optional[Dict]:
+        semaphore = self._semaphores.get(provider)
+        if semaphore is None:
+            semaphore = self._semaphores.setdefault(provider, threading.BoundedSemaphore(self.concurrency))
+        with semaphore:
+            return self.gateway.status_queries.query(
+                provider, order['order_id'],
+                lambda: service.query_payment_status(order['order_id'])
+            )
+
+    def _write_back(self, changes: List[tuple]) -> int:
+        """批量寫回狀態；訂單狀態已被回調或其他進程改變時不覆蓋"""
+        if not changes:
+            return 0
+
+        now = datetime.now().isoformat()
+        applied = []
+        with self.db_manager.get_connection() as conn:
+            for order, status in changes:
+                cursor = conn.execute(
+                    'UPDATE payment_orders SET status = ?, updated_at = ?, paid_at = COALESCE(?, paid_at) '
+                    'WHERE order_id = ? AND status = ?',
+                    (status, now, now if status == 'completed' else None, order['order_id'], order['status'])
+                )
+                if cursor.rowcount:
+                    applied.append(dict(order, status=status))
+            conn.commit()
+
+        for order in applied:
+            self._notify(order)
+        return len(applied)
+
+    def _notify(self, order: Dict[str, Any]):
+        if self.notify is None:
+            return
+        try:
+            self.notify(order)
+        except Exception as e:
+            logger.error(f"推送訂單 {order['order_id']} 狀態失敗: {e}")
+
+    def start(self):
+        """啟動後台對賬線程"""
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stop.is_set():
+                try:
+                    self.run_once()
+                except Exception as e:
+                    self.errors += 1
+                    logger.error(f"訂單對賬失敗: {e}")
+                self._stop.wait(self.interval)
+
+        self._thread = threading.Thread(target=run, name='payment-reconciler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取統計信息"""
+        return {
+            'running': self._thread is not None,
+            'interval': self.interval,
+            'runs': self.runs,
+            'errors': self.errors,
+            'total_expired': self.total_expired,
+            'total_checked': self.total_checked,
+            'total_changed': self.total_changed,
+            'last_run': self.last_run
+        }
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 支付服務商健康檢查與熔斷
+Provider Health and Circuit Breakers for 4D Tech Style Auto Sponsorship System
+
+主要功能:
+- 後台線程定期探測各服務商（is_available），緩存健康狀態
+- 每個服務商和每個支付方式一個熔斷器，由真實請求的錯誤率和慢請求比例驅動
+- 熔斷打開期間直接跳過，冷卻後放行一個試探請求（半開），成功則恢復
+- 支付方式列表和下單只讀緩存狀態，不會等待已知不可用的服務商
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+def is_provider_fault(error: Optional[BaseException]) -> bool:
+    """連接錯誤、超時、429/5xx 算服務商故障；其他 4xx 是請求本身的問題"""
+    if error is None:
+        return False
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 429 or error.response.status_code >= 500
+    return True
+
+class CircuitBreaker:
+    """按最近 N 次調用的失敗率和慢調用比例熔斷"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self,
+                 name: str,
+                 window: int = 20,
+                 min_calls: int = 5,
+                 failure_rate: float = 0.5,
+                 slow_call_seconds: float = 5.0,
+                 slow_call_rate: float = 0.8,
+                 open_seconds: float = 30):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_rate = slow_call_rate
+        self.open_seconds = open_seconds
+
+        self._calls: deque = deque(maxlen=window)  # (成功, 慢)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+        # 統計信息
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = False
+        return self._state
+
+    def available(self) -> bool:
+        """是否可以使用（不佔用半開狀態的試探名額，用於列表展示）"""
+        with self._lock:
+            state = self._current_state()
+            return state == self.CLOSED or (state == self.HALF_OPEN and not self._trial_in_flight)
+
+    def allow(self) -> bool:
+        """發起調用前檢查；半開狀態只放行一個試探調用"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def release(self):
+        """allow() 之後沒有實際調用服務商時歸還試探名額"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record(self, ok: bool, seconds: float):
+        """記錄一次調用結果"""
+        with self._lock:
+            state = self._current_state()
+            if state == self.OPEN:
+                return  # 熔斷前發出的調用，結果不再影響狀態
+            if state == self.HALF_OPEN:
+                if ok:
+                    self._state = self.CLOSED
+                    self._calls.clear()
+                    logger.info(f"熔斷器 {self.name} 恢復")
+                else:
+                    self._trip()
+                return
+
+            self._calls.append((ok, seconds >= self.slow_call_seconds))
+            if len(self._calls) < self.min_calls:
+                return
+            failures = sum(1 for call_ok, _ in self._calls if not call_ok)
+            slow = sum(1 for _, call_slow in self._calls if call_slow)
+            if failures / len(self._calls) >= self.failure_rate or slow / len(self._calls) >= self.slow_call_rate:
+                self._trip()
+
+    def _trip(self):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._trial_in_flight = False
+        self._calls.clear()
+        self.opened += 1
+        logger.warning(f"熔斷器 {self.name} 打開，{self.open_seconds}s 後試探恢復")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取統計信息"""
+        with self._lock:
+            calls = len(self._calls)
+            failures = sum(1 for ok, _ in self._calls if not ok)
+            return {
+                'state': self._current_state(),
+                'window_calls': calls,
+                'window_failures': failures,
+                'opened': self.opened,
+                'rejected': self.rejected
+            }
+
+class ProviderHealthMonitor:
+    """服務商健康狀態：後台探測結果 + 熔斷器"""
+
+    def __init__(self,
+                 probes: Dict[str, Callable[[], bool]],
+                 interval: float = 30,
+                 probe_timeout: float = 15,
+                 breaker_options: Optional[Dict[str, Any]] = None):
+        self.probes = probes
+        self.interval = interval
+        self.probe_timeout = probe_timeout
+        self.breaker_options = breaker_options or {}
+
+        self._health: Dict[str, Dict[str, Any]] = {
+            name: {'healthy': None, 'checked_at': None, 'latency_ms': None, 'error': None}
+            for name in probes
+        }
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._breakers_lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def breaker(self, key: str) -> CircuitBreaker:
+        """服務商或支付方式的熔斷器"""
+        breaker = self._breakers.get(key)
+        if breaker is None:
+            with self._breakers_lock:
+                breaker = self._breakers.setdefault(key, CircuitBreaker(key, **self.breaker_options))
+        return breaker
+
+    def observe_request(self, provider: str, endpoint: str, error: Optional[BaseException], seconds: float):
+        """服務商 API 請求結果（由 metrics.provider_request 回調）"""
+        self.breaker(provider).record(not is_provider_fault(error), seconds)
+
+    def is_healthy(self, provider: str) -> bool:
+        """最近一次探測是否成功（尚未探測時視為健康）"""
+        return self._health.get(provider, {}).get('healthy') is not False
+
+    def is_usable(self, provider: str, method: Optional[str] = None) -> bool:
+        """列表展示用：探測健康且熔斷器未打開"""
+        return (self.is_healthy(provider)
+                and self.breaker(provider).available()
+                and (method is None or self.breaker(method).available()))
+
+    def acquire(self, provider: str, method: str) -> bool:
+        """下單前檢查；熔斷器半開時佔用試探名額，調用後須 record_method"""
+        if not self.is_healthy(provider) or not self.breaker(provider).available():
+            return False
+        return self.breaker(method).allow()
+
+    def record_method(self, method: str, ok: Optional[bool], seconds: float):
+        """記錄下單調用結果；ok 為 None 表示沒有調用到服務商"""
+        if ok is None:
+            self.breaker(method).release()
+        else:
+            self.breaker(method).record(ok, seconds)
+
+    def probe_all(self):
+        """並行探測所有服務商，超時未返回的視為不健康"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=len(self.probes) or 1, thread_name_prefix='provider-probe')
+
+        started = time.perf_counter()
+        futures = {name: self._executor.submit(self._probe, name, probe) for name, probe in self.probes.items()}
+        wait(futures.values(), timeout=self.probe_timeout)
+        for name, future in futures.items():
+            if not future.done():
+                self._set_health(name, False, (time.perf_counter() - started) * 1000, '探測超時')
+
+    def _probe(self, name: str, probe: Callable[[], bool]):
+        started = time.perf_counter()
+        try:
+            healthy, error = bool(probe()), None
+        except Exception as e:
+            healthy, error = False, str(e)
+        self._set_health(name, healthy, (time.perf_counter() - started) * 1000, error)
+
+    def _set_health(self, name: str, healthy: bool, latency_ms: float, error: Optional[str]):
+        previous = self._health[name]['healthy']
+        self._health[name] = {
+            'healthy': healthy,
+            'checked_at': time.time(),
+            'latency_ms': round(latency_ms, 1),
+            'error': error
+        }
+        if previous is not False and not healthy:
+            logger.warning(f"支付服務商 {name} 探測失敗: {error or '不可用'}")
+        elif previous is False and healthy:
+            logger.info(f"支付服務商 {name} 探測恢復")
+
+    def start(self):
+        """啟動後台探測線程"""
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stop.is_set():
+                try:
+                    self.probe_all()
+                except Exception as e:
+                    logger.error(f"支付服務商探測失敗: {e}")
+                self._stop.wait(self.interval)
+
+        self._thread = threading.Thread(target=run, name='provider-health', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取統計信息"""
+        return {
+            'providers': dict(self._health),
+            'breakers': {key: breaker.get_stats() for key, breaker in list(self._breakers.items())}
+        }
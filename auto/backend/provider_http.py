@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 支付服務商 HTTP 客戶端
+Provider HTTP Client for 4D Tech Style Auto Sponsorship System
+
+主要功能:
+- 基於 httpx.AsyncClient 的共享連接池（keep-alive），每個事件循環一個
+- 單次請求超時 + 整個調用（含重試）的截止時間
+- 帶隨機抖動的指數退避，等待時不阻塞線程
+- 只重試連接錯誤、超時和 429/5xx
+- 同步外觀（SyncFacade）：Flask 線程把異步調用提交到一個共享的後台事件循環
+
+FastAPI 應用直接 await 服務方法；Flask 應用通過 SyncFacade 同步調用。
+"""
+
+import time
+import random
+import asyncio
+import logging
+import inspect
+import functools
+import threading
+import weakref
+from typing import Any, Coroutine, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# 可重試的 HTTP 狀態碼
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+class ProviderDeadlineExceeded(httpx.TimeoutException):
+    """整個調用（含重試）超過截止時間"""
+
+class ProviderHTTPClient:
+    """單個支付服務商的異步 HTTP 客戶端"""
+
+    def __init__(self,
+                 name: str,
+                 base_url: str,
+                 headers: Optional[Dict[str, str]] = None,
+                 timeout: float = 30,
+                 deadline: float = 60,
+                 max_retries: int = 3,
+                 retry_delay: float = 1,
+                 max_connections: int = 20,
+                 max_keepalive: int = 10):
+        self.name = name
+        self.base_url = base_url
+        self.headers = headers or {}
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=30
+        )
+        # httpx.AsyncClient 綁定創建它的事件循環
+        self._clients: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]' = weakref.WeakKeyDictionary()
+
+        # 統計信息
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.deadline_exceeded = 0
+
+    def _client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.headers,
+                timeout=self.timeout,
+                limits=self.limits
+            )
+            self._clients[loop] = client
+        return client
+
+    async def request(self,
+                      method: str,
+                      endpoint: str,
+                      *,
+                      params: Optional[Dict] = None,
+                      json: Any = None,
+                      data: Optional[Dict] = None,
+                      timeout: Optional[float] = None,
+                      deadline: Optional[float] = None) -> httpx.Response:
+        """發送請求；timeout 為單次請求超時，deadline 為含重試的總時間（秒）"""
+        timeout = timeout or self.timeout
+        give_up_at = time.monotonic() + (deadline or self.deadline)
+        self.requests += 1
+        last_error: Optional[Exception] = None
+
+        for attempt in range(self.max_retries):
+            remaining = give_up_at - time.monotonic()
+            if remaining <= 0:
+                break
+
+            try:
+                response = await self._client().request(
+                    method, endpoint, params=params, json=json, data=data,
+                    timeout=min(timeout, remaining)
+                )
+                response.raise_for_status()
+                return response
+            except httpx.HTTPStatusError as e:
+                last_error = e
+                if e.response.status_code not in RETRY_STATUSES or attempt == self.max_retries - 1:
+                    self.failures += 1
+                    raise
+                logger.warning(f"{self.name} API 返回 {e.response.status_code} (嘗試 {attempt + 1}/{self.max_retries})")
+            except httpx.TransportError as e:
+                last_error = e
+                if attempt == self.max_retries - 1:
+                    self.failures += 1
+                    raise
+                logger.warning(f"{self.name} API 請求失敗: {e!r} (嘗試 {attempt + 1}/{self.max_retries})")
+
+            # 全抖動指數退避，退避後已超過截止時間則不再重試
+            delay = random.uniform(0, self.retry_delay * 2 ** attempt)
+            if time.monotonic() + delay >= give_up_at:
+                break
+            self.retries += 1
+            await asyncio.sleep(delay)
+
+        self.failures += 1
+        self.deadline_exceeded += 1
+        raise ProviderDeadlineExceeded(
+            f"{self.name} API 請求超過截止時間 {deadline or self.deadline}s"
+        ) from last_error
+
+    async def close(self):
+        """關閉當前事件循環上的連接池"""
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取統計信息"""
+        return {
+            'name': self.name,
+            'pools': len(self._clients),
+            'requests': self.requests,
+            'retries': self.retries,
+            'failures': self.failures,
+            'deadline_exceeded': self.deadline_exceeded
+        }
+
+# Flask 等同步調用方共享的後台事件循環
+_background_loop: Optional[asyncio.AbstractEventLoop] = None
+_background_lock = threading.Lock()
+
+def _get_background_loop() -> asyncio.AbstractEventLoop:
+    global _background_loop
+    with _background_lock:
+        if _background_loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='provider-http-loop', daemon=True).start()
+            _background_loop = loop
+        return _background_loop
+
+def run_sync(coro: Coroutine) -> Any:
+    """在後台事件循環中執行協程並等待結果（不能在事件循環線程中調用）"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        coro.close()
+        raise RuntimeError("事件循環中請直接 await 異步方法")
+    return asyncio.run_coroutine_threadsafe(coro, _get_background_loop()).result()
+
+class SyncFacade:
+    """把服務的異步方法包裝為同步方法，其他屬性原樣返回"""
+
+    def __init__(self, service: Any):
+        self._service = service
+
+    @property
+    def service(self) -> Any:
+        return self._service
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._service, name)
+        if not inspect.iscoroutinefunction(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            return run_sync(attr(*args, **kwargs))
+        return call
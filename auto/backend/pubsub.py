@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 跨進程發布/訂閱
+Cross-Worker Pub/Sub for 4D Tech Style Auto Sponsorship System
+
+主要功能:
+- 可替換的發布/訂閱後端
+- 進程內後端（單進程部署、腳本和基準測試）
+- Redis 協議後端（多個 uvicorn worker 共享）
+- 斷線自動重連訂閱
+"""
+
+import asyncio
+import logging
+from typing import Callable, Dict, Iterable, Optional, Any
+
+try:
+    import redis.asyncio as aioredis
+except ImportError:  # 未安裝 redis 時只能使用進程內後端
+    aioredis = None
+
+logger = logging.getLogger(__name__)
+
+MessageHandler = Callable[[str, str], Any]
+
+class PubSubBackend:
+    """發布/訂閱後端接口"""
+
+    name = 'base'
+
+    def __init__(self):
+        self.handler: Optional[MessageHandler] = None
+        self.channel_handlers: Dict[str, MessageHandler] = {}
+        self.channels: set = set()
+
+        # 統計信息
+        self.published = 0
+        self.received = 0
+
+    def set_handler(self, handler: MessageHandler):
+        """設置收到消息時的回調 handler(channel, data)"""
+        self.handler = handler
+
+    def add_channel_handler(self, channel: str, handler: MessageHandler):
+        """為單個頻道設置回調（需在 start 之前調用）"""
+        self.channel_handlers[channel] = handler
+        self.channels.add(channel)
+
+    async def start(self, channels: Iterable[str]):
+        """訂閱頻道"""
+        self.channels.update(channels)
+
+    async def publish(self, channel: str, data: str):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    def _dispatch(self, channel: str, data: str):
+        self.received += 1
+        handler = self.channel_handlers.get(channel, self.handler)
+        if handler is None:
+            return
+        try:
+            result = handler(channel, data)
+            if asyncio.iscoroutine(result):
+                asyncio.create_task(result)
+        except Exception as e:
+            logger.error(f"處理 {channel} 消息失敗: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取統計信息"""
+        return {
+            'backend': self.name,
+            'channels': sorted(self.channels),
+            'published': self.published,
+            'received': self.received
+        }
+
+class InProcessPubSub(PubSubBackend):
+    """進程內後端：發布即在本進程投遞"""
+
+    name = 'memory'
+
+    async def publish(self, channel: str, data: str):
+        self.published += 1
+        self._dispatch(channel, data)
+
+class RedisPubSub(PubSubBackend):
+    """Redis 協議後端：所有 worker 訂閱相同頻道"""
+
+    name = 'redis'
+
+    def __init__(self, url: str, reconnect_delay: float = 1.0):
+        super().__init__()
+        if aioredis is None:
+            raise RuntimeError("Redis 發布/訂閱需要安裝 redis 套件")
+        self.url = url
+        self.reconnect_delay = reconnect_delay
+        self.client = aioredis.from_url(url, decode_responses=True)
+        self._task: Optional[asyncio.Task] = None
+        self.reconnects = 0
+
+    async def start(self, channels: Iterable[str]):
+        await super().start(channels)
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen())
+            logger.info(f"Redis 發布/訂閱已啟動: {self.url} {sorted(self.channels)}")
+
+    async def publish(self, channel: str, data: str):
+        await self.client.publish(channel, data)
+        self.published += 1
+
+    async def _listen(self):
+        """持續讀取訂閱消息，斷線後重新訂閱"""
+        while True:
+            pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(*self.channels)
+                async for message in pubsub.listen():
+                    if message.get('type') == 'message':
+                        self._dispatch(message['channel'], message['data'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.reconnects += 1
+                logger.error(f"Redis 訂閱中斷，{self.reconnect_delay} 秒後重連: {e}")
+                await asyncio.sleep(self.reconnect_delay)
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.client.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = super().get_stats()
+        stats['reconnects'] = self.reconnects
+        return stats
+
+def create_pubsub(backend: str, redis_url: str = None) -> PubSubBackend:
+    """按配置創建後端: memory 或 redis"""
+    if backend == 'redis':
+        return RedisPubSub(redis_url)
+    if backend != 'memory':
+        raise ValueError(f"不支持的發布/訂閱後端: {backend}")
+    return InProcessPubSub()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 用戶最近活動
+Recent Activity Feed for 4D Tech Style Auto Sponsorship System
+
+主要功能:
+- 每個用戶一個有界環形緩衝區（最新在前），存放在緩存層
+- 記錄活動時直接寫入已載入的緩衝區，緩衝區跨寫入隊列回寫保留
+- 緩衝區不存在時從 activity_logs 懶載入一次
+
+記錄活動時緩衝區不存在，則從 activity_logs 載入歷史並與新活動按時間合併後建立緩衝區，
+避免只含新活動的殘缺列表掩蓋歷史記錄，也避免仍在寫入隊列中的活動在懶載入時遺漏。
+合併按 (類型, 內容, 時間到秒) 去重，已落庫的活動不會重複出現。
+"""
+
+import logging
+from typing import Any, Awaitable, Callable, Dict, List
+
+import fast_json
+
+logger = logging.getLogger(__name__)
+
+# loader(user_id, limit) -> 最新在前的活動列表
+ActivityLoader = Callable[[int, int], Awaitable[List[Dict[str, Any]]]]
+
+class RecentActivityFeed:
+    """用戶最近活動的環形緩衝區"""
+
+    def __init__(self, cache_factory: Callable, loader: ActivityLoader, size: int = 10, ttl: float = 3600):
+        self.cache_factory = cache_factory  # 返回當前的緩存後端（連接後才創建）
+        self.loader = loader
+        self.size = size
+        self.ttl = ttl
+
+        # 統計信息
+        self.hits = 0
+        self.misses = 0
+        self.pushes = 0
+        self.seeded = 0
+
+    @staticmethod
+    def key(user_id: int) -> str:
+        return f"activity:recent:{user_id}"
+
+    @staticmethod
+    def format_entry(action: str, description: str, created_at) -> Dict[str, Any]:
+        """與儀表板返回的活動格式一致"""
+        return {
+            "type": action,
+            "message": description,
+            "timestamp": created_at.isoformat()
+        }
+
+    @staticmethod
+    def _identity(activity: Dict[str, Any]):
+        # 資料庫 DATETIME 不保存微秒，按秒比較時間
+        return activity["type"], activity["message"], activity["timestamp"][:19]
+
+    def merge(self, *sources: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """合併多個最新在前的活動列表，去重後按時間倒序保留 size 條"""
+        merged: Dict[Any, Dict[str, Any]] = {}
+        for activities in sources:
+            for activity in activities:
+                merged.setdefault(self._identity(activity), activity)
+        ordered = sorted(merged.values(), key=lambda activity: activity["timestamp"][:19], reverse=True)
+        return ordered[:self.size]
+
+    async def record(self, user_id: int, action: str, description: str, created_at):
+        """加入一條活動；緩衝區不存在時載入歷史後合併建立"""
+        try:
+            cache = self.cache_factory()
+            key = self.key(user_id)
+            activity = self.format_entry(action, description, created_at)
+            if await cache.push_list(key, fast_json.dumps_str(activity), self.size, self.ttl):
+                self.pushes += 1
+                return
+
+            activities = self.merge([activity], await self.loader(user_id, self.size))
+            await self._store(cache, key, activities)
+            self.seeded += 1
+        except Exception as e:
+            # 緩衝區只是加速讀取，失敗不影響活動落庫
+            logger.warning(f"寫入用戶 {user_id} 最近活動失敗: {e}")
+
+    async def _store(self, cache, key: str, activities: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """寫入緩衝區；載入期間已有其他請求建立緩衝區時與之合併，不覆蓋其中較新的活動"""
+        existing = await cache.get_list(key)
+        if existing is not None:
+            activities = self.merge([fast_json.loads(value) for value in existing], activities)
+        await cache.set_list(key, [fast_json.dumps_str(activity) for activity in activities], self.size, self.ttl)
+        return activities
+
+    async def get(self, user_id: int) -> List[Dict[str, Any]]:
+        """讀取最近活動，未命中時從資料庫載入"""
+        cache = self.cache_factory()
+        key = self.key(user_id)
+
+        values = await cache.get_list(key)
+        if values is not None:
+            self.hits += 1
+            return [fast_json.loads(value) for value in values]
+
+        self.misses += 1
+        return await self._store(cache, key, await self.loader(user_id, self.size))
+
+    async def invalidate(self, user_id: int):
+        await self.cache_factory().delete(self.key(user_id))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取統計信息"""
+        total = self.hits + self.misses
+        return {
+            'size': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            'pushes': self.pushes,
+            'seeded': self.seeded
+        }
@@ -17,12 +17,14 @@ import json
 import time
 import hashlib
 import logging
-import requests
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 from urllib.parse import urlencode, quote_plus
 from decimal import Decimal, ROUND_HALF_UP
 
+import metrics
+from provider_http import ProviderHTTPClient
+
 logger = logging.getLogger(__name__)
 
 class SpeedPayConfig:
@@ -39,9 +41,11 @@ class SpeedPayConfig:
     IS_SANDBOX = os.environ.get('SPEEDPAY_SANDBOX', 'True').lower() == 'true'
     
     # 請求配置
-    TIMEOUT = 30
+    TIMEOUT = 30  # 單次請求超時（秒）
+    DEADLINE = 60  # 含重試的總時間（秒）
     MAX_RETRIES = 3
-    RETRY_DELAY = 1
+    RETRY_DELAY = 1  # 退避基數（秒），實際等待為 0 ~ RETRY_DELAY * 2^重試次數 的隨機值
+    MAX_CONNECTIONS = 20
     
     # 支付配置
     CURRENCY = 'TWD'
@@ -123,21 +127,29 @@ class SpeedPayService:
     def __init__(self):
         """初始化速買配服務"""
         self.config = SpeedPayConfig()
-        self.session = requests.Session()
         
-        # 設置請求頭
-        self.session.headers.update({
-            'Content-Type': 'application/json',
-            'User-Agent': 'JY-4D-Tech-Sponsor-System/1.0',
-            'Accept': 'application/json'
-        })
+        # 共享連接池的異步客戶端（超時、截止時間和退避見 provider_http.py）
+        self.http = ProviderHTTPClient(
+            name='speedpay',
+            base_url=self.config.BASE_URL,
+            headers={
+                'Content-Type': 'application/json',
+                'User-Agent': 'JY-4D-Tech-Sponsor-System/1.0',
+                'Accept': 'application/json'
+            },
+            timeout=self.config.TIMEOUT,
+            deadline=self.config.DEADLINE,
+            max_retries=self.config.MAX_RETRIES,
+            retry_delay=self.config.RETRY_DELAY,
+            max_connections=self.config.MAX_CONNECTIONS
+        )
         
         logger.info(f"速買配服務初始化完成 - 環境: {'沙盒' if self.config.IS_SANDBOX else '正式'}")
     
-    def is_available(self) -> bool:
+    async def is_available(self) -> bool:
         """檢查服務可用性"""
         try:
-            response = self._make_request('GET', '/api/v1/health')
+            response = await self._make_request('GET', '/api/v1/health')
             return response.get('status') == 'ok'
         except Exception as e:
             logger.warning(f"速買配服務不可用: {e}")
@@ -179,7 +191,7 @@ class SpeedPayService:
         # 四捨五入到分
         return float(Decimal(str(fee)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
     
-    def create_payment(self, 
+    async def create_payment(self, 
                       order_id: str,
                       amount: float,
                       description: str,
@@ -247,7 +259,7 @@ class SpeedPayService:
             request_data['signature'] = self._generate_signature(request_data)
             
             # 發送請求
-            response = self._make_request('POST', '/api/v1/payments/create', request_data)
+            response = await self._make_request('POST', '/api/v1/payments/create', request_data)
             
             if response.get('success'):
                 logger.info(f"速買配支付訂單創建成功: {order_id}")
@@ -280,7 +292,7 @@ class SpeedPayService:
                 'message': '系統錯誤，請稍後重試'
             }
     
-    def query_payment_status(self, order_id: str) -> Dict:
+    async def query_payment_status(self, order_id: str) -> Dict:
         """查詢支付狀態"""
         try:
             request_data = {
@@ -293,7 +305,7 @@ class SpeedPayService:
             request_data['signature'] = self._generate_signature(request_data)
             
             # 發送請求
-            response = self._make_request('POST', '/api/v1/payments/query', request_data)
+            response = await self._make_request('POST', '/api/v1/payments/query', request_data)
             
             if response.get('success'):
                 status_mapping = {
@@ -388,7 +400,7 @@ class SpeedPayService:
                 'message': '回調驗證失敗'
             }
     
-    def cancel_payment(self, order_id: str, reason: str = None) -> Dict:
+    async def cancel_payment(self, order_id: str, reason: str = None) -> Dict:
         """取消支付"""
         try:
             request_data = {
@@ -402,7 +414,7 @@ class SpeedPayService:
             request_data['signature'] = self._generate_signature(request_data)
             
             # 發送請求
-            response = self._make_request('POST', '/api/v1/payments/cancel', request_data)
+            response = await self._make_request('POST', '/api/v1/payments/cancel', request_data)
             
             if response.get('success'):
                 logger.info(f"速買配支付取消成功: {order_id}")
@@ -423,7 +435,7 @@ class SpeedPayService:
                 'message': '取消失敗'
             }
     
-    def refund_payment(self, order_id: str, amount: float = None, reason: str = None) -> Dict:
+    async def refund_payment(self, order_id: str, amount: float = None, reason: str = None) -> Dict:
         """退款"""
         try:
             request_data = {
@@ -438,7 +450,7 @@ class SpeedPayService:
             request_data['signature'] = self._generate_signature(request_data)
             
             # 發送請求
-            response = self._make_request('POST', '/api/v1/payments/refund', request_data)
+            response = await self._make_request('POST', '/api/v1/payments/refund', request_data)
             
             if response.get('success'):
                 logger.info(f"速買配退款成功: {order_id}")
@@ -461,10 +473,10 @@ class SpeedPayService:
                 'message': '退款失敗'
             }
     
-    def get_payment_methods_info(self) -> Dict:
+    async def get_payment_methods_info(self) -> Dict:
         """獲取支付方式詳細信息"""
         try:
-            response = self._make_request('GET', '/api/v1/payment-methods')
+            response = await self._make_request('GET', '/api/v1/payment-methods')
             
             if response.get('success'):
                 return {
@@ -489,46 +501,22 @@ class SpeedPayService:
                 'banks': self.config.BANK_CODES
             }
     
-    def _make_request(self, method: str, endpoint: str, data: Dict = None) -> Dict:
-        """發送HTTP請求"""
-        url = f"{self.config.BASE_URL}{endpoint}"
+    @metrics.provider_request('speedpay')
+    async def _make_request(self, method: str, endpoint: str, data: Dict = None) -> Dict:
+        """發送HTTP請求（失敗時按退避策略重試，超過截止時間拋出異常）"""
+        if method.upper() == 'GET':
+            response = await self.http.request('GET', endpoint, params=data)
+        else:
+            response = await self.http.request('POST', endpoint, json=data)
         
-        for attempt in range(self.config.MAX_RETRIES):
-            try:
-                if method.upper() == 'GET':
-                    response = self.session.get(url, params=data, timeout=self.config.TIMEOUT)
-                else:
-                    response = self.session.post(url, json=data, timeout=self.config.TIMEOUT)
-                
-                response.raise_for_status()
-                
-                # 嘗試解析JSON
-                try:
-                    return response.json()
-                except json.JSONDecodeError:
-                    return {
-                        'success': False,
-                        'message': '響應格式錯誤'
-                    }
-                    
-            except requests.exceptions.Timeout:
-                logger.warning(f"速買配API請求超時 (嘗試 {attempt + 1}/{self.config.MAX_RETRIES})")
-                if attempt < self.config.MAX_RETRIES - 1:
-                    time.sleep(self.config.RETRY_DELAY * (attempt + 1))
-                    continue
-                raise
-                
-            except requests.exceptions.RequestException as e:
-                logger.error(f"速買配API請求失敗: {e}")
-                if attempt < self.config.MAX_RETRIES - 1:
-                    time.sleep(self.config.RETRY_DELAY * (attempt + 1))
-                    continue
-                raise
-        
-        return {
-            'success': False,
-            'message': '請求失敗'
-        }
+        # 嘗試解析JSON
+        try:
+            return response.json()
+        except json.JSONDecodeError:
+            return {
+                'success': False,
+                'message': '響應格式錯誤'
+            }
     
     def _generate_signature(self, data: Dict) -> str:
         """生成API簽名"""
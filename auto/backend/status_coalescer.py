@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 支付狀態查詢合併
+Provider Status Query Coalescing for 4D Tech Style Auto Sponsorship System
+
+前端按固定間隔輪詢待支付訂單，同一訂單開多個頁面時會產生大量相同的上游查詢。
+
+主要功能:
+- 單飛（single-flight）：同一訂單同時只有一個上游查詢，其他調用方等待並共享結果
+- 按服務商設置的短 TTL 緩存查詢結果
+- 每個訂單的最小重查間隔（查詢失敗時同樣生效），間隔內直接使用本地狀態
+- 收到回調時立即使該訂單的緩存失效，進行中的查詢結果不再寫入緩存
+"""
+
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+class _Flight:
+    """一次進行中的上游查詢"""
+
+    __slots__ = ('done', 'result', 'generation')
+
+    def __init__(self, generation: int):
+        self.done = threading.Event()
+        self.result: Optional[Dict[str, Any]] = None
+        self.generation = generation
+
+class StatusQueryCoalescer:
+    """按訂單合併服務商狀態查詢（線程安全，供 Flask 線程使用）"""
+
+    def __init__(self,
+                 ttl: Optional[Dict[str, float]] = None,
+                 default_ttl: float = 5,
+                 min_interval: float = 3,
+                 wait_timeout: float = 30,
+                 maxsize: int = 10000):
+        """
+        ttl: 服務商 -> 結果緩存秒數
+        min_interval: 同一訂單兩次上游查詢的最小間隔（秒）
+        wait_timeout: 等待進行中查詢的最長時間，應不小於服務商請求的截止時間
+        """
+        self.ttl = ttl or {}
+        self.default_ttl = default_ttl
+        self.min_interval = min_interval
+        self.wait_timeout = wait_timeout
+        self.maxsize = maxsize
+
+        self._lock = threading.Lock()
+        self._cache: Dict[str, tuple] = {}          # order_id -> (結果, 過期時間)
+        self._last_query: Dict[str, float] = {}     # order_id -> 上次上游查詢開始時間
+        self._flights: Dict[str, _Flight] = {}
+        self._generations: Dict[str, int] = {}      # 每次失效加一
+
+        # 統計信息
+        self.upstream = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.throttled = 0
+        self.invalidations = 0
+
+    def query(self, provider: str, order_id: str, fetch: Callable[[], Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """返回服務商狀態；在最小重查間隔內且沒有緩存時返回 None（調用方使用本地狀態）。
+        fetch 拋出的異常只傳給發起查詢的調用方，等待的調用方得到 None"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(order_id)
+            if cached is not None:
+                if cached[1] > now:
+                    self.cache_hits += 1
+                    return cached[0]
+                del self._cache[order_id]
+
+            flight = self._flights.get(order_id)
+            if flight is None:
+                if now - self._last_query.get(order_id, float('-inf')) < self.min_interval:
+                    self.throttled += 1
+                    return None
+                flight = _Flight(self._generations.get(order_id, 0))
+                self._flights[order_id] = flight
+                self._last_query[order_id] = now
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            flight.done.wait(self.wait_timeout)
+            return flight.result
+
+        self.upstream += 1
+        try:
+            flight.result = fetch()
+        finally:
+            with self._lock:
+                self._flights.pop(order_id, None)
+                # 查詢期間收到回調則不緩存（結果可能早於回調）
+                if (flight.result is not None and flight.result.get('success')
+                        and flight.generation == self._generations.get(order_id, 0)):
+                    self._cache[order_id] = (flight.result, time.monotonic() + self.ttl.get(provider, self.default_ttl))
+                self._prune()
+            flight.done.set()
+        return flight.result
+
+    def invalidate(self, order_id: str):
+        """訂單狀態已由回調更新：丟棄緩存，下次輪詢可立即重查"""
+        with self._lock:
+            self._cache.pop(order_id, None)
+            self._last_query.pop(order_id, None)
+            self._generations[order_id] = self._generations.get(order_id, 0) + 1
+            self.invalidations += 1
+
+    def _prune(self):
+        """超出容量時清理過期條目和不再需要節流的訂單"""
+        if len(self._last_query) <= self.maxsize and len(self._generations) <= self.maxsize:
+            return
+        now = time.monotonic()
+        self._cache = {key: entry for key, entry in self._cache.items() if entry[1] > now}
+        self._last_query = {key: started for key, started in self._last_query.items()
+                            if now - started < self.min_interval}
+        self._generations = {key: generation for key, generation in self._generations.items()
+                             if key in self._flights}
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取統計信息"""
+        with self._lock:
+            return {
+                'cached': len(self._cache),
+                'in_flight': len(self._flights),
+                'upstream': self.upstream,
+                'cache_hits': self.cache_hits,
+                'coalesced': self.coalesced,
+                'throttled': self.throttled,
+                'invalidations': self.invalidations
+            }
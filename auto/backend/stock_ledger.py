@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 庫存預留帳本
+Stock Reservation Ledger for 4D Tech Style Auto Sponsorship System
+
+主要功能:
+- 按商品分片的進程內庫存預留
+- 從資料庫申請庫存配額（多進程不超賣）
+- 批量回寫庫存扣減
+- 重啟後對帳
+- 定期同步速買商品集合（新標記的商品加入帳本，取消標記的商品歸還配額）
+
+資料模型:
+- items.stock              已結算的剩餘庫存
+- stock_allocations.quota  各進程持有但尚未結算的配額
+- orders.stock_settled     訂單的庫存扣減是否已回寫到 items.stock
+
+不變量: 所有進程配額之和 <= items.stock，因此內存中的預留永遠有庫存支撐。
+不經帳本的扣減必須從 items.stock 減去所有進程的配額後再判斷庫存是否充足。
+
+配額是一份租約：對帳會回收心跳超過 stale_after 的配額。每個分片記錄最後一次
+成功寫入心跳的時間，超過 stale_after - safety_margin 後不再使用內存配額
+（作廢並停止申請新配額），直到下一次回寫成功重新確認持有的配額。
+"""
+
+import os
+import time
+import uuid
+import asyncio
+import logging
+import socket
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Tuple, Any
+
+from sqlalchemy import text, bindparam
+
+logger = logging.getLogger(__name__)
+
+class StockShard:
+    """單個商品的庫存分片"""
+
+    __slots__ = ('item_id', 'quota', 'consumed', 'pending_orders', 'lock', 'exhausted_until',
+                 'heartbeat_at', 'lapsed', 'forfeited', 'retired')
+
+    def __init__(self, item_id: int):
+        self.item_id = item_id
+        self.quota = 0                      # 可預留的配額
+        self.consumed = 0                   # 已售出但尚未回寫的數量
+        self.pending_orders: List[str] = [] # 待結算的訂單ID
+        self.lock = asyncio.Lock()          # 補充配額時使用
+        self.exhausted_until = 0.0          # 售罄後暫停向資料庫申請的截止時間
+        self.heartbeat_at = 0.0             # 最後一次成功寫入心跳的時間（monotonic，0 表示未持有配額）
+        self.lapsed = False                 # 租約已過期，等待回寫成功
+        self.forfeited = 0                  # 租約過期時作廢、但資料庫中可能仍記在本進程名下的配額
+        self.retired = False                # 已取消速買標記，回寫完成後移除
+
+class StockLedger:
+    """庫存預留帳本"""
+
+    def __init__(self,
+                 session_factory: Callable,
+                 worker_id: str = None,
+                 chunk_size: int = 50,
+                 stale_after: int = 60,
+                 safety_margin: float = 10,
+                 exhausted_backoff: float = 1.0,
+                 on_settled: Callable[[List[int]], None] = None):
+        self.session_factory = session_factory
+        self.on_settled = on_settled  # items.stock 變更後的回調（例如使目錄緩存失效）
+        self.worker_id = worker_id or os.environ.get('STOCK_LEDGER_WORKER_ID') or \
+            f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.chunk_size = chunk_size
+        self.stale_after = stale_after
+        # 對帳按資料庫時間判斷心跳超時，預留時鐘偏差和回寫耗時
+        self.lease_seconds = max(stale_after - safety_margin, 0)
+        self.exhausted_backoff = exhausted_backoff
+        self.shards: Dict[int, StockShard] = {}
+        self.loaded = False
+
+        # 統計信息
+        self.accepted = 0
+        self.rejected = 0
+        self.lapses = 0
+        self.refills = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+
+    def manages(self, item_id: int) -> bool:
+        """商品是否由帳本管理"""
+        shard = self.shards.get(item_id)
+        return self.loaded and shard is not None and not shard.retired
+
+    async def load(self):
+        """啟動時對帳並為速買商品申請初始配額"""
+        await self.reconcile(include_own=True)
+        await self.sync_items()
+
+        self.loaded = True
+        logger.info(f"庫存帳本已載入: {len(self.shards)} 個速買商品, 進程 {self.worker_id}")
+
+    async def sync_items(self):
+        """按資料庫同步速買商品集合：新商品申請初始配額，取消標記或下架的商品停止預留並歸還配額"""
+        async with self.session_factory() as session:
+            result = await session.execute(
+                text("SELECT id FROM items WHERE is_active = 1 AND is_quick_buy = 1")
+            )
+            item_ids = {row[0] for row in result}
+
+        for item_id in item_ids:
+            shard = self.shards.get(item_id)
+            if shard is None:
+                shard = StockShard(item_id)
+                self.shards[item_id] = shard
+                await self._refill(shard, self.chunk_size)
+            elif shard.retired:
+                shard.retired = False
+
+        for item_id, shard in self.shards.items():
+            if item_id not in item_ids and not shard.retired:
+                # 未用配額在下一次回寫時從 stock_allocations 扣除，之後改由直接扣減銷售
+                logger.info(f"商品 {item_id} 已不是速買商品，退出庫存帳本")
+                shard.retired = True
+                shard.forfeited += shard.quota
+                shard.quota = 0
+
+    def _lease_valid(self, shard: StockShard) -> bool:
+        return shard.heartbeat_at == 0.0 or time.monotonic() - shard.heartbeat_at < self.lease_seconds
+
+    def _lapse(self, shard: StockShard):
+        """租約過期：配額可能已被對帳回收，作廢內存配額"""
+        if shard.lapsed:
+            return
+        logger.warning(f"商品 {shard.item_id} 的配額心跳已超過 {self.lease_seconds}s 未更新，停止銷售")
+        shard.lapsed = True
+        shard.forfeited += shard.quota
+        shard.quota = 0
+        self.lapses += 1
+
+    async def reserve(self, item_id: int, amount: int) -> bool:
+        """預留庫存，立即返回是否接受"""
+        shard = self.shards[item_id]
+
+        if shard.retired:
+            self.rejected += 1
+            return False
+
+        if not self._lease_valid(shard):
+            self._lapse(shard)
+
+        # 快速路徑：內存配額充足，無需訪問資料庫
+        if shard.quota >= amount:
+            shard.quota -= amount
+            self.accepted += 1
+            return True
+
+        # 剛確認過售罄，或租約過期（回寫成功前不申請新配額，避免與已結算的扣減混淆），直接拒絕
+        if shard.lapsed or time.monotonic() < shard.exhausted_until:
+            self.rejected += 1
+            return False
+
+        async with shard.lock:
+            if shard.quota < amount and not shard.lapsed:
+                await self._refill(shard, amount - shard.quota)
+
+            if shard.quota >= amount:
+                shard.quota -= amount
+                self.accepted += 1
+                return True
+
+            shard.exhausted_until = time.monotonic() + self.exhausted_backoff
+            self.rejected += 1
+            return False
+
+    def release(self, item_id: int, amount: int):
+        """訂單未提交時歸還預留"""
+        shard = self.shards.get(item_id)
+        if shard is None:
+            return
+        if shard.lapsed or shard.retired:
+            shard.forfeited += amount
+        else:
+            shard.quota += amount
+
+    def commit(self, item_id: int, order_id: str, amount: int):
+        """訂單已提交，記錄待回寫的扣減"""
+        shard = self.shards.get(item_id)
+        if shard is not None:
+            shard.consumed += amount
+            shard.pending_orders.append(order_id)
+
+    async def _refill(self, shard: StockShard, need: int):
+        """向資料庫申請更多配額"""
+        grant_target = max(self.chunk_size, need)
+        started = time.monotonic()
+
+        async with self.session_factory() as session:
+            async with session.begin():
+                result = await session.execute(
+                    text("SELECT stock FROM items WHERE id = :item_id AND is_active = 1 FOR UPDATE"),
+                    {"item_id": shard.item_id}
+                )
+                stock = result.scalar()
+                if stock is None:
+                    return
+
+                result = await session.execute(
+                    text("SELECT COALESCE(SUM(quota), 0) FROM stock_allocations WHERE item_id = :item_id"),
+                    {"item_id": shard.item_id}
+                )
+                allocated = int(result.scalar() or 0)
+
+                grant = min(int(stock) - allocated, grant_target)
+                if grant <= 0:
+                    return
+
+                await session.execute(
+                    text("""
+                        INSERT INTO stock_allocations (item_id, worker_id, quota, heartbeat_at)
+                        VALUES (:item_id, :worker_id, :grant, :now)
+                        ON DUPLICATE KEY UPDATE
+                            quota = quota + VALUES(quota),
+                            heartbeat_at = VALUES(heartbeat_at)
+                    """),
+                    {"item_id": shard.item_id, "worker_id": self.worker_id,
+                     "grant": grant, "now": datetime.utcnow()}
+                )
+
+        shard.quota += grant
+        shard.heartbeat_at = max(shard.heartbeat_at, started)
+        self.refills += 1
+
+    async def flush(self):
+        """批量回寫已售出的庫存扣減並更新心跳"""
+        if not self.loaded:
+            return
+
+        started = time.perf_counter()
+        heartbeat_started = time.monotonic()
+
+        # 快照本次要回寫的數據（回寫期間的新訂單留到下一輪）
+        batch = {
+            item_id: (shard.consumed, list(shard.pending_orders))
+            for item_id, shard in self.shards.items()
+            if shard.consumed or shard.pending_orders
+        }
+        forfeited = {item_id: shard.forfeited for item_id, shard in self.shards.items() if shard.forfeited}
+        order_ids = [order_id for _, orders in batch.values() for order_id in orders]
+        settled_items: List[int] = []
+
+        try:
+            async with self.session_factory() as session:
+                async with session.begin():
+                    if order_ids:
+                        _, settled_items = await self._settle_orders(
+                            session,
+                            text("""
+                                SELECT id, item_id, amount FROM orders
+                                WHERE order_id IN :order_ids AND stock_settled = 0
+                                FOR UPDATE
+                            """).bindparams(bindparam('order_ids', expanding=True)),
+                            {"order_ids": order_ids}
+                        )
+
+                    # 配額扣除已售出部分和租約過期時作廢的部分（配額已被回收時沒有對應行）
+                    consumed = {item_id: count for item_id, (count, _) in batch.items() if count}
+                    for item_id, count in forfeited.items():
+                        consumed[item_id] = consumed.get(item_id, 0) + count
+                    if consumed:
+                        case_sql, params = self._case_sql('item_id', consumed)
+                        params.update({"worker_id": self.worker_id, "item_ids": list(consumed)})
+                        await session.execute(
+                            text(f"""
+                                UPDATE stock_allocations SET quota = quota - {case_sql}
+                                WHERE worker_id = :worker_id AND item_id IN :item_ids
+                            """).bindparams(bindparam('item_ids', expanding=True)),
+                            params
+                        )
+
+                    await session.execute(
+                        text("UPDATE stock_allocations SET heartbeat_at = :now WHERE worker_id = :worker_id"),
+                        {"now": datetime.utcnow(), "worker_id": self.worker_id}
+                    )
+
+                    result = await session.execute(
+                        text("SELECT item_id FROM stock_allocations WHERE worker_id = :worker_id"),
+                        {"worker_id": self.worker_id}
+                    )
+                    held_items = {row[0] for row in result}
+
+        except Exception as e:
+            # 心跳未更新，租約到期後 reserve 會停止使用內存配額
+            logger.error(f"回寫庫存帳本失敗: {e}")
+            return
+
+        self._notify_settled(settled_items)
+
+        # 回寫成功後再從內存移除
+        for item_id, (count, orders) in batch.items():
+            shard = self.shards[item_id]
+            shard.consumed -= count
+            del shard.pending_orders[:len(orders)]
+
+        for item_id, shard in self.shards.items():
+            shard.forfeited -= forfeited.get(item_id, 0)
+            if item_id in held_items:
+                # 心跳已在本次事務中更新，租約續期
+                shard.heartbeat_at = max(shard.heartbeat_at, heartbeat_started)
+            else:
+                # 配額已被對帳回收（例如心跳超時），停止銷售該配額
+                if shard.quota:
+                    logger.warning(f"商品 {item_id} 的庫存配額已被回收，重新申請")
+                    shard.quota = 0
+                    shard.exhausted_until = 0.0
+                if shard.heartbeat_at <= heartbeat_started:
+                    shard.heartbeat_at = 0.0
+            if shard.lapsed and not shard.forfeited:
+                shard.lapsed = False
+                logger.info(f"商品 {item_id} 的配額租約已恢復")
+
+        # 已退出帳本的商品在配額和待結算訂單都回寫後移除
+        for item_id in [item_id for item_id, shard in self.shards.items()
+                        if shard.retired and not (shard.forfeited or shard.consumed or shard.pending_orders)]:
+            del self.shards[item_id]
+
+        self.flushes += 1
+        self.last_flush_ms = (time.perf_counter() - started) * 1000
+
+    async def reconcile(self, include_own: bool = False):
+        """對帳：回收失聯進程的配額並結算所有未回寫的訂單"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.stale_after)
+        # 啟動時本進程不應持有任何配額，沿用舊 worker_id 重啟時一併回收
+        own_worker_id = self.worker_id if include_own else None
+
+        async with self.session_factory() as session:
+            async with session.begin():
+                # 先結算訂單，再刪除配額，兩者在同一事務內，避免超賣
+                settled, settled_items = await self._settle_orders(
+                    session,
+                    text("SELECT id, item_id, amount FROM orders WHERE stock_settled = 0 FOR UPDATE"),
+                    {}
+                )
+
+                result = await session.execute(
+                    text("""
+                        DELETE FROM stock_allocations
+                        WHERE heartbeat_at < :cutoff OR worker_id = :worker_id
+                    """),
+                    {"cutoff": cutoff, "worker_id": own_worker_id}
+                )
+
+        self._notify_settled(settled_items)
+
+        if settled or result.rowcount:
+            logger.info(f"庫存對帳完成: 結算 {settled} 筆訂單, 回收 {result.rowcount} 份配額")
+
+    async def close(self):
+        """關閉時回寫並歸還未使用的配額"""
+        if not self.loaded:
+            return
+
+        await self.flush()
+
+        try:
+            async with self.session_factory() as session:
+                async with session.begin():
+                    await session.execute(
+                        text("DELETE FROM stock_allocations WHERE worker_id = :worker_id"),
+                        {"worker_id": self.worker_id}
+                    )
+        except Exception as e:
+            logger.error(f"歸還庫存配額失敗: {e}")
+
+        self.loaded = False
+
+    async def _settle_orders(self, session, select_stmt, params: Dict[str, Any]) -> Tuple[int, List[int]]:
+        """把選中且未結算訂單的數量從 items.stock 扣除並標記為已結算，返回訂單數和商品ID"""
+        result = await session.execute(select_stmt, params)
+        rows = result.all()
+        if not rows:
+            return 0, []
+
+        quantities: Dict[int, int] = {}
+        for _, item_id, amount in rows:
+            quantities[item_id] = quantities.get(item_id, 0) + amount
+
+        case_sql, case_params = self._case_sql('id', quantities)
+        case_params["item_ids"] = list(quantities)
+        await session.execute(
+            text(f"UPDATE items SET stock = stock - {case_sql} WHERE id IN :item_ids")
+                .bindparams(bindparam('item_ids', expanding=True)),
+            case_params
+        )
+
+        await session.execute(
+            text("UPDATE orders SET stock_settled = 1 WHERE id IN :ids")
+                .bindparams(bindparam('ids', expanding=True)),
+            {"ids": [row[0] for row in rows]}
+        )
+        return len(rows), list(quantities)
+
+    def _notify_settled(self, item_ids: List[int]):
+        """事務提交後通知庫存已變更"""
+        if item_ids and self.on_settled is not None:
+            try:
+                self.on_settled(item_ids)
+            except Exception as e:
+                logger.error(f"庫存變更回調失敗: {e}")
+
+    @staticmethod
+    def _case_sql(column: str, values: Dict[int, int]):
+        """構建 CASE column WHEN ... THEN ... END 表達式"""
+        params = {}
+        clauses = []
+        for index, (key, value) in enumerate(values.items()):
+            params[f"k{index}"] = key
+            params[f"v{index}"] = value
+            clauses.append(f"WHEN :k{index} THEN :v{index}")
+        return f"CASE {column} {' '.join(clauses)} ELSE 0 END", params
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取統計信息"""
+        return {
+            'worker_id': self.worker_id,
+            'items': len(self.shards),
+            'quota': sum(shard.quota for shard in self.shards.values()),
+            'pending_settlement': sum(len(shard.pending_orders) for shard in self.shards.values()),
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'lapses': self.lapses,
+            'refills': self.refills,
+            'flushes': self.flushes,
+            'last_flush_ms': round(self.last_flush_ms, 2)
+        }
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 發布/訂閱後端測試
+Pub/Sub Backend Tests for 4D Tech Style Auto Sponsorship System
+
+進程內後端的頻道路由；Redis 後端連接本地服務器測試跨 worker 投遞，
+沒有可用的服務器時跳過（TEST_REDIS_URL，默認 redis://localhost:6379/15）。
+"""
+
+import os
+import sys
+import asyncio
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from pubsub import InProcessPubSub, RedisPubSub, create_pubsub  # noqa: E402
+
+TEST_REDIS_URL = os.environ.get('TEST_REDIS_URL', 'redis://localhost:6379/15')
+
+def test_channel_handler_takes_precedence_over_default_handler():
+    async def run():
+        pubsub = InProcessPubSub()
+        default, revocations = [], []
+        pubsub.set_handler(lambda channel, data: default.append((channel, data)))
+        pubsub.add_channel_handler('auth:revoke', lambda channel, data: revocations.append(data))
+        await pubsub.start(['ws:user'])
+
+        await pubsub.publish('auth:revoke', 'abc:1')
+        await pubsub.publish('ws:user', '1:{}')
+        return pubsub, default, revocations
+
+    pubsub, default, revocations = asyncio.run(run())
+    assert revocations == ['abc:1']
+    assert default == [('ws:user', '1:{}')]
+    assert pubsub.get_stats()['channels'] == ['auth:revoke', 'ws:user']
+    assert pubsub.get_stats()['published'] == pubsub.get_stats()['received'] == 2
+
+def test_coroutine_handler_is_scheduled_and_errors_are_contained():
+    async def run():
+        pubsub = InProcessPubSub()
+        received = []
+
+        async def on_message(channel, data):
+            received.append(data)
+
+        def broken(channel, data):
+            raise ValueError("bad message")
+
+        pubsub.set_handler(on_message)
+        pubsub.add_channel_handler('broken', broken)
+        await pubsub.publish('broken', 'x')
+        await pubsub.publish('ws:broadcast', 'y')
+        await asyncio.sleep(0)
+        return received
+
+    assert asyncio.run(run()) == ['y']
+
+def test_create_pubsub_rejects_unknown_backend():
+    assert isinstance(create_pubsub('memory'), InProcessPubSub)
+    with pytest.raises(ValueError):
+        create_pubsub('kafka')
+
+async def _redis_available() -> bool:
+    client = pytest.importorskip('redis.asyncio').from_url(TEST_REDIS_URL)
+    try:
+        return await asyncio.wait_for(client.ping(), timeout=1)
+    except Exception:
+        return False
+    finally:
+        await client.close()
+
+def test_redis_backend_delivers_to_every_subscriber():
+    if not asyncio.run(_redis_available()):
+        pytest.skip(f"沒有可用的 Redis 服務器: {TEST_REDIS_URL}")
+
+    async def run():
+        # 兩個後端實例模擬兩個 worker
+        workers = [RedisPubSub(TEST_REDIS_URL), RedisPubSub(TEST_REDIS_URL)]
+        received = [[], []]
+        for index, pubsub in enumerate(workers):
+            pubsub.set_handler(lambda channel, data, index=index: received[index].append((channel, data)))
+            await pubsub.start(['test:pubsub'])
+        await asyncio.sleep(0.2)  # 等待訂閱生效
+
+        await workers[0].publish('test:pubsub', 'hello')
+        for _ in range(50):
+            if all(received):
+                break
+            await asyncio.sleep(0.05)
+
+        for pubsub in workers:
+            await pubsub.close()
+        return received
+
+    assert asyncio.run(run()) == [[('test:pubsub', 'hello')], [('test:pubsub', 'hello')]]
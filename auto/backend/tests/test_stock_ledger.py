@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 庫存預留帳本測試
+Stock Reservation Ledger Tests for 4D Tech Style Auto Sponsorship System
+
+回寫持續失敗時心跳不再更新，對帳可能已回收本進程的配額；
+租約過期後 reserve 必須拒絕並作廢內存配額，避免超賣。
+"""
+
+import os
+import sys
+import time
+import asyncio
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from stock_ledger import StockLedger, StockShard  # noqa: E402
+
+ITEM_ID = 1
+
+def failing_session_factory():
+    raise ConnectionError("database unavailable")
+
+def make_ledger(heartbeat_age: float) -> StockLedger:
+    ledger = StockLedger(failing_session_factory, worker_id='test', stale_after=60, safety_margin=10)
+    shard = StockShard(ITEM_ID)
+    shard.quota = 20
+    shard.heartbeat_at = time.monotonic() - heartbeat_age
+    ledger.shards[ITEM_ID] = shard
+    ledger.loaded = True
+    return ledger
+
+def test_reserve_uses_quota_while_lease_is_fresh():
+    ledger = make_ledger(heartbeat_age=5)
+
+    assert asyncio.run(ledger.reserve(ITEM_ID, 1)) is True
+    assert ledger.shards[ITEM_ID].quota == 19
+
+def test_reserve_refuses_quota_after_flush_failures():
+    ledger = make_ledger(heartbeat_age=55)
+    shard = ledger.shards[ITEM_ID]
+
+    asyncio.run(ledger.flush())
+    assert asyncio.run(ledger.reserve(ITEM_ID, 1)) is False
+    assert shard.quota == 0
+    assert shard.lapsed
+
+    # 回寫仍然失敗：繼續拒絕，也不向資料庫申請新配額
+    asyncio.run(ledger.flush())
+    assert asyncio.run(ledger.reserve(ITEM_ID, 1)) is False
+    assert shard.quota == 0
+    assert ledger.get_stats()['lapses'] == 1
+
+def test_release_on_lapsed_shard_is_not_resold():
+    ledger = make_ledger(heartbeat_age=55)
+    shard = ledger.shards[ITEM_ID]
+
+    asyncio.run(ledger.reserve(ITEM_ID, 1))
+    ledger.release(ITEM_ID, 3)
+
+    assert shard.quota == 0
+    assert shard.forfeited == 23
+    assert asyncio.run(ledger.reserve(ITEM_ID, 1)) is False
+
+class QuickBuyItemsSession:
+    """只回應速買商品查詢的會話（商品已全部取消速買標記）"""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def execute(self, statement, params=None):
+        return []
+
+def test_sync_items_retires_unflagged_items():
+    ledger = make_ledger(heartbeat_age=5)
+    ledger.session_factory = QuickBuyItemsSession
+    shard = ledger.shards[ITEM_ID]
+
+    asyncio.run(ledger.sync_items())
+
+    assert not ledger.manages(ITEM_ID)
+    assert shard.quota == 0
+    assert shard.forfeited == 20
+    assert asyncio.run(ledger.reserve(ITEM_ID, 1)) is False
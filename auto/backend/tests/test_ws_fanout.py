@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - WebSocket 扇出測試
+WebSocket Fan-out Tests for 4D Tech Style Auto Sponsorship System
+
+同一用戶多個連接的投遞、單連接回覆、本地廣播和慢客戶端處理（進程內發布/訂閱）。
+"""
+
+import os
+import sys
+import json
+import asyncio
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from pubsub import InProcessPubSub  # noqa: E402
+from ws_fanout import ConnectionManager  # noqa: E402
+
+class FakeWebSocket:
+    """記錄收到的消息"""
+
+    def __init__(self):
+        self.sent = []
+        self.closed_with = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, payload: str):
+        self.sent.append(json.loads(payload))
+
+    async def close(self, code: int = 1000, reason: str = ''):
+        self.closed_with = code
+
+    def types(self):
+        return [message['type'] for message in self.sent]
+
+async def drain():
+    """讓各連接的寫入任務把隊列發完"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+def run_with_manager(scenario, **options):
+    async def run():
+        manager = ConnectionManager(pubsub=InProcessPubSub(), **options)
+        await manager.start()
+        try:
+            return await scenario(manager)
+        finally:
+            await manager.stop()
+    return asyncio.run(run())
+
+def test_personal_message_reaches_every_socket_of_the_user_only():
+    async def scenario(manager):
+        tab1, tab2, other = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        await manager.connect(tab1, 1)
+        await manager.connect(tab2, 1)
+        await manager.connect(other, 2)
+
+        await manager.send_personal_message({"type": "quick_buy_result"}, 1)
+        await drain()
+        return tab1, tab2, other
+
+    tab1, tab2, other = run_with_manager(scenario)
+    assert tab1.types() == tab2.types() == ["quick_buy_result"]
+    assert other.sent == []
+
+def test_reply_goes_to_the_requesting_socket_only():
+    async def scenario(manager):
+        tab1, tab2 = FakeWebSocket(), FakeWebSocket()
+        connection = await manager.connect(tab1, 1)
+        await manager.connect(tab2, 1)
+        published = manager.pubsub.published
+
+        manager.reply(connection, {"type": "pong"})
+        await drain()
+        return tab1, tab2, manager.pubsub.published - published
+
+    tab1, tab2, published = run_with_manager(scenario)
+    assert tab1.types() == ["pong"]
+    assert tab2.sent == []
+    assert published == 0
+
+def test_local_broadcast_is_not_published():
+    async def scenario(manager):
+        sockets = [FakeWebSocket(), FakeWebSocket()]
+        for user_id, websocket in enumerate(sockets):
+            await manager.connect(websocket, user_id)
+
+        await manager.broadcast({"type": "system_status"}, local=True)
+        await manager.broadcast({"type": "announcement"})
+        await drain()
+        return sockets, manager.pubsub.published
+
+    sockets, published = run_with_manager(scenario)
+    for websocket in sockets:
+        assert websocket.types() == ["system_status", "announcement"]
+    assert published == 1
+
+def test_disconnect_removes_only_the_given_socket():
+    async def scenario(manager):
+        tab1, tab2 = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(tab1, 1)
+        await manager.connect(tab2, 1)
+        manager.disconnect(1, tab1)
+
+        await manager.send_personal_message({"type": "notification"}, 1)
+        await drain()
+        return tab1, tab2, manager.connection_count()
+
+    tab1, tab2, connections = run_with_manager(scenario)
+    assert tab1.sent == []
+    assert tab2.types() == ["notification"]
+    assert connections == 1
+
+def test_full_queue_coalesces_status_and_drops_slow_consumer():
+    async def scenario(manager):
+        websocket = FakeWebSocket()
+        connection = manager.register(websocket, 1)
+        # 寫入任務尚未運行，消息留在隊列中
+        for index in range(3):
+            manager.broadcast_local(json.dumps({"type": "system_status", "n": index}))
+        coalesced = [entry[1] for entry in connection.queue]
+
+        manager.broadcast_local(json.dumps({"type": "announcement"}))
+        manager.broadcast_local(json.dumps({"type": "announcement"}))
+        await drain()
+        return coalesced, manager.connection_count(), websocket
+
+    coalesced, connections, websocket = run_with_manager(
+        scenario, queue_size=2, coalesce_types=("system_status",)
+    )
+    assert [json.loads(payload)["n"] for payload in coalesced] == [2]
+    assert connections == 0
+    assert websocket.closed_with == 1013
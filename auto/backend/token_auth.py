@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 令牌驗證
+Token Verification for 4D Tech Style Auto Sponsorship System
+
+主要功能:
+- 簽發訪問令牌與刷新令牌（帶 jti 和 typ）
+- 已驗證令牌的摘要 LRU，條目在令牌 exp 時過期，命中時不再解碼簽名
+- 吊銷列表: 進程內 jti -> exp 集合，經發布/訂閱同步到所有 worker，
+  持久化在 revoked_tokens 表中供新啟動的 worker 載入；
+  並定期增量輪詢 revoked_tokens，發布/訂閱為進程內實現或消息丟失時也能同步
+- 刷新令牌輪換（舊刷新令牌使用一次即吊銷，以 revoked_tokens 插入是否成功判定，
+  並發重放同一刷新令牌時只有一個請求能換發）
+"""
+
+import time
+import uuid
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+import jwt
+from sqlalchemy import text
+
+from ttl_cache import TTLCache
+from pubsub import PubSubBackend
+
+logger = logging.getLogger(__name__)
+
+ACCESS_TOKEN = 'access'
+REFRESH_TOKEN = 'refresh'
+
+# 發布/訂閱頻道，消息格式 "{jti}:{exp}"
+REVOCATION_CHANNEL = 'auth:revoke'
+
+class InvalidToken(Exception):
+    """令牌無效、過期、類型不符或已吊銷"""
+
+class TokenClaims(NamedTuple):
+    subject: str
+    jti: Optional[str]       # 舊版令牌沒有 jti，無法吊銷，只能等待過期
+    token_type: str
+    expires_at: float        # Unix 時間戳
+
+class RevocationList:
+    """已吊銷令牌的 jti 集合（條目保留到令牌本身過期）"""
+
+    def __init__(self,
+                 session_factory: Callable,
+                 pubsub: Optional[PubSubBackend] = None,
+                 poll_overlap: float = 60):
+        """
+        poll_overlap: 輪詢時回看的秒數，覆蓋較早開始但較晚提交的插入和時鐘誤差
+        """
+        self.session_factory = session_factory
+        self.pubsub = pubsub
+        self.poll_overlap = poll_overlap
+        self._revoked: Dict[bytes, float] = {}  # jti（16字節）-> exp
+        self._watermark: Optional[datetime] = None  # 已載入記錄中最新的 revoked_at（資料庫時間）
+        if pubsub is not None:
+            pubsub.add_channel_handler(REVOCATION_CHANNEL, self._on_message)
+
+        # 統計信息
+        self.revocations = 0
+        self.polls = 0
+        self.polled = 0
+
+    @staticmethod
+    def _key(jti: str) -> bytes:
+        return bytes.fromhex(jti)
+
+    def is_revoked(self, jti: Optional[str]) -> bool:
+        return jti is not None and self._key(jti) in self._revoked
+
+    def add_local(self, jti: str, expires_at: float):
+        if expires_at > time.time():
+            self._revoked[self._key(jti)] = expires_at
+
+    async def revoke(self, jti: str, expires_at: float, strict: bool = False) -> int:
+        """
+        吊銷令牌：寫入本進程、持久化並通知其他 worker
+
+        返回 INSERT IGNORE 影響的行數，0 表示該令牌已被吊銷過。
+        strict 為 True 時持久化失敗會拋出異常（刷新令牌輪換需要確認插入成功）。
+        """
+        self.add_local(jti, expires_at)
+        self.revocations += 1
+        inserted = 0
+        error = None
+        try:
+            async with self.session_factory() as session:
+                async with session.begin():
+                    result = await session.execute(
+                        text("""
+                            INSERT IGNORE INTO revoked_tokens (jti, expires_at)
+                            VALUES (:jti, :expires_at)
+                        """),
+                        {"jti": jti, "expires_at": datetime.utcfromtimestamp(expires_at)}
+                    )
+                    inserted = result.rowcount
+        except Exception as e:
+            # 已在本進程和其他在線 worker 生效，持久化失敗只影響之後啟動的 worker
+            logger.error(f"持久化令牌吊銷失敗: {e}")
+            error = e
+
+        if self.pubsub is not None:
+            await self.pubsub.publish(REVOCATION_CHANNEL, f"{jti}:{expires_at}")
+
+        if error is not None and strict:
+            raise error
+        return inserted
+
+    def _on_message(self, channel: str, data: str):
+        jti, expires_at = data.split(':', 1)
+        self.add_local(jti, float(expires_at))
+
+    async def _fetch(self, since: Optional[datetime]) -> int:
+        """載入 revoked_at >= since（None 表示全部）且尚未過期的吊銷記錄"""
+        sql = "SELECT jti, expires_at, revoked_at FROM revoked_tokens WHERE expires_at > :now"
+        params = {"now": datetime.utcnow()}
+        if since is not None:
+            sql += " AND revoked_at >= :since"
+            params["since"] = since
+
+        async with self.session_factory() as session:
+            result = await session.execute(text(sql), params)
+            rows = result.fetchall()
+        for jti, expires_at, revoked_at in rows:
+            self.add_local(jti, (expires_at - datetime(1970, 1, 1)).total_seconds())
+            if revoked_at is not None and (self._watermark is None or revoked_at > self._watermark):
+                self._watermark = revoked_at
+        return len(rows)
+
+    async def load(self) -> int:
+        """啟動時載入尚未過期的吊銷記錄"""
+        count = await self._fetch(None)
+        logger.info(f"已載入 {count} 條令牌吊銷記錄")
+        return count
+
+    async def poll(self) -> int:
+        """增量載入其他 worker 寫入的吊銷記錄（重複載入無副作用）"""
+        if self._watermark is None:
+            since = None
+        else:
+            since = self._watermark - timedelta(seconds=self.poll_overlap)
+        try:
+            count = await self._fetch(since)
+        except Exception as e:
+            logger.error(f"輪詢令牌吊銷記錄失敗: {e}")
+            return 0
+        self.polls += 1
+        self.polled += count
+        return count
+
+    async def purge_expired(self) -> int:
+        """清理已過期的吊銷記錄（令牌本身已無法通過驗證）"""
+        now = time.time()
+        expired = [key for key, expires_at in self._revoked.items() if expires_at <= now]
+        for key in expired:
+            del self._revoked[key]
+
+        try:
+            async with self.session_factory() as session:
+                async with session.begin():
+                    await session.execute(
+                        text("DELETE FROM revoked_tokens WHERE expires_at <= :now"),
+                        {"now": datetime.utcnow()}
+                    )
+        except Exception as e:
+            logger.error(f"清理令牌吊銷記錄失敗: {e}")
+        return len(expired)
+
+    def __len__(self) -> int:
+        return len(self._revoked)
+
+class TokenService:
+    """令牌簽發與驗證"""
+
+    def __init__(self,
+                 secret: str,
+                 algorithm: str,
+                 access_ttl: float,
+                 refresh_ttl: float,
+                 revocations: RevocationList,
+                 cache_size: int = 50000):
+        self.secret = secret
+        self.algorithm = algorithm
+        self.access_ttl = access_ttl
+        self.refresh_ttl = refresh_ttl
+        self.revocations = revocations
+        # 摘要 -> TokenClaims；TTL 按每個令牌的剩餘有效期設置
+        self.verified = TTLCache(maxsize=cache_size, ttl=access_ttl, name='verified_tokens')
+
+        # 統計信息
+        self.decodes = 0
+        self.rejected = 0
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return hashlib.blake2b(token.encode('utf-8'), digest_size=16).digest()
+
+    def create(self, subject: str, token_type: str = ACCESS_TOKEN, ttl: Optional[float] = None) -> str:
+        if ttl is None:
+            ttl = self.access_ttl if token_type == ACCESS_TOKEN else self.refresh_ttl
+        payload = {
+            "sub": str(subject),
+            "jti": uuid.uuid4().hex,
+            "typ": token_type,
+            "exp": int(time.time() + ttl)
+        }
+        return jwt.encode(payload, self.secret, algorithm=self.algorithm)
+
+    def issue_pair(self, subject: str) -> Dict[str, Any]:
+        """簽發訪問令牌和刷新令牌"""
+        return {
+            "token": self.create(subject, ACCESS_TOKEN),
+            "refresh_token": self.create(subject, REFRESH_TOKEN),
+            "token_type": "bearer",
+            "expires_in": int(self.access_ttl)
+        }
+
+    def _decode(self, token: str) -> TokenClaims:
+        self.decodes += 1
+        try:
+            payload = jwt.decode(token, self.secret, algorithms=[self.algorithm])
+        except jwt.PyJWTError as e:
+            raise InvalidToken(str(e))
+
+        subject = payload.get("sub")
+        if subject is None:
+            raise InvalidToken("缺少 sub")
+        # 舊版令牌沒有 typ，視為訪問令牌
+        return TokenClaims(
+            subject=str(subject),
+            jti=payload.get("jti"),
+            token_type=payload.get("typ", ACCESS_TOKEN),
+            expires_at=float(payload["exp"])
+        )
+
+    def verify(self, token: str, token_type: str = ACCESS_TOKEN) -> TokenClaims:
+        """驗證令牌，已驗證過的令牌直接從 LRU 返回"""
+        digest = self._digest(token)
+        claims = self.verified.get(digest)
+
+        if claims is None:
+            claims = self._decode(token)
+            if claims.token_type == ACCESS_TOKEN:
+                remaining = claims.expires_at - time.time()
+                if remaining > 0:
+                    self.verified.set(digest, claims, ttl=remaining)
+
+        if claims.token_type != token_type:
+            self.rejected += 1
+            raise InvalidToken("令牌類型不符")
+        if self.revocations.is_revoked(claims.jti):
+            self.rejected += 1
+            raise InvalidToken("令牌已吊銷")
+        return claims
+
+    async def revoke(self, claims: TokenClaims) -> bool:
+        """吊銷令牌，沒有 jti 的舊令牌無法吊銷"""
+        if claims.jti is None:
+            return False
+        await self.revocations.revoke(claims.jti, claims.expires_at)
+        return True
+
+    async def refresh(self, refresh_token: str) -> Dict[str, Any]:
+        """
+        用刷新令牌換取新的令牌對，舊刷新令牌隨即吊銷
+
+        只有成功插入吊銷記錄的請求才換發；其他 worker 尚未收到吊銷消息時，
+        重放的刷新令牌會因插入 0 行被拒絕。無法確認插入時同樣拒絕。
+        """
+        claims = self.verify(refresh_token, REFRESH_TOKEN)
+        if claims.jti is None:
+            self.rejected += 1
+            raise InvalidToken("刷新令牌缺少 jti")
+
+        try:
+            inserted = await self.revocations.revoke(claims.jti, claims.expires_at, strict=True)
+        except Exception:
+            self.rejected += 1
+            raise InvalidToken("無法吊銷刷新令牌")
+        if not inserted:
+            self.rejected += 1
+            raise InvalidToken("刷新令牌已使用")
+        return self.issue_pair(claims.subject)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取統計信息"""
+        stats = self.verified.get_stats()
+        stats.update({
+            'decodes': self.decodes,
+            'rejected': self.rejected,
+            'revoked': len(self.revocations),
+            'revocations': self.revocations.revocations,
+            'revocation_polls': self.revocations.polls
+        })
+        return stats
@@ -12,26 +12,40 @@ USDT Payment Service for 4D Tech Style Auto Sponsorship System
 - USDT支付處理
 - 多網絡支持
 - 地址驗證
-- 交易監控
+- 交易監控（每個網絡一個後台掃描器，見 chain_scanner.py）
 - 自動確認
+- 到期自動過期（時間輪調度，見 expiry_scheduler.py），釋放唯一金額尾數
 """
 
 import os
 import json
-import uuid
 import hashlib
 import logging
 import asyncio
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any, Tuple
+from typing import Dict, List, Optional, Any, Tuple, Callable, Awaitable
 from decimal import Decimal, ROUND_HALF_UP
 from enum import Enum
-import requests
-from web3 import Web3
-from tronpy import Tron
+
+from order_id import generate_order_id
+from pagination import decode_cursor, next_cursor
+from usdt_store import AmountTaken, MemoryUSDTOrderStore, USDTOrderStore
+from amount_allocator import AmountAllocator
+from chain_scanner import ChainSource, ChainWatcher, SimulatedChain, TronGridTransferSource, Web3TransferSource
+from expiry_scheduler import ExpiryScheduler
 
 logger = logging.getLogger(__name__)
 
+# 訂單有效期
+ORDER_TTL_MINUTES = 30
+
+# USDT 代幣精度（6 位小數）
+USDT_DECIMALS = 6
+USDT_PRECISION = Decimal(1).scaleb(-USDT_DECIMALS)
+
+# 唯一金額尾數數量：同一基礎金額最多同時有這麼多未完成訂單（尾數最大 0.000999 USDT）
+AMOUNT_SUFFIX_SLOTS = 1000
+
 class USDTNetwork(Enum):
     """USDT網絡枚舉"""
     ERC20 = "erc20"  # Ethereum
@@ -56,6 +70,7 @@ class USDTConfig:
             'gas_limit': 100000,
             'gas_price': 20,  # Gwei
             'confirmation_blocks': 12,
+            'block_time': 12,  # 秒
             'explorer_url': 'https://etherscan.io/tx/',
             'min_amount': 1,  # USDT
             'max_amount': 10000,  # USDT
@@ -71,6 +86,7 @@ class USDTConfig:
             'energy_limit': 100000,
             'energy_price': 420,  # SUN
             'confirmation_blocks': 19,
+            'block_time': 3,  # 秒
             'explorer_url': 'https://tronscan.org/#/transaction/',
             'min_amount': 1,  # USDT
             'max_amount': 50000,  # USDT
@@ -94,35 +110,61 @@ class USDTConfig:
 class USDTPaymentService:
     """USDT支付服務主類"""
     
-    def __init__(self):
-        """初始化USDT支付服務"""
+    def __init__(self, store: Optional[USDTOrderStore] = None, simulated: bool = False):
+        """初始化USDT支付服務
+
+        store: 訂單存儲，默認為進程內存儲；多 worker 部署時應使用 SQLUSDTOrderStore
+        simulated: 使用本地模擬鏈（離線測試），通過 simulated_chains[network].send() 模擬付款
+        """
         self.config = USDTConfig()
-        self.pending_transactions = {}
-        self.web3 = None
-        self.tron = None
-        self.init_networks()
+        self.store = store or MemoryUSDTOrderStore()
+        self.simulated = simulated
+        self.allocator = AmountAllocator(decimals=USDT_DECIMALS, slots=AMOUNT_SUFFIX_SLOTS)
+        self.simulated_chains: Dict[str, SimulatedChain] = {}
+        self.watchers: Dict[str, ChainWatcher] = {}
+        # 訂單過期時間輪，到期後批量過期並推送
+        self.expiry = ExpiryScheduler('usdt', self.expire_ids)
+        self.on_status_change: Optional[Callable[[Dict], Awaitable[None]]] = None
+        # 鏈客戶端（web3 / tronpy）在首次使用時才導入和創建
+        self._web3 = None
+        self._tron = None
+    
+    def _erc20_configured(self) -> bool:
+        erc20_config = self.config.NETWORK_CONFIG[USDTNetwork.ERC20]
+        return erc20_config['enabled'] and erc20_config['rpc_url'] != 'https://mainnet.infura.io/v3/YOUR_INFURA_KEY'
+    
+    def _trc20_configured(self) -> bool:
+        return self.config.NETWORK_CONFIG[USDTNetwork.TRC20]['enabled']
+    
+    @property
+    def web3(self):
+        """Ethereum 客戶端（未配置 RPC 時為 None）"""
+        if self._web3 is None and self._erc20_configured():
+            from web3 import Web3
+            self._web3 = Web3(Web3.HTTPProvider(self.config.NETWORK_CONFIG[USDTNetwork.ERC20]['rpc_url']))
+            logger.info("Ethereum網絡連接成功")
+        return self._web3
+    
+    @property
+    def tron(self):
+        """Tron 客戶端（未啟用時為 None）"""
+        if self._tron is None and self._trc20_configured():
+            from tronpy import Tron
+            self._tron = Tron(network='mainnet')
+            logger.info("Tron網絡連接成功")
+        return self._tron
     
     def init_networks(self):
-        """初始化網絡連接"""
+        """預先創建網絡連接（可選的預熱，正常使用時按需創建）"""
         try:
-            # 初始化Ethereum連接
-            erc20_config = self.config.NETWORK_CONFIG[USDTNetwork.ERC20]
-            if erc20_config['enabled'] and erc20_config['rpc_url'] != 'https://mainnet.infura.io/v3/YOUR_INFURA_KEY':
-                self.web3 = Web3(Web3.HTTPProvider(erc20_config['rpc_url']))
-                logger.info("Ethereum網絡連接成功")
-            
-            # 初始化Tron連接
-            trc20_config = self.config.NETWORK_CONFIG[USDTNetwork.TRC20]
-            if trc20_config['enabled']:
-                self.tron = Tron(network='mainnet')
-                logger.info("Tron網絡連接成功")
-                
+            self.web3
+            self.tron
         except Exception as e:
             logger.error(f"初始化網絡連接失敗: {e}")
     
     def is_available(self) -> bool:
-        """檢查服務是否可用"""
-        return (self.web3 is not None or self.tron is not None)
+        """檢查服務是否可用（按配置判斷，不觸發客戶端創建）"""
+        return self._erc20_configured() or self._trc20_configured()
     
     def get_supported_networks(self) -> List[Dict]:
         """獲取支持的網絡"""
@@ -143,11 +185,12 @@ class USDTPaymentService:
         
         return networks
     
-    def create_payment_order(self, amount: float, network: str, order_id: str = None) -> Dict:
-        """創建USDT支付訂單"""
+    async def create_payment_order(self, amount: float, network: str, order_id: str = None,
+                                   user_id: Optional[int] = None) -> Dict:
+        """創建USDT支付訂單（user_id 用於推送狀態變更，可為空）"""
         try:
             if not order_id:
-                order_id = f"USDT_{uuid.uuid4().hex[:16].upper()}"
+                order_id = generate_order_id('USDT_')
             
             network_enum = USDTNetwork(network)
             config = self.config.NETWORK_CONFIG[network_enum]
@@ -157,29 +200,35 @@ class USDTPaymentService:
             if amount < config['min_amount'] or amount > config['max_amount']:
                 raise ValueError(f"金額必須在 {config['min_amount']} - {config['max_amount']} USDT之間")
             
-            # 計算手續費
-            fee = amount * config['fee_rate']
-            total_amount = amount + fee
+            # 計算手續費（按代幣精度取整，與 usdt_orders 表的 DECIMAL(18,6) 一致）
+            amount = Decimal(str(amount)).quantize(USDT_PRECISION, rounding=ROUND_HALF_UP)
+            fee = (amount * Decimal(str(config['fee_rate']))).quantize(USDT_PRECISION, rounding=ROUND_HALF_UP)
             
-            # 創建訂單
-            order = {
-                'order_id': order_id,
-                'network': network,
-                'network_name': config['name'],
-                'amount': amount,
-                'fee': fee,
-                'total_amount': total_amount,
-                'wallet_address': wallet_address,
-                'currency': 'USDT',
-                'status': 'pending',
-                'created_at': datetime.now().isoformat(),
-                'expires_at': (datetime.now() + timedelta(minutes=30)).isoformat(),
-                'confirmation_blocks': config['confirmation_blocks'],
-                'explorer_url': config['explorer_url']
-            }
-            
-            # 存儲訂單
-            self.pending_transactions[order_id] = order
+            # 所有訂單付款到同一地址，應付金額加上唯一尾數以便匹配鏈上轉賬
+            now = datetime.now().replace(microsecond=0)
+            row = None
+            for total_amount in self.allocator.candidates(network, amount + fee):
+                try:
+                    row = await self.store.insert({
+                        'order_id': order_id,
+                        'user_id': user_id,
+                        'network': network,
+                        'amount': amount,
+                        'fee': fee,
+                        'total_amount': total_amount,
+                        'wallet_address': wallet_address,
+                        'status': 'pending',
+                        'created_at': now,
+                        'expires_at': now + timedelta(minutes=ORDER_TTL_MINUTES)
+                    })
+                    break
+                except AmountTaken:
+                    self.allocator.collided(network, total_amount)
+            if row is None:
+                raise ValueError("相同金額的待付款訂單過多，請稍後再試或更換金額")
+            self.allocator.reserve(network, row['total_amount'], order_id)
+            self.expiry.schedule(row['id'], row['expires_at'])
+            order = self.present_order(row)
             
             logger.info(f"創建USDT支付訂單: {order_id}, 網絡: {network}, 金額: {amount} USDT")
             
@@ -196,6 +245,31 @@ class USDTPaymentService:
                 'error': str(e)
             }
     
+    def present_order(self, row: Dict) -> Dict:
+        """把存儲的訂單行轉換為接口返回的格式（網絡名稱等展示字段從配置讀取）"""
+        config = self.config.NETWORK_CONFIG[USDTNetwork(row['network'])]
+        order = {
+            'order_id': row['order_id'],
+            'network': row['network'],
+            'network_name': config['name'],
+            'amount': row['amount'],
+            'fee': row['fee'],
+            'total_amount': row['total_amount'],
+            'wallet_address': row['wallet_address'],
+            'currency': 'USDT',
+            'status': row['status'],
+            'created_at': row['created_at'].isoformat(),
+            'expires_at': row['expires_at'].isoformat(),
+            'confirmation_blocks': config['confirmation_blocks'],
+            'explorer_url': config['explorer_url']
+        }
+        if row.get('tx_hash'):
+            order['tx_hash'] = row['tx_hash']
+            order['confirmations'] = row['confirmations']
+        if row.get('cancelled_at'):
+            order['cancelled_at'] = row['cancelled_at'].isoformat()
+        return order
+    
     def generate_payment_instructions(self, order: Dict) -> Dict:
         """生成支付說明"""
         network = order['network']
@@ -226,37 +300,25 @@ class USDTPaymentService:
         return instructions
     
     async def check_payment_status(self, order_id: str) -> Dict:
-        """檢查支付狀態"""
+        """檢查支付狀態（只讀訂單存儲，鏈上轉賬由後台掃描器匹配）"""
         try:
-            if order_id not in self.pending_transactions:
+            row = await self.store.get(order_id)
+            if row is None:
                 return {
                     'success': False,
                     'error': '訂單不存在'
                 }
             
-            order = self.pending_transactions[order_id]
-            network = USDTNetwork(order['network'])
-            
-            # 檢查是否過期
-            expires_at = datetime.fromisoformat(order['expires_at'])
-            if datetime.now() > expires_at:
-                order['status'] = 'expired'
+            # 未收到轉賬且已過期（過期調度最多延遲一個刻度）
+            if row['status'] == 'pending' and datetime.now() > row['expires_at']:
+                await self.expire_ids([row['id']])
                 return {
                     'success': True,
                     'status': 'expired',
                     'message': '訂單已過期'
                 }
             
-            # 根據網絡檢查交易
-            if network == USDTNetwork.ERC20:
-                return await self.check_erc20_transaction(order)
-            elif network == USDTNetwork.TRC20:
-                return await self.check_trc20_transaction(order)
-            else:
-                return {
-                    'success': False,
-                    'error': '不支持的網絡'
-                }
+            return self.status_payload(row)
                 
         except Exception as e:
             logger.error(f"檢查支付狀態失敗: {e}")
@@ -265,62 +327,88 @@ class USDTPaymentService:
                 'error': str(e)
             }
     
-    async def check_erc20_transaction(self, order: Dict) -> Dict:
-        """檢查ERC-20交易"""
-        try:
-            # 這裡需要實現實際的區塊鏈查詢邏輯
-            # 由於需要私鑰和實際的區塊鏈API，這裡提供模擬實現
-            
-            # 模擬檢查邏輯
-            await asyncio.sleep(1)  # 模擬網絡延遲
-            
-            # 檢查錢包餘額變化（實際實現中需要查詢區塊鏈）
-            # 這裡返回模擬結果
-            return {
-                'success': True,
-                'status': 'pending',
-                'message': '等待確認中',
-                'confirmations': 0,
-                'required_confirmations': order['confirmation_blocks']
-            }
-            
-        except Exception as e:
-            logger.error(f"檢查ERC-20交易失敗: {e}")
-            return {
-                'success': False,
-                'error': str(e)
-            }
+    def status_payload(self, row: Dict) -> Dict:
+        """訂單狀態響應（狀態查詢接口和 WebSocket 推送共用）"""
+        config = self.config.NETWORK_CONFIG[USDTNetwork(row['network'])]
+        payload = {
+            'success': True,
+            'order_id': row['order_id'],
+            'status': row['status'],
+            'message': self.config.PAYMENT_STATUS[row['status']],
+            'amount': row['total_amount'],
+            'confirmations': row.get('confirmations') or 0,
+            'required_confirmations': config['confirmation_blocks']
+        }
+        if row.get('tx_hash'):
+            payload['tx_hash'] = row['tx_hash']
+            payload['tx_url'] = config['explorer_url'] + row['tx_hash']
+        return payload
     
-    async def check_trc20_transaction(self, order: Dict) -> Dict:
-        """檢查TRC-20交易"""
-        try:
-            # 這裡需要實現實際的Tron網絡查詢邏輯
-            # 由於需要實際的Tron API，這裡提供模擬實現
-            
-            # 模擬檢查邏輯
-            await asyncio.sleep(1)  # 模擬網絡延遲
-            
-            # 檢查錢包餘額變化（實際實現中需要查詢Tron網絡）
-            # 這裡返回模擬結果
-            return {
-                'success': True,
-                'status': 'pending',
-                'message': '等待確認中',
-                'confirmations': 0,
-                'required_confirmations': order['confirmation_blocks']
-            }
-            
-        except Exception as e:
-            logger.error(f"檢查TRC-20交易失敗: {e}")
-            return {
-                'success': False,
-                'error': str(e)
-            }
+    def _chain_source(self, network: USDTNetwork) -> Optional[ChainSource]:
+        """網絡的鏈上數據源；未配置的網絡返回 None"""
+        config = self.config.NETWORK_CONFIG[network]
+        wallet_address = self.config.WALLET_ADDRESSES[network]
+        
+        if self.simulated:
+            return self.simulated_chains.setdefault(network.value, SimulatedChain())
+        if network == USDTNetwork.ERC20 and self._erc20_configured():
+            return Web3TransferSource(
+                client_factory=lambda: self.web3,
+                contract_address=config['contract_address'],
+                wallet_address=wallet_address,
+                decimals=config['decimals'],
+                lookback_blocks=ORDER_TTL_MINUTES * 60 // config['block_time']
+            )
+        if network == USDTNetwork.TRC20 and self._trc20_configured():
+            return TronGridTransferSource(
+                api_url=config['rpc_url'],
+                contract_address=config['contract_address'],
+                wallet_address=wallet_address,
+                decimals=config['decimals'],
+                lookback_seconds=ORDER_TTL_MINUTES * 60
+            )
+        return None
+    
+    def start_watchers(self, interval: float,
+                       on_status_change: Optional[Callable[[Dict], Awaitable[None]]] = None):
+        """為每個已配置的網絡啟動一個鏈上掃描器（需要在事件循環中調用）"""
+        for network in USDTNetwork:
+            if network.value in self.watchers or not self.config.NETWORK_CONFIG[network]['enabled']:
+                continue
+            source = self._chain_source(network)
+            if source is None:
+                continue
+            watcher = ChainWatcher(
+                network=network.value,
+                source=source,
+                store=self.store,
+                allocator=self.allocator,
+                required_confirmations=self.config.NETWORK_CONFIG[network]['confirmation_blocks'],
+                interval=interval,
+                on_status_change=on_status_change
+            )
+            watcher.start()
+            self.watchers[network.value] = watcher
+            logger.info(f"啟動 {network.value} 鏈上掃描器")
+    
+    async def stop_watchers(self):
+        """停止所有鏈上掃描器"""
+        for watcher in self.watchers.values():
+            await watcher.stop()
+        self.watchers.clear()
+    
+    def get_watcher_stats(self) -> Dict[str, Any]:
+        """各網絡掃描器和唯一金額分配統計"""
+        stats = {network: watcher.get_stats() for network, watcher in self.watchers.items()}
+        stats['amount_allocator'] = self.allocator.get_stats()
+        stats['expiry'] = self.expiry.get_stats()
+        return stats
     
     def validate_address(self, address: str, network: str) -> bool:
         """驗證地址格式"""
         try:
             if network == 'erc20':
+                from web3 import Web3
                 return Web3.is_address(address)
             elif network == 'trc20':
                 return self.tron.is_address(address) if self.tron else False
@@ -337,25 +425,33 @@ class USDTPaymentService:
         except ValueError:
             return None
     
-    def cancel_order(self, order_id: str) -> Dict:
-        """取消訂單"""
+    async def cancel_order(self, order_id: str) -> Dict:
+        """取消訂單（已收到轉賬或已結束的訂單不能取消）"""
         try:
-            if order_id in self.pending_transactions:
-                order = self.pending_transactions[order_id]
-                order['status'] = 'cancelled'
-                order['cancelled_at'] = datetime.now().isoformat()
-                
+            row = await self.store.get(order_id)
+            if row is None:
+                return {
+                    'success': False,
+                    'error': '訂單不存在'
+                }
+            
+            cancelled = await self.store.transition(
+                order_id, 'cancelled', ('pending',), cancelled_at=datetime.now().replace(microsecond=0)
+            )
+            if cancelled:
+                self.allocator.release(row['network'], row['total_amount'])
                 logger.info(f"取消USDT支付訂單: {order_id}")
                 
                 return {
                     'success': True,
                     'message': '訂單已取消'
                 }
-            else:
-                return {
-                    'success': False,
-                    'error': '訂單不存在'
-                }
+            
+            row = await self.store.get(order_id)
+            return {
+                'success': False,
+                'error': f"訂單{self.config.PAYMENT_STATUS[row['status']]}，無法取消"
+            }
                 
         except Exception as e:
             logger.error(f"取消訂單失敗: {e}")
@@ -364,12 +460,47 @@ class USDTPaymentService:
                 'error': str(e)
             }
     
-    def get_order_history(self, limit: int = 50) -> List[Dict]:
-        """獲取訂單歷史"""
+    async def get_order_history(self, limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """按創建時間倒序分頁獲取訂單歷史，返回 (訂單, 下一頁游標)；游標無效時拋出 ValueError"""
+        after = decode_cursor(cursor) if cursor else None
         try:
-            orders = list(self.pending_transactions.values())
-            orders.sort(key=lambda x: x['created_at'], reverse=True)
-            return orders[:limit]
+            rows = await self.store.recent(limit, after)
+            return [self.present_order(row) for row in rows], next_cursor(rows, limit)
         except Exception as e:
             logger.error(f"獲取訂單歷史失敗: {e}")
-            return [] 
\ No newline at end of file
+            return [], None
+    
+    async def expire_orders(self) -> int:
+        """把已過期的待付款訂單標記為 expired（兜底清理，例如其他 worker 停止後遺留的訂單）"""
+        return await self._finish_expired(await self.store.expire_due(datetime.now()))
+    
+    async def expire_ids(self, ids: List[int]) -> int:
+        """過期調度的處理函數：批量過期到期的訂單"""
+        return await self._finish_expired(await self.store.expire_ids(ids, datetime.now()))
+    
+    async def _finish_expired(self, rows: List[Dict]) -> int:
+        """釋放已過期訂單的金額尾數並推送狀態"""
+        for row in rows:
+            self.allocator.release(row['network'], row['total_amount'])
+            if self.on_status_change is not None:
+                try:
+                    await self.on_status_change(row)
+                except Exception as e:
+                    logger.error(f"推送訂單 {row['order_id']} 狀態失敗: {e}")
+        return len(rows)
+    
+    async def start_expiry(self, on_status_change: Optional[Callable[[Dict], Awaitable[None]]] = None,
+                           page_size: int = 10000):
+        """從存儲載入所有待付款訂單的過期時間並啟動過期調度（需要在事件循環中調用）"""
+        self.on_status_change = on_status_change
+        after_id = 0
+        while True:
+            page = await self.store.pending_deadlines(after_id, page_size)
+            if not page:
+                break
+            self.expiry.load(page)
+            after_id = page[-1][0]
+        self.expiry.start_async()
+    
+    async def stop_expiry(self):
+        await self.expiry.stop_async()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - USDT 訂單存儲
+USDT Order Store for 4D Tech Style Auto Sponsorship System
+
+主要功能:
+- usdt_orders 表存儲（按 order_id 唯一索引查找，多 worker 共享，重啟不丟失）
+- 條件狀態轉換（只有處於指定狀態的訂單才會被更新）
+- 按 (created_at, id) 游標分頁的訂單歷史
+- 按 (status, expires_at) 索引批量過期，或按過期調度給出的訂單行 id 批量過期
+- 按網絡讀取所有未完成訂單（鏈上掃描批量匹配）
+- 同一網絡上未完成訂單的應付金額唯一（見 amount_allocator.py）
+- 進程內存儲（開發模式、Flask 應用和腳本）
+"""
+
+import itertools
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text, bindparam
+from sqlalchemy.exc import IntegrityError
+
+from pagination import KEYSET_CONDITION
+
+# 等待付款（pending）或已收到轉賬、等待確認（processing）的訂單
+OPEN_STATUSES = ('pending', 'processing')
+
+ORDER_COLUMNS = (
+    "order_id", "user_id", "network", "amount", "fee", "total_amount", "wallet_address",
+    "status", "created_at", "expires_at"
+)
+
+class AmountTaken(Exception):
+    """同一網絡上已有未完成訂單使用了這個應付金額"""
+
+class USDTOrderStore:
+    """USDT 訂單存儲接口，訂單為 dict（含 id、created_at、expires_at 等列）"""
+
+    name = 'base'
+
+    async def insert(self, order: Dict[str, Any]) -> Dict[str, Any]:
+        """插入訂單；應付金額與同網絡的未完成訂單重複時拋出 AmountTaken"""
+        raise NotImplementedError
+
+    async def get(self, order_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    async def transition(self, order_id: str, to_status: str,
+                         from_statuses: Iterable[str], **fields) -> bool:
+        """訂單處於 from_statuses 之一時改為 to_status，返回是否更新"""
+        raise NotImplementedError
+
+    async def recent(self, limit: int, after: Optional[Tuple[datetime, int]] = None) -> List[Dict[str, Any]]:
+        """按創建時間倒序的一頁訂單，after 為上一頁最後一條的 (created_at, id)"""
+        raise NotImplementedError
+
+    async def open_orders(self, network: str) -> List[Dict[str, Any]]:
+        """某個網絡上等待付款或等待確認的所有訂單（鏈上掃描每輪讀取一次）"""
+        raise NotImplementedError
+
+    async def expire_due(self, now: datetime) -> List[Dict[str, Any]]:
+        """把所有已過期的待付款訂單標記為 expired，返回這些訂單"""
+        raise NotImplementedError
+
+    async def pending_deadlines(self, after_id: int, limit: int) -> List[Tuple[int, datetime]]:
+        """按 id 分頁讀取待付款訂單的 (id, expires_at)，啟動時載入過期調度"""
+        raise NotImplementedError
+
+    async def expire_ids(self, ids: List[int], now: datetime) -> List[Dict[str, Any]]:
+        """把 ids 中仍為 pending 且已到期的訂單標記為 expired，返回這些訂單"""
+        raise NotImplementedError
+
+class MemoryUSDTOrderStore(USDTOrderStore):
+    """進程內存儲（按創建順序保存，歷史查詢從尾部讀取）"""
+
+    name = 'memory'
+
+    def __init__(self):
+        self._orders: Dict[str, Dict[str, Any]] = {}
+        self._by_id: Dict[int, Dict[str, Any]] = {}
+        self._ids = itertools.count(1)
+        # (network, total_amount) -> order_id，只包含未完成訂單
+        self._open_amounts: Dict[Tuple[str, Any], str] = {}
+
+    async def insert(self, order: Dict[str, Any]) -> Dict[str, Any]:
+        if order['order_id'] in self._orders:
+            raise ValueError(f"訂單已存在: {order['order_id']}")
+        amount_key = (order['network'], order['total_amount'])
+        if amount_key in self._open_amounts:
+            raise AmountTaken(order['total_amount'])
+        row = {'tx_hash': None, 'tx_block': None, 'confirmations': 0, 'cancelled_at': None, **order}
+        row['id'] = next(self._ids)
+        self._orders[row['order_id']] = row
+        self._by_id[row['id']] = row
+        self._open_amounts[amount_key] = row['order_id']
+        return dict(row)
+
+    def _release_amount(self, row: Dict[str, Any]):
+        self._open_amounts.pop((row['network'], row['total_amount']), None)
+
+    async def get(self, order_id: str) -> Optional[Dict[str, Any]]:
+        row = self._orders.get(order_id)
+        return dict(row) if row is not None else None
+
+    async def transition(self, order_id: str, to_status: str,
+                         from_statuses: Iterable[str], **fields) -> bool:
+        row = self._orders.get(order_id)
+        if row is None or row['status'] not in set(from_statuses):
+            return False
+        row.update(fields, status=to_status)
+        if to_status not in OPEN_STATUSES:
+            self._release_amount(row)
+        return True
+
+    async def recent(self, limit: int, after: Optional[Tuple[datetime, int]] = None) -> List[Dict[str, Any]]:
+        page = []
+        for row in reversed(self._orders.values()):
+            if after is not None and (row['created_at'], row['id']) >= after:
+                continue
+            page.append(dict(row))
+            if len(page) >= limit:
+                break
+        return page
+
+    async def open_orders(self, network: str) -> List[Dict[str, Any]]:
+        return [
+            dict(row) for row in self._orders.values()
+            if row['network'] == network and row['status'] in OPEN_STATUSES
+        ]
+
+    async def expire_due(self, now: datetime) -> List[Dict[str, Any]]:
+        expired = []
+        for row in self._orders.values():
+            if row['status'] == 'pending' and row['expires_at'] <= now:
+                row['status'] = 'expired'
+                self._release_amount(row)
+                expired.append(dict(row))
+        return expired
+
+    async def pending_deadlines(self, after_id: int, limit: int) -> List[Tuple[int, datetime]]:
+        page = []
+        for row in self._orders.values():
+            if row['id'] > after_id and row['status'] == 'pending':
+                page.append((row['id'], row['expires_at']))
+                if len(page) >= limit:
+                    break
+        return page
+
+    async def expire_ids(self, ids: List[int], now: datetime) -> List[Dict[str, Any]]:
+        expired = []
+        for item_id in ids:
+            row = self._by_id.get(item_id)
+            if row is not None and row['status'] == 'pending' and row['expires_at'] <= now:
+                row['status'] = 'expired'
+                self._release_amount(row)
+                expired.append(dict(row))
+        return expired
+
+class SQLUSDTOrderStore(USDTOrderStore):
+    """usdt_orders 表存儲"""
+
+    name = 'mysql'
+
+    def __init__(self, session_factory: Callable):
+        self.session_factory = session_factory
+
+    async def insert(self, order: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            async with self.session_factory() as session:
+                async with session.begin():
+                    result = await session.execute(
+                        text(f"""
+                            INSERT INTO usdt_orders ({", ".join(ORDER_COLUMNS)})
+                            VALUES ({", ".join(f":{column}" for column in ORDER_COLUMNS)})
+                        """),
+                        {column: order[column] for column in ORDER_COLUMNS}
+                    )
+        except IntegrityError as e:
+            # uk_open_amount 只約束未完成訂單，訂單結束後金額自動釋放
+            if 'uk_open_amount' in str(e.orig):
+                raise AmountTaken(order['total_amount']) from e
+            raise
+        return dict(order, id=result.lastrowid)
+
+    async def get(self, order_id: str) -> Optional[Dict[str, Any]]:
+        async with self.session_factory() as session:
+            result = await session.execute(
+                text("SELECT * FROM usdt_orders WHERE order_id = :order_id"),
+                {"order_id": order_id}
+            )
+            row = result.mappings().first()
+        return dict(row) if row is not None else None
+
+    async def transition(self, order_id: str, to_status: str,
+                         from_statuses: Iterable[str], **fields) -> bool:
+        assignments = "".join(f", {column} = :{column}" for column in fields)
+        statement = text(f"""
+            UPDATE usdt_orders SET status = :to_status{assignments}
+            WHERE order_id = :order_id AND status IN :from_statuses
+        """).bindparams(bindparam("from_statuses", expanding=True))
+
+        async with self.session_factory() as session:
+            async with session.begin():
+                result = await session.execute(statement, {
+                    **fields,
+                    "order_id": order_id,
+                    "to_status": to_status,
+                    "from_statuses": list(from_statuses)
+                })
+        return result.rowcount > 0
+
+    async def recent(self, limit: int, after: Optional[Tuple[datetime, int]] = None) -> List[Dict[str, Any]]:
+        values: Dict[str, Any] = {"limit": limit}
+        keyset = ""
+        if after is not None:
+            keyset = f"WHERE {KEYSET_CONDITION}"
+            values.update({"cursor_created_at": after[0], "cursor_id": after[1]})
+
+        async with self.session_factory() as session:
+            result = await session.execute(
+                text(f"""
+                    SELECT * FROM usdt_orders {keyset}
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT :limit
+                """),
+                values
+            )
+            return [dict(row) for row in result.mappings()]
+
+    async def open_orders(self, network: str) -> List[Dict[str, Any]]:
+        async with self.session_factory() as session:
+            result = await session.execute(
+                text("""
+                    SELECT * FROM usdt_orders
+                    WHERE status IN ('pending', 'processing') AND network = :network
+                """),
+                {"network": network}
+            )
+            return [dict(row) for row in result.mappings()]
+
+    async def expire_due(self, now: datetime) -> List[Dict[str, Any]]:
+        return await self._expire_selected(
+            text("""
+                SELECT * FROM usdt_orders
+                WHERE status = 'pending' AND expires_at <= :now
+                FOR UPDATE
+            """),
+            {"now": now}
+        )
+
+    async def pending_deadlines(self, after_id: int, limit: int) -> List[Tuple[int, datetime]]:
+        async with self.session_factory() as session:
+            result = await session.execute(
+                text("""
+                    SELECT id, expires_at FROM usdt_orders
+                    WHERE status = 'pending' AND id > :after_id
+                    ORDER BY id LIMIT :limit
+                """),
+                {"after_id": after_id, "limit": limit}
+            )
+            return [(row.id, row.expires_at) for row in result]
+
+    async def expire_ids(self, ids: List[int], now: datetime) -> List[Dict[str, Any]]:
+        if not ids:
+            return []
+        return await self._expire_selected(
+            text("""
+                SELECT * FROM usdt_orders
+                WHERE id IN :ids AND status = 'pending' AND expires_at <= :now
+                FOR UPDATE
+            """).bindparams(bindparam("ids", expanding=True)),
+            {"ids": ids, "now": now}
+        )
+
+    async def _expire_selected(self, select, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """在同一事務中鎖定選中的訂單並標記為 expired，返回這些訂單（用於釋放金額和推送）"""
+        update = text(
+            "UPDATE usdt_orders SET status = 'expired' WHERE id IN :ids"
+        ).bindparams(bindparam("ids", expanding=True))
+
+        async with self.session_factory() as session:
+            async with session.begin():
+                rows = [dict(row) for row in (await session.execute(select, params)).mappings()]
+                if rows:
+                    await session.execute(update, {"ids": [row['id'] for row in rows]})
+        for row in rows:
+            row['status'] = 'expired'
+        return rows
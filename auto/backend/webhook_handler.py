@@ -10,6 +10,7 @@ Webhook Handler for 4D Tech Style Auto Sponsorship System
 - 更新訂單狀態
 - 發送WebSocket通知
 - 記錄交易日誌
+- WebhookHandler: main_app.py 直接路由使用的回調處理器（支付閘道顯式傳入）
 """
 
 import os
@@ -302,6 +303,11 @@ def process_payment_result(result: Dict) -> Dict:
             # 提交事務
             conn.commit()
             
+            # 丟棄輪詢緩存的服務商狀態，下次查詢讀到回調後的狀態
+            payment_gateway = getattr(current_app, 'payment_gateway', None)
+            if payment_gateway:
+                payment_gateway.invalidate_payment_status(order_id)
+            
             # 發送WebSocket通知
             if ws_manager:
                 # 發送給用戶
@@ -350,7 +356,70 @@ def process_payment_result(result: Dict) -> Dict:
         }
 
 # 註冊藍圖
-def register_webhook_handlers(app):
-    """註冊回調處理器"""
+def register_webhook_handlers(app, payment_gateway=None):
+    """註冊回調處理器（藍圖通過 current_app.payment_gateway 取得支付閘道）"""
+    if payment_gateway is not None:
+        app.payment_gateway = payment_gateway
     app.register_blueprint(webhook_bp, url_prefix='/webhook')
-    logger.info("支付回調處理器註冊成功")
\ No newline at end of file
+    logger.info("支付回調處理器註冊成功")
+
+class WebhookHandler:
+    """
+    main_app.py /webhook/<服務商> 路由使用的回調處理器
+
+    驗證和更新訂單由 PaymentGateway.process_payment_callback 完成（更新後丟棄輪詢緩存的
+    服務商狀態），成功後通過 notify 推送訂單狀態。
+    """
+
+    # 各服務商要求的響應: (成功內容, 失敗內容, 失敗狀態碼)
+    RESPONSES = {
+        'speedpay': ("success", "處理失敗", 500),
+        'ecpay': ("1|OK", "0|處理失敗", 200),       # 綠界要求返回200狀態碼
+        'newebpay': ("SUCCESS", "FAIL", 200),       # 藍新要求返回200狀態碼
+    }
+
+    def __init__(self, payment_gateway, notify: Optional[Callable[[Dict[str, Any]], None]] = None):
+        self.payment_gateway = payment_gateway
+        self.notify = notify
+
+        # 統計信息
+        self.received = 0
+        self.failed = 0
+
+    def handle_speedpay_callback(self, req) -> Response:
+        return self._handle('speedpay', req)
+
+    def handle_ecpay_callback(self, req) -> Response:
+        return self._handle('ecpay', req)
+
+    def handle_newebpay_callback(self, req) -> Response:
+        return self._handle('newebpay', req)
+
+    def _handle(self, provider: str, req) -> Response:
+        success_body, failure_body, failure_status = self.RESPONSES[provider]
+        self.received += 1
+        try:
+            callback_data = req.get_json(silent=True) if req.is_json else req.form.to_dict()
+            result = self.payment_gateway.process_payment_callback(provider, callback_data or {})
+        except Exception as e:
+            logger.error(f"處理 {provider} 回調異常: {e}")
+            result = {'success': False, 'message': str(e)}
+
+        if not result['success']:
+            self.failed += 1
+            logger.error(f"處理 {provider} 回調失敗: {result.get('message')}")
+            return Response(failure_body, status=failure_status)
+
+        if self.notify is not None:
+            try:
+                self.notify({'order_id': result['order_id'], 'status': result['status']})
+            except Exception as e:
+                logger.error(f"推送訂單 {result['order_id']} 狀態失敗: {e}")
+        return Response(success_body, status=200)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取統計信息"""
+        return {
+            'received': self.received,
+            'failed': self.failed
+        }
\ No newline at end of file
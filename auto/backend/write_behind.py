@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - 延遲批量寫入
+Write-Behind Batching for 4D Tech Style Auto Sponsorship System
+
+主要功能:
+- 有界異步寫入隊列（隊列滿時寫入方等待，形成背壓）
+- 按數量或時間觸發批量回寫
+- 按記錄類型分派到批量寫入處理器
+- 批量寫入失敗時對半拆分重試，只丟棄單獨寫入仍失敗的記錄
+- 關閉時回寫剩餘記錄
+- 隊列深度與回寫延遲統計
+"""
+
+import time
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+BatchHandler = Callable[[List[Dict[str, Any]]], Awaitable[None]]
+
+def build_values_clause(columns: Sequence[str], rows: Sequence[Dict[str, Any]]) -> Tuple[str, Dict[str, Any]]:
+    """構建多行 VALUES (...), (...) 子句及其參數"""
+    params: Dict[str, Any] = {}
+    groups = []
+    for index, row in enumerate(rows):
+        placeholders = []
+        for column in columns:
+            name = f"{column}_{index}"
+            params[name] = row.get(column)
+            placeholders.append(f":{name}")
+        groups.append(f"({', '.join(placeholders)})")
+    return ', '.join(groups), params
+
+class WriteBehindQueue:
+    """延遲批量寫入隊列"""
+
+    def __init__(self,
+                 max_size: int = 10000,
+                 batch_size: int = 500,
+                 flush_interval: float = 1.0,
+                 name: str = 'write_behind'):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.name = name
+        self.handlers: Dict[str, BatchHandler] = {}
+
+        self._queue: asyncio.Queue = None
+        self._batch_ready: asyncio.Event = None
+        self._flush_lock: asyncio.Lock = None
+        self._task: asyncio.Task = None
+        self._stopping = False
+
+        # 統計信息
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.splits = 0
+        self.backpressure_waits = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def register(self, kind: str, handler: BatchHandler):
+        """註冊某類記錄的批量寫入處理器"""
+        self.handlers[kind] = handler
+
+    def start(self):
+        """啟動後台回寫任務（需在事件循環內調用）"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._batch_ready = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"延遲寫入隊列 {self.name} 已啟動 (容量 {self.max_size}, 批量 {self.batch_size})")
+
+    async def stop(self):
+        """停止後台任務並回寫剩餘記錄"""
+        if not self.running:
+            return
+
+        # 不取消任務：已從隊列取出的批次正在寫入，取消會丟失這些記錄
+        self._stopping = True
+        self._batch_ready.set()
+        await self._task
+
+        await self.flush()
+        self._task = None
+        logger.info(f"延遲寫入隊列 {self.name} 已停止")
+
+    async def put(self, kind: str, record: Dict[str, Any]):
+        """加入一條待寫入記錄，隊列滿時等待"""
+        if not self.running:
+            # 未啟動（例如腳本直接調用）時同步寫入
+            await self._write(kind, [record])
+            return
+
+        if self._queue.full():
+            self.backpressure_waits += 1
+        await self._queue.put((kind, record))
+        self.enqueued += 1
+
+        if self._queue.qsize() >= self.batch_size:
+            self._batch_ready.set()
+
+    async def _run(self):
+        """按時間或數量觸發回寫，stop() 設置標誌後在兩次回寫之間退出"""
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._batch_ready.clear()
+
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"延遲寫入隊列 {self.name} 回寫失敗: {e}")
+
+    async def flush(self):
+        """回寫隊列中的全部記錄"""
+        if self._queue is None:
+            return
+
+        async with self._flush_lock:
+            while not self._queue.empty():
+                started = time.perf_counter()
+
+                batches: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+                for _ in range(min(self.batch_size, self._queue.qsize())):
+                    kind, record = self._queue.get_nowait()
+                    batches[kind].append(record)
+
+                for kind, records in batches.items():
+                    await self._write(kind, records)
+
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                self.flushes += 1
+                self.last_flush_ms = elapsed_ms
+                self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+
+    async def _write(self, kind: str, records: List[Dict[str, Any]]):
+        """調用處理器寫入一批記錄；失敗時對半拆分重試，單條仍失敗時記錄日誌並丟棄"""
+        handler = self.handlers.get(kind)
+        if handler is None:
+            logger.error(f"延遲寫入隊列 {self.name} 缺少處理器: {kind}")
+            self.dropped += len(records)
+            return
+
+        try:
+            await handler(records)
+            self.written += len(records)
+        except Exception as e:
+            if len(records) == 1:
+                logger.error(f"寫入 {kind} 失敗，丟棄記錄 {records[0]}: {e}")
+                self.dropped += 1
+                return
+            # 多行寫入中的一條壞記錄（例如外鍵不存在）不應連累整批
+            logger.warning(f"批量寫入 {kind} 失敗 ({len(records)} 條)，拆分重試: {e}")
+            self.splits += 1
+            middle = len(records) // 2
+            await self._write(kind, records[:middle])
+            await self._write(kind, records[middle:])
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取統計信息"""
+        return {
+            'name': self.name,
+            'running': self.running,
+            'depth': self._queue.qsize() if self._queue is not None else 0,
+            'max_size': self.max_size,
+            'batch_size': self.batch_size,
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'splits': self.splits,
+            'backpressure_waits': self.backpressure_waits,
+            'flushes': self.flushes,
+            'last_flush_ms': round(self.last_flush_ms, 2),
+            'max_flush_ms': round(self.max_flush_ms, 2)
+        }
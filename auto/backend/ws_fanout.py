@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+4D科技風格自動贊助系統 - WebSocket 扇出
+WebSocket Fan-out for 4D Tech Style Auto Sponsorship System
+
+主要功能:
+- 每條消息只序列化一次
+- 每個連接獨立的有界發送隊列和寫入任務，廣播不等待任何客戶端
+- 慢客戶端策略: 可合併的消息類型只保留最新一條，其餘消息隊列滿或發送超時時斷開該客戶端
+- 同一用戶可同時持有多個連接（多個分頁）
+- 通過發布/訂閱後端把消息路由到持有連接的 worker
+- 回覆單個連接的消息（握手、pong）和各 worker 自行產生的消息只在本地投遞
+- 扇出統計
+"""
+
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import fast_json
+from pubsub import PubSubBackend, InProcessPubSub
+
+logger = logging.getLogger(__name__)
+
+# 慢客戶端被斷開時使用的關閉碼（Try Again Later）
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+# 發布/訂閱頻道
+USER_CHANNEL = 'ws:user'            # 消息格式 "{user_id}:{payload}"
+BROADCAST_CHANNEL = 'ws:broadcast'  # 消息為已序列化的 payload
+
+class OutboundConnection:
+    """單個 WebSocket 連接的發送隊列與寫入任務"""
+
+    def __init__(self, websocket, user_id: int, owner: 'ConnectionManager'):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.owner = owner
+        self.queue: deque = deque()                 # 元素為 [coalesce_key, payload]
+        self.pending: Dict[str, list] = {}          # 可合併消息類型 -> 隊列中的元素
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.task = asyncio.create_task(self._writer())
+
+    def enqueue(self, payload: str, coalesce_key: Optional[str] = None) -> bool:
+        """加入發送隊列，返回是否接受"""
+        if self.closed:
+            return False
+
+        # 同類型的舊消息尚未發出，直接替換為最新內容
+        if coalesce_key is not None:
+            entry = self.pending.get(coalesce_key)
+            if entry is not None:
+                entry[1] = payload
+                self.owner.coalesced += 1
+                return True
+
+        if len(self.queue) >= self.owner.queue_size:
+            if coalesce_key is not None:
+                # 可合併的狀態消息允許丟棄，客戶端下次更新時會收到
+                self.owner.dropped_messages += 1
+                return False
+            self.owner.drop_slow_consumer(self, "發送隊列已滿")
+            return False
+
+        entry = [coalesce_key, payload]
+        self.queue.append(entry)
+        if coalesce_key is not None:
+            self.pending[coalesce_key] = entry
+        self.ready.set()
+        return True
+
+    async def _writer(self):
+        """依序把隊列中的消息寫入 WebSocket"""
+        try:
+            while not self.closed:
+                await self.ready.wait()
+                while self.queue and not self.closed:
+                    entry = self.queue.popleft()
+                    coalesce_key, payload = entry
+                    if coalesce_key is not None and self.pending.get(coalesce_key) is entry:
+                        del self.pending[coalesce_key]
+
+                    try:
+                        await asyncio.wait_for(
+                            self.websocket.send_text(payload),
+                            timeout=self.owner.send_timeout
+                        )
+                        self.owner.sent += 1
+                    except asyncio.TimeoutError:
+                        self.owner.drop_slow_consumer(self, "發送超時")
+                        return
+                    except Exception as e:
+                        logger.error(f"發送消息給用戶 {self.user_id} 失敗: {e}")
+                        self.owner.disconnect(self.user_id, self.websocket)
+                        return
+                self.ready.clear()
+        except asyncio.CancelledError:
+            pass
+
+    def close(self):
+        """停止寫入任務並丟棄未發送的消息"""
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        self.pending.clear()
+        # 喚醒寫入任務，即使取消信號被吞掉也能退出
+        self.ready.set()
+        if not self.task.done() and self.task is not asyncio.current_task():
+            self.task.cancel()
+
+class ConnectionManager:
+    """WebSocket 連接管理與消息扇出"""
+
+    def __init__(self,
+                 queue_size: int = 100,
+                 send_timeout: float = 5.0,
+                 coalesce_types: Iterable[str] = ('system_status',),
+                 pubsub: PubSubBackend = None):
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.coalesce_types = set(coalesce_types)
+        self.active_connections: Dict[int, Set[OutboundConnection]] = {}
+
+        # 所有發送都經過發布/訂閱，由持有連接的 worker 投遞
+        self.pubsub = pubsub or InProcessPubSub()
+        self.pubsub.set_handler(self._on_message)
+
+        # 統計信息
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped_messages = 0
+        self.slow_consumers = 0
+        self.broadcasts = 0
+        self.last_broadcast_ms = 0.0
+
+    async def connect(self, websocket, user_id: int) -> OutboundConnection:
+        await websocket.accept()
+        connection = self.register(websocket, user_id)
+        logger.info(f"用戶 {user_id} WebSocket 已連接")
+        return connection
+
+    async def start(self):
+        """訂閱跨 worker 的消息頻道"""
+        await self.pubsub.start([USER_CHANNEL, BROADCAST_CHANNEL])
+
+    async def stop(self):
+        """關閉所有連接並停止訂閱"""
+        await self.close_all()
+        await self.pubsub.close()
+
+    def register(self, websocket, user_id: int) -> OutboundConnection:
+        """登記已接受的連接，同一用戶可以有多個連接"""
+        connection = OutboundConnection(websocket, user_id, self)
+        self.active_connections.setdefault(user_id, set()).add(connection)
+        return connection
+
+    def disconnect(self, user_id: int, websocket=None):
+        """移除連接；未指定 websocket 時移除該用戶的全部連接"""
+        connections = self.active_connections.get(user_id)
+        if not connections:
+            return
+
+        removed = [c for c in connections if websocket is None or c.websocket is websocket]
+        for connection in removed:
+            connections.discard(connection)
+            connection.close()
+        if not connections:
+            del self.active_connections[user_id]
+        if removed:
+            logger.info(f"用戶 {user_id} WebSocket 已斷開 ({len(removed)} 個連接)")
+
+    def drop_slow_consumer(self, connection: OutboundConnection, reason: str):
+        """斷開跟不上的客戶端"""
+        self.slow_consumers += 1
+        logger.warning(f"用戶 {connection.user_id} WebSocket {reason}，斷開慢客戶端")
+        self.disconnect(connection.user_id, connection.websocket)
+        asyncio.create_task(self._close_socket(connection.websocket))
+
+    async def _close_socket(self, websocket):
+        try:
+            await asyncio.wait_for(
+                websocket.close(code=SLOW_CONSUMER_CLOSE_CODE, reason="客戶端接收過慢"),
+                timeout=self.send_timeout
+            )
+        except Exception:
+            pass
+
+    def _coalesce_key(self, message: Dict[str, Any]) -> Optional[str]:
+        message_type = message.get('type')
+        return message_type if message_type in self.coalesce_types else None
+
+    async def send_personal_message(self, message: dict, user_id: int):
+        """發送給用戶的所有連接（可能在其他 worker 上）"""
+        await self.pubsub.publish(USER_CHANNEL, f"{user_id}:{fast_json.dumps_str(message)}")
+
+    def reply(self, connection: OutboundConnection, message: dict) -> bool:
+        """只發送給指定連接（握手、pong 等回覆），不經過發布/訂閱"""
+        return connection.enqueue(fast_json.dumps_str(message), self._coalesce_key(message))
+
+    async def broadcast(self, message: dict, local: bool = False):
+        """
+        序列化一次後發布給所有 worker
+
+        local: 只投遞給本 worker 的連接。每個 worker 都會產生的消息（例如定時的系統狀態）
+               使用本地投遞，否則多 worker 部署時每個客戶端會收到 worker 數量份
+        """
+        payload = fast_json.dumps_str(message)
+        if local:
+            self.broadcast_local(payload)
+        else:
+            await self.pubsub.publish(BROADCAST_CHANNEL, payload)
+
+    def _on_message(self, channel: str, data: str):
+        """收到發布/訂閱消息，投遞給本 worker 持有的連接"""
+        if channel == USER_CHANNEL:
+            user_id, payload = data.split(':', 1)
+            self.deliver_local(int(user_id), payload)
+        elif channel == BROADCAST_CHANNEL:
+            self.broadcast_local(payload=data)
+
+    def _coalesce_key_of(self, payload: str) -> Optional[str]:
+        # 只在配置了可合併類型時解析消息類型
+        if not self.coalesce_types:
+            return None
+        return self._coalesce_key(fast_json.loads(payload))
+
+    def deliver_local(self, user_id: int, payload: str) -> int:
+        """放入本 worker 上該用戶所有連接的隊列"""
+        connections = self.active_connections.get(user_id)
+        if not connections:
+            return 0
+        coalesce_key = self._coalesce_key_of(payload)
+        return sum(1 for connection in list(connections) if connection.enqueue(payload, coalesce_key))
+
+    def broadcast_local(self, payload: str) -> int:
+        """放入本 worker 所有連接的隊列，返回接受的連接數"""
+        started = time.perf_counter()
+        coalesce_key = self._coalesce_key_of(payload)
+
+        accepted = 0
+        for connections in list(self.active_connections.values()):
+            for connection in list(connections):
+                if connection.enqueue(payload, coalesce_key):
+                    accepted += 1
+
+        self.broadcasts += 1
+        self.last_broadcast_ms = (time.perf_counter() - started) * 1000
+        return accepted
+
+    def connection_count(self) -> int:
+        return sum(len(connections) for connections in self.active_connections.values())
+
+    def queued_messages(self) -> int:
+        return sum(
+            len(connection.queue)
+            for connections in self.active_connections.values()
+            for connection in connections
+        )
+
+    async def close_all(self):
+        """關閉所有連接的寫入任務"""
+        connections: List[OutboundConnection] = [
+            connection for group in self.active_connections.values() for connection in group
+        ]
+        self.active_connections.clear()
+        for connection in connections:
+            connection.close()
+        await asyncio.gather(*(connection.task for connection in connections), return_exceptions=True)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """獲取統計信息"""
+        return {
+            'users': len(self.active_connections),
+            'connections': self.connection_count(),
+            'queued': self.queued_messages(),
+            'queue_size': self.queue_size,
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'dropped_messages': self.dropped_messages,
+            'slow_consumers': self.slow_consumers,
+            'broadcasts': self.broadcasts,
+            'last_broadcast_ms': round(self.last_broadcast_ms, 2),
+            'pubsub': self.pubsub.get_stats()
+        }
@@ -60,7 +60,8 @@ CREATE TABLE IF NOT EXISTS items (
     INDEX idx_active (is_active),
     INDEX idx_quick_buy (is_quick_buy),
     INDEX idx_price (price),
-    INDEX idx_stock (stock)
+    INDEX idx_stock (stock),
+    INDEX idx_active_created (is_active, created_at, id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- 訂單表
@@ -74,6 +75,7 @@ CREATE TABLE IF NOT EXISTS orders (
     payment_method VARCHAR(50) NOT NULL,
     status ENUM('pending', 'processing', 'completed', 'cancelled', 'failed') DEFAULT 'pending',
     is_quick_buy BOOLEAN DEFAULT FALSE,
+    stock_settled BOOLEAN DEFAULT TRUE,  -- 庫存扣減是否已由庫存帳本回寫
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     completed_at TIMESTAMP NULL,
@@ -89,7 +91,76 @@ CREATE TABLE IF NOT EXISTS orders (
     INDEX idx_status (status),
     INDEX idx_quick_buy (is_quick_buy),
     INDEX idx_created_at (created_at),
-    INDEX idx_payment_method (payment_method)
+    INDEX idx_payment_method (payment_method),
+    INDEX idx_stock_settled (stock_settled),
+    INDEX idx_user_created (user_id, created_at, id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- 庫存配額表（各進程從 items.stock 申請的速買配額）
+CREATE TABLE IF NOT EXISTS stock_allocations (
+    item_id INT NOT NULL,
+    worker_id VARCHAR(100) NOT NULL,
+    quota INT NOT NULL DEFAULT 0,
+    heartbeat_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    
+    PRIMARY KEY (item_id, worker_id),
+    
+    -- 外鍵約束
+    FOREIGN KEY (item_id) REFERENCES items(id) ON DELETE CASCADE,
+    
+    -- 索引
+    INDEX idx_worker_id (worker_id),
+    INDEX idx_heartbeat_at (heartbeat_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- 每日訂單計數匯總表（由應用定期合併增量，避免按 DATE(created_at) 掃描訂單表）
+CREATE TABLE IF NOT EXISTS daily_order_counters (
+    stat_date DATE NOT NULL,
+    counter VARCHAR(50) NOT NULL,
+    value BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    
+    PRIMARY KEY (stat_date, counter)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- 已吊銷令牌表（登出/刷新後的令牌，保留到令牌本身過期）
+CREATE TABLE IF NOT EXISTS revoked_tokens (
+    jti CHAR(32) NOT NULL PRIMARY KEY,
+    expires_at DATETIME NOT NULL,
+    revoked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    
+    -- 索引
+    INDEX idx_expires_at (expires_at),
+    INDEX idx_revoked_at (revoked_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- USDT支付訂單表
+CREATE TABLE IF NOT EXISTS usdt_orders (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    order_id VARCHAR(64) NOT NULL UNIQUE,
+    user_id INT NULL,
+    network VARCHAR(10) NOT NULL,
+    amount DECIMAL(18,6) NOT NULL,
+    fee DECIMAL(18,6) NOT NULL,
+    total_amount DECIMAL(18,6) NOT NULL,
+    wallet_address VARCHAR(64) NOT NULL,
+    status ENUM('pending', 'processing', 'confirmed', 'completed', 'failed', 'expired', 'cancelled') DEFAULT 'pending',
+    tx_hash VARCHAR(100) NULL,
+    tx_block BIGINT NULL,
+    confirmations INT DEFAULT 0,
+    created_at DATETIME NOT NULL,
+    expires_at DATETIME NOT NULL,
+    cancelled_at DATETIME NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    -- 未完成訂單的應付金額（訂單結束後為 NULL，不參與唯一約束）
+    open_amount DECIMAL(18,6) AS (IF(status IN ('pending', 'processing'), total_amount, NULL)) STORED,
+    
+    -- 索引
+    UNIQUE KEY uk_open_amount (network, open_amount),
+    INDEX idx_status_expires (status, expires_at),
+    INDEX idx_created (created_at, id),
+    UNIQUE KEY uk_tx_hash (tx_hash),
+    INDEX idx_network_status (network, status)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- 用戶偏好設置表
@@ -293,6 +364,20 @@ INSERT INTO orders (order_id, user_id, item_id, amount, total_price, payment_met
 ('QB20241201120004', 3, 7, 2, 39.98, 'balance', 'completed', TRUE, NOW() - INTERVAL 1 HOUR),
 ('QB20241201120005', 3, 8, 3, 17.97, 'balance', 'completed', TRUE, NOW() - INTERVAL 30 MINUTE);
 
+-- 回填每日訂單計數
+INSERT INTO daily_order_counters (stat_date, counter, value)
+SELECT stat_date, counter, value FROM (
+    SELECT DATE(created_at) AS stat_date, 'orders_created' AS counter, COUNT(*) AS value
+    FROM orders GROUP BY DATE(created_at)
+    UNION ALL
+    SELECT DATE(completed_at), 'orders_completed', COUNT(*)
+    FROM orders WHERE status = 'completed' AND completed_at IS NOT NULL GROUP BY DATE(completed_at)
+    UNION ALL
+    SELECT DATE(created_at), 'quick_buy_orders', COUNT(*)
+    FROM orders WHERE is_quick_buy = 1 GROUP BY DATE(created_at)
+) AS daily
+ON DUPLICATE KEY UPDATE value = VALUES(value);
+
 -- 插入速買統計數據
 INSERT INTO quick_buy_stats (user_id, item_id, success_count, failed_count, total_amount, total_spent, last_purchase) VALUES
 (2, 1, 3, 0, 15, 150.00, NOW() - INTERVAL 1 DAY),
@@ -482,6 +567,27 @@ BEGIN
 END //
 DELIMITER ;
 
+-- 速買訂單直接以已完成狀態寫入時更新購買歷史緩存
+-- （用戶統計由速買事務自行更新，這裡不重複累加）
+DELIMITER //
+CREATE TRIGGER update_purchase_cache_after_order_insert
+AFTER INSERT ON orders
+FOR EACH ROW
+BEGIN
+    IF NEW.status = 'completed' THEN
+        INSERT INTO purchase_history_cache 
+        (user_id, item_id, purchase_count, last_purchase_price, avg_purchase_amount, preference_score)
+        VALUES (NEW.user_id, NEW.item_id, 1, NEW.total_price / NEW.amount, NEW.amount, 0.5)
+        ON DUPLICATE KEY UPDATE
+            purchase_count = purchase_count + 1,
+            last_purchase_price = NEW.total_price / NEW.amount,
+            avg_purchase_amount = (avg_purchase_amount + NEW.amount) / 2,
+            preference_score = LEAST(1.0, preference_score + 0.1),
+            updated_at = CURRENT_TIMESTAMP;
+    END IF;
+END //
+DELIMITER ;
+
 -- 創建索引優化查詢性能
 CREATE INDEX idx_orders_user_status ON orders(user_id, status);
 CREATE INDEX idx_orders_created_status ON orders(created_at, status);
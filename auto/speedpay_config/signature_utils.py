@@ -19,7 +19,7 @@ import time
 import secrets
 import urllib.parse
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any, Union
+from typing import Callable, Dict, List, Optional, Any, Union
 from enum import Enum
 from Crypto.Cipher import AES
 from Crypto.Random import get_random_bytes
@@ -300,6 +300,14 @@ class SpeedPayEncryption:
 class TokenGenerator:
     """令牌生成器"""
     
+    # 訂單ID生成函數 prefix -> 訂單ID；後端通過 set_order_id_factory 注入共用的生成器
+    order_id_factory: Optional[Callable[[str], str]] = None
+    
+    @classmethod
+    def set_order_id_factory(cls, factory: Optional[Callable[[str], str]]):
+        """設置訂單ID生成函數（例如 backend/order_id.py 的 generate_order_id）"""
+        cls.order_id_factory = factory
+    
     @staticmethod
     def generate_api_token(length: int = 32) -> str:
         """生成API令牌"""
@@ -310,9 +318,11 @@ class TokenGenerator:
         """生成會話令牌"""
         return secrets.token_hex(length)
     
-    @staticmethod
-    def generate_order_id(prefix: str = 'SP') -> str:
-        """生成訂單ID"""
+    @classmethod
+    def generate_order_id(cls, prefix: str = 'SP') -> str:
+        """生成訂單ID（未注入生成函數時使用時間戳加隨機數）"""
+        if cls.order_id_factory is not None:
+            return cls.order_id_factory(prefix)
         timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
         random_part = secrets.token_hex(4).upper()
         return f"{prefix}{timestamp}{random_part}"